@@ -0,0 +1,301 @@
+#!/usr/bin/python
+"""
+This script implements streaming (online) decoding of continuous EEG signals with networks trained on MOABB datasets.
+
+A StreamingDecoder loads a trained network from its experiment directory (the averaged checkpoint, as used for
+testing, or any other checkpoint) and receives continuous multichannel EEG chunks (e.g., from an amplifier or a Lab
+Streaming Layer inlet), stored in a ring buffer. Every hop, the last window of the stream is pre-processed as the
+trials used for training (channel selection, band-pass filtering, resampling and normalization, see
+utils/prepare.py, utils/dataio_iterators.py and MOABBBrain.prepare_inputs in train.py) and decoded into class
+probabilities.
+
+To decode a stream (chunks of shape (n_samples, n_channels) at the original sampling rate of the dataset):
+    decoder = StreamingDecoder.from_exp_dir(exp_dir, ch_names=ch_names, adjacency_mtx=adjacency_mtx, hop=0.1)
+    for chunk in stream:
+        for time, probs in decoder.push(chunk):
+            print(time, probs)
+
+The int8 network saved by quantize.py can be used instead (from_exp_dir(exp_dir, quantized=True), CPU only). The latency
+of the decoder can be measured with utils/benchmark_streaming.py.
+"""
+
+import json
+import os
+from fractions import Fraction
+import numpy as np
+import torch
+from hyperpyyaml import load_hyperpyyaml
+from scipy.signal import resample_poly
+import speechbrain as sb
+from utils.filtering import bandpass_filter
+from utils.montage import MontageIndex
+from utils.quantization import load_quantized_state, quantize_model
+
+# Folder of the experiment directory containing the quantized network (see quantize.py)
+QUANTIZED_FOLDER = "quantized"
+
+
+class RingBuffer(object):
+    """Ring buffer of the last samples of a multichannel stream.
+    Samples are written twice (in two consecutive copies of the buffer), so that the content of the buffer is always
+    available as a contiguous view, without copies.
+
+    Arguments
+    ---------
+    length: int
+        Number of samples kept in the buffer.
+    n_channels: int
+        Number of channels.
+    dtype: str
+        Data type of the buffer.
+
+    Example
+    -------
+    >>> buffer = RingBuffer(3, 1)
+    >>> buffer.write(np.array([[1.0], [2.0], [3.0], [4.0]]))
+    >>> buffer.get()[:, 0].tolist()
+    [2.0, 3.0, 4.0]
+    >>> buffer.n_samples
+    4
+    """
+
+    def __init__(self, length, n_channels, dtype="float32"):
+        self.length = length
+        self.data = np.zeros((2 * length, n_channels), dtype=dtype)
+        self.pos = 0  # position of the oldest sample
+        self.n_samples = 0  # number of samples written so far
+
+    def write(self, x):
+        """Writes the samples x (n_samples, n_channels), overwriting the oldest ones."""
+        self.n_samples += x.shape[0]
+        x = x[-self.length :]
+        n_first = min(x.shape[0], self.length - self.pos)
+        for offset in [0, self.length]:
+            self.data[offset + self.pos : offset + self.pos + n_first] = x[
+                :n_first
+            ]
+            self.data[offset : offset + x.shape[0] - n_first] = x[n_first:]
+        self.pos = (self.pos + x.shape[0]) % self.length
+
+    def is_full(self):
+        """Returns True if the buffer was filled at least once."""
+        return self.n_samples >= self.length
+
+    def get(self):
+        """Returns the samples of the buffer (length, n_channels), from the oldest to the most recent one."""
+        return self.data[self.pos : self.pos + self.length]
+
+
+def load_exp_hparams(exp_dir):
+    """This function loads the hparams of a training (hyperparams.yaml of its experiment directory, with the
+    overrides of the training, including the input shape T and C)."""
+    with open(os.path.join(exp_dir, "hyperparams.yaml")) as fin:
+        hparams = load_hyperpyyaml(fin)
+    hparams["exp_dir"] = exp_dir
+    return hparams
+
+
+def load_checkpoint(hparams, checkpoint=None, device="cpu"):
+    """This function loads the parameters of a trained network (hparams["model"]) from the checkpoints of its
+    experiment directory. By default, the checkpoint used for testing (i.e., the averaged one, selected with test_key as
+    in train.py) is loaded, otherwise the checkpoint whose folder name is checkpoint (e.g., CKPT+2023-01-01+00-00-00+00).
+    """
+    checkpointer = sb.utils.checkpoints.Checkpointer(
+        checkpoints_dir=os.path.join(hparams["exp_dir"], "save"),
+        recoverables={"model": hparams["model"]},
+    )
+    min_key, max_key = None, None
+    if checkpoint is None and hparams["test_key"] == "loss":
+        min_key = hparams["test_key"]
+    elif checkpoint is None:
+        max_key = hparams["test_key"]
+    ckpt = checkpointer.recover_if_possible(
+        min_key=min_key,
+        max_key=max_key,
+        ckpt_predicate=lambda ckpt: checkpoint is None
+        or os.path.basename(ckpt.path) == checkpoint,
+        device=device,
+    )
+    if ckpt is None:
+        raise FileNotFoundError(
+            "No checkpoint found in {0}".format(checkpointer.checkpoints_dir)
+        )
+    return ckpt
+
+
+def load_quantized_model(hparams):
+    """This function loads the int8 network saved by quantize.py in the experiment directory (CPU only)."""
+    quantized_dir = os.path.join(hparams["exp_dir"], QUANTIZED_FOLDER)
+    with open(os.path.join(quantized_dir, "report.json")) as fin:
+        engine = json.load(fin)["engine"]
+    # the int8 layers are created without calibration, their parameters are then loaded
+    qmodel = quantize_model(hparams["model"], engine=engine)
+    load_quantized_state(
+        qmodel,
+        torch.load(
+            os.path.join(quantized_dir, "model.ckpt"), weights_only=False
+        ),
+    )
+    return qmodel.eval()
+
+
+class StreamingDecoder(object):
+    """Decoder of continuous EEG streams with a trained network.
+
+    Chunks of the stream are written in a ring buffer containing the last window of the stream (tmax - tmin seconds)
+    and some padding before it. Every hop, the buffer is pre-processed as the training trials and decoded:
+    - channel selection (the channels sampled around Cz with n_steps_channel_selection, if ch_names are given);
+    - band-pass filtering between fmin and fmax (zero-phase Butterworth filter, see utils/filtering.py), applied on the
+    whole buffer so that the padding absorbs the transients of the filter at the beginning of the window;
+    - resampling from original_sample_rate to sample_rate (polyphase filtering);
+    - normalization (normalize, as in MOABBBrain.prepare_inputs).
+    Note that, differently from the training trials, the samples at the end of the window are filtered without future
+    samples (they are not available yet), thus they can slightly differ from the offline pre-processing.
+
+    Arguments
+    ---------
+    hparams: dict
+        Hparams of the training (see load_exp_hparams).
+    model: torch.nn.Module
+        Trained network (see load_checkpoint).
+    ch_names: list
+        Names of the channels of the stream. If None, the stream contains the C channels of the network (already
+        selected and in the same order as the training trials).
+    adjacency_mtx: np.array
+        Adjacency matrix of the channels of the stream (see utils/prepare.py), needed to select the channels of the
+        network when n_steps_channel_selection is not null.
+    hop: float
+        Time (s) between two consecutive decoded windows.
+    pad: float
+        Time (s) of the stream kept before the decoded window, absorbing the transients of the band-pass filter. If None,
+        3 / fmin seconds (at least 1 s) are kept, as the transients of the high-pass filter last a few periods of fmin.
+    device: str
+        Device of the network.
+    """
+
+    def __init__(
+        self,
+        hparams,
+        model,
+        ch_names=None,
+        adjacency_mtx=None,
+        hop=0.1,
+        pad=None,
+        device="cpu",
+    ):
+        self.hparams = hparams
+        self.device = torch.device(device)
+        self.model = model.to(self.device).eval()
+        self.normalize = hparams.get("normalize")
+        self.srate_in = hparams["original_sample_rate"]
+        self.srate = hparams["sample_rate"]
+        self.fmin, self.fmax = hparams["fmin"], hparams["fmax"]
+        self.T, self.C = hparams["T"], hparams["C"]
+
+        # channels of the stream fed to the network
+        self.idx_channels = np.arange(self.C)
+        n_channels = self.C
+        if ch_names is not None:
+            n_channels = len(ch_names)
+            self.idx_channels = self.get_idx_channels(
+                ch_names, adjacency_mtx, hparams["n_steps_channel_selection"]
+            )
+        if self.idx_channels.shape[0] != self.C:
+            raise ValueError(
+                "The network was trained with {0} channels, {1} channels are selected from the stream".format(
+                    self.C, self.idx_channels.shape[0]
+                )
+            )
+
+        # resampling factors (up / down)
+        ratio = Fraction(self.srate / self.srate_in).limit_denominator(1000)
+        self.up, self.down = ratio.numerator, ratio.denominator
+
+        if pad is None:
+            pad = 1.0 if self.fmin is None else max(1.0, 3.0 / self.fmin)
+        window_length = int(np.ceil(self.T * self.srate_in / self.srate))
+        self.buffer = RingBuffer(
+            window_length + int(round(pad * self.srate_in)), n_channels
+        )
+        self.hop_length = max(1, int(round(hop * self.srate_in)))
+        self.samples_to_hop = self.hop_length
+
+    @staticmethod
+    def get_idx_channels(ch_names, adjacency_mtx, n_steps):
+        """Returns the indices of the channels of the network in the stream (as sampled by sample_channels in
+        utils/dataio_iterators.py, i.e. in the order of ch_names)."""
+        if n_steps is None:
+            return np.arange(len(ch_names))
+        if adjacency_mtx is None:
+            raise ValueError(
+                "adjacency_mtx is needed to select the channels of the stream (n_steps_channel_selection: {0})".format(
+                    n_steps
+                )
+            )
+        return MontageIndex(ch_names, adjacency_mtx).get_neighbourhood(
+            n_steps=n_steps
+        )
+
+    @classmethod
+    def from_exp_dir(
+        cls, exp_dir, checkpoint=None, quantized=False, device="cpu", **kwargs
+    ):
+        """Creates the decoder of a trained network from its experiment directory (see load_checkpoint for
+        checkpoint). If quantized, the int8 network saved by quantize.py is used (on CPU). The other arguments are
+        passed to the decoder."""
+        hparams = load_exp_hparams(exp_dir)
+        if quantized:
+            return cls(hparams, load_quantized_model(hparams), **kwargs)
+        load_checkpoint(hparams, checkpoint=checkpoint, device=device)
+        return cls(hparams, hparams["model"], device=device, **kwargs)
+
+    def reset(self):
+        """Empties the buffer (e.g., at the beginning of a new stream)."""
+        self.buffer = RingBuffer(self.buffer.length, self.buffer.data.shape[1])
+        self.samples_to_hop = self.hop_length
+
+    def push(self, chunk):
+        """Writes a chunk of the stream (n_samples, n_channels) and decodes the windows ending in the chunk (one every
+        hop, once the buffer is full).
+        It returns the list of decoded windows, as tuples (time of the end of the window in the stream (s), class
+        probabilities)."""
+        chunk = np.asarray(chunk, dtype=self.buffer.data.dtype)
+        if chunk.ndim != 2 or chunk.shape[1] != self.buffer.data.shape[1]:
+            raise ValueError(
+                "Chunks must have shape (n_samples, {0}), got {1}".format(
+                    self.buffer.data.shape[1], chunk.shape
+                )
+            )
+        outputs = []
+        start = 0
+        while start < chunk.shape[0]:
+            stop = min(chunk.shape[0], start + self.samples_to_hop)
+            self.buffer.write(chunk[start:stop])
+            self.samples_to_hop -= stop - start
+            start = stop
+            if self.samples_to_hop == 0:
+                self.samples_to_hop = self.hop_length
+                if self.buffer.is_full():
+                    outputs.append(
+                        (self.buffer.n_samples / self.srate_in, self.decode(),)
+                    )
+        return outputs
+
+    def preprocess(self, x):
+        """Pre-processes the content of the buffer (length, n_channels) and returns the network inputs (1, T, C, 1)."""
+        # from (length, n_channels) to (C, length)
+        x = x[:, self.idx_channels].T
+        x = bandpass_filter(x, self.srate_in, self.fmin, self.fmax)
+        if self.up != self.down:
+            x = resample_poly(x, self.up, self.down, axis=-1)
+        x = np.ascontiguousarray(x[:, -self.T :].T, dtype=np.float32)
+        inputs = torch.from_numpy(x)[None, ..., None].to(self.device)
+        if self.normalize is not None:
+            inputs = self.normalize(inputs)
+        return inputs
+
+    @torch.no_grad()
+    def decode(self):
+        """Decodes the last window of the buffer and returns the class probabilities (n_classes,)."""
+        inputs = self.preprocess(self.buffer.get())
+        return torch.exp(self.model(inputs))[0].cpu().numpy()
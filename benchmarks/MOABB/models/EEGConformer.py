@@ -42,6 +42,9 @@ class EEGConformer(torch.nn.Module):
         Number of heads in the transformer module.
     attn_dropout: float
         Dropout probability for the transformer module.
+    attn_use_sdpa: bool
+        If True, attention is computed with the fused torch.nn.functional.scaled_dot_product_attention (when
+        available), otherwise with explicit matrix products and softmax.
     dense_n_neurons: int
         Number of output neurons.
 
@@ -68,6 +71,7 @@ class EEGConformer(torch.nn.Module):
         attn_depth=2,
         attn_heads=2,
         attn_dropout=0.5,
+        attn_use_sdpa=True,
         dense_n_neurons=4,
     ):
         super().__init__()
@@ -95,6 +99,7 @@ class EEGConformer(torch.nn.Module):
             emb_size=self.emb_module.emb_size,
             attn_heads=attn_heads,
             dropout=attn_dropout,
+            use_sdpa=attn_use_sdpa,
         )
 
         # Shape of intermediate feature maps
@@ -263,12 +268,28 @@ class MultiHeadAttention(torch.nn.Module):
         Number of heads in the transformer module.
     dropout: float
         Dropout probability for the transformer module.
+    use_sdpa: bool
+        If True, attention is computed with the fused torch.nn.functional.scaled_dot_product_attention (when
+        available), otherwise with explicit matrix products and softmax.
+
+    Example
+    -------
+    >>> inp_tensor = torch.rand([2, 10, 40])
+    >>> attn = MultiHeadAttention(emb_size=40, num_heads=2, dropout=0.5).eval()
+    >>> out_sdpa = attn(inp_tensor)
+    >>> attn.use_sdpa = False
+    >>> out = attn(inp_tensor)
+    >>> torch.allclose(out_sdpa, out, atol=1e-6)
+    True
     """
 
-    def __init__(self, emb_size, num_heads, dropout):
+    def __init__(self, emb_size, num_heads, dropout, use_sdpa=True):
         super().__init__()
         self.emb_size = emb_size
         self.num_heads = num_heads
+        self.use_sdpa = use_sdpa and hasattr(
+            torch.nn.functional, "scaled_dot_product_attention"
+        )
 
         self.keys = sb.nnet.linear.Linear(
             input_size=emb_size, n_neurons=emb_size, bias=True,
@@ -308,15 +329,28 @@ class MultiHeadAttention(torch.nn.Module):
         )
         values = values.transpose(-2, -3)
 
-        energy = torch.einsum("bhqd, bhkd -> bhqk", queries, keys)
-        if mask is not None:
-            fill_value = torch.finfo(torch.float32).min
-            energy.mask_fill(~mask, fill_value)
+        if self.use_sdpa:
+            # fused attention, without materializing the bhqk energy tensor
+            # energies are scaled by the square root of emb_size (not of the head size, which is the default of
+            # scaled_dot_product_attention), so queries are rescaled accordingly
+            queries = queries * (queries.shape[-1] / self.emb_size) ** (1 / 2)
+            out = torch.nn.functional.scaled_dot_product_attention(
+                queries,
+                keys,
+                values,
+                attn_mask=mask,
+                dropout_p=self.dropout.p if self.training else 0.0,
+            )
+        else:
+            energy = torch.einsum("bhqd, bhkd -> bhqk", queries, keys)
+            if mask is not None:
+                fill_value = torch.finfo(torch.float32).min
+                energy = energy.masked_fill(~mask, fill_value)
 
-        scaling = self.emb_size ** (1 / 2)
-        att = torch.nn.functional.softmax(energy / scaling, dim=-1)
-        att = self.dropout(att)
-        out = torch.einsum("bhal, bhlv -> bhav ", att, values)
+            scaling = self.emb_size ** (1 / 2)
+            att = torch.nn.functional.softmax(energy / scaling, dim=-1)
+            att = self.dropout(att)
+            out = torch.einsum("bhal, bhlv -> bhav ", att, values)
 
         out = out.transpose(1, 2)  # b h n d-> b n h d
         out = out.reshape(
@@ -364,14 +398,20 @@ class TransformerEncoderBlock(torch.nn.Sequential):
     dropout: float
         Dropout probability for the transformer module.
     forward_expansion: int
+    use_sdpa: bool
+        If True, attention is computed with the fused torch.nn.functional.scaled_dot_product_attention.
     """
 
-    def __init__(self, emb_size, attn_heads, dropout, forward_expansion=4):
+    def __init__(
+        self, emb_size, attn_heads, dropout, forward_expansion=4, use_sdpa=True,
+    ):
         super().__init__(
             ResidualAdd(
                 torch.nn.Sequential(
                     torch.nn.LayerNorm(emb_size),
-                    MultiHeadAttention(emb_size, attn_heads, dropout),
+                    MultiHeadAttention(
+                        emb_size, attn_heads, dropout, use_sdpa=use_sdpa
+                    ),
                     torch.nn.Dropout(dropout),
                 )
             ),
@@ -400,12 +440,18 @@ class TransformerEncoder(torch.nn.Sequential):
         Number of heads in the transformer module.
     dropout: float
         Dropout probability for the transformer module.
+    use_sdpa: bool
+        If True, attention is computed with the fused torch.nn.functional.scaled_dot_product_attention.
     """
 
-    def __init__(self, attn_depth, emb_size, attn_heads, dropout):
+    def __init__(
+        self, attn_depth, emb_size, attn_heads, dropout, use_sdpa=True
+    ):
         super().__init__(
             *[
-                TransformerEncoderBlock(emb_size, attn_heads, dropout)
+                TransformerEncoderBlock(
+                    emb_size, attn_heads, dropout, use_sdpa=use_sdpa
+                )
                 for _ in range(attn_depth)
             ]
         )
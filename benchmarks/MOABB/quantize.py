@@ -0,0 +1,161 @@
+#!/usr/bin/python
+"""
+This script implements the post-training int8 quantization of networks trained on MOABB datasets, for CPU inference.
+
+The trained network of an experiment directory (the averaged checkpoint used for testing) is quantized (see
+utils/quantization.py): the convolutional stacks are statically quantized, with activations calibrated on a slice of
+the training set of the fold, and the linear layers are dynamically quantized. The float32 and int8 networks are then
+compared on the test set of the fold (performance metrics), and on single-trial CPU inference (latency and model size).
+
+The quantized network and the report are saved in the quantized folder of the experiment directory, and the quantized
+network can be loaded with load_quantized_model of inference.py.
+
+To quantize the network trained for a specific subject, recording session and training strategy:
+    > python quantize.py results/MotorImagery/BNCI2014001/EEGNet/1986/leave-one-session-out/sub-001/session_E --n_calibration_batches 8
+"""
+
+import argparse
+import json
+import os
+import time
+import numpy as np
+import torch
+from inference import load_checkpoint, load_exp_hparams, QUANTIZED_FOLDER
+from utils.quantization import (
+    get_default_engine,
+    get_model_size,
+    get_quantized_state,
+    quantize_model,
+)
+from train import prepare_datasets
+
+
+def get_inputs(hparams, batch):
+    """This function returns the network inputs of a batch, as in MOABBBrain.prepare_inputs during evaluation."""
+    inputs = batch[0].float()
+    if "normalize" in hparams:
+        inputs = hparams["normalize"](inputs)
+    return inputs
+
+
+@torch.no_grad()
+def evaluate(model, hparams, loader):
+    """This function computes the performance metrics (scalar metrics of hparams["metrics"]) of a network."""
+    y_true, y_pred = [], []
+    for batch in loader:
+        y_pred.append(model(get_inputs(hparams, batch)).argmax(dim=-1))
+        y_true.append(batch[1])
+    y_true, y_pred = torch.cat(y_true).numpy(), torch.cat(y_pred).numpy()
+    stats = {}
+    for metric_key, metric in hparams["metrics"].items():
+        value = metric(y_true=y_true, y_pred=y_pred)
+        if np.ndim(value) == 0:
+            stats[metric_key] = float(value)
+    return stats
+
+
+@torch.no_grad()
+def measure_latency(model, x, n_repeats=100, n_warmup=10):
+    """This function returns the median and the 99th percentile of the inference time (ms) of a network on x."""
+    latencies = []
+    for i in range(n_repeats + n_warmup):
+        start_time = time.perf_counter()
+        model(x)
+        latencies.append((time.perf_counter() - start_time) * 1000)
+    p50, p99 = np.percentile(latencies[n_warmup:], [50, 99])
+    return {"p50": float(p50), "p99": float(p99)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Post-training int8 quantization of a trained network"
+    )
+    parser.add_argument("exp_dir", help="Experiment directory")
+    parser.add_argument(
+        "--checkpoint",
+        default=None,
+        help="Checkpoint folder name (default: the checkpoint used for testing)",
+    )
+    parser.add_argument(
+        "--n_calibration_batches",
+        type=int,
+        default=8,
+        help="Number of training batches used for calibration",
+    )
+    parser.add_argument(
+        "--engine",
+        default=get_default_engine(),
+        choices=torch.backends.quantized.supported_engines,
+        help="Quantized engine (e.g., x86 or fbgemm on x86 CPUs, qnnpack on ARM CPUs)",
+    )
+    parser.add_argument(
+        "--n_repeats",
+        type=int,
+        default=100,
+        help="Number of measured single-trial inferences",
+    )
+    FLAGS = parser.parse_args()
+
+    hparams = load_exp_hparams(FLAGS.exp_dir)
+    load_checkpoint(hparams, checkpoint=FLAGS.checkpoint)
+    model = hparams["model"].eval()
+
+    # fold of the training (same subject, session and data iterator)
+    _, datasets = prepare_datasets(hparams)
+    calibration_batches = [
+        get_inputs(hparams, batch)
+        for _, batch in zip(
+            range(FLAGS.n_calibration_batches), datasets["train"]
+        )
+    ]
+    qmodel = quantize_model(
+        model, calibration_batches=calibration_batches, engine=FLAGS.engine
+    )
+
+    x = get_inputs(hparams, next(iter(datasets["test"])))[:1]
+    report = {"engine": FLAGS.engine, "checkpoint": FLAGS.checkpoint}
+    for name, net in [("float32", model), ("int8", qmodel)]:
+        report[name] = {
+            "test": evaluate(net, hparams, datasets["test"]),
+            "latency_ms": measure_latency(net, x, n_repeats=FLAGS.n_repeats),
+            "size_mb": get_model_size(net),
+        }
+    report["delta"] = {
+        key: report["int8"]["test"][key] - report["float32"]["test"][key]
+        for key in report["float32"]["test"].keys()
+    }
+
+    quantized_dir = os.path.join(FLAGS.exp_dir, QUANTIZED_FOLDER)
+    os.makedirs(quantized_dir, exist_ok=True)
+    torch.save(
+        get_quantized_state(qmodel), os.path.join(quantized_dir, "model.ckpt")
+    )
+    with open(os.path.join(quantized_dir, "report.json"), "w") as fout:
+        json.dump(report, fout, indent=4)
+
+    for name in ["float32", "int8"]:
+        print(
+            "{0:8s} {1}  latency p50 {2:.2f}ms  p99 {3:.2f}ms  size {4:.3f}MB".format(
+                name,
+                "  ".join(
+                    [
+                        "{0} {1:.4f}".format(key, value)
+                        for key, value in report[name]["test"].items()
+                    ]
+                ),
+                report[name]["latency_ms"]["p50"],
+                report[name]["latency_ms"]["p99"],
+                report[name]["size_mb"],
+            )
+        )
+    print(
+        "delta    {0}".format(
+            "  ".join(
+                [
+                    "{0} {1:+.4f}".format(key, value)
+                    for key, value in report["delta"].items()
+                ]
+            )
+        )
+    )
+    print("Quantized network saved in {0}".format(quantized_dir))
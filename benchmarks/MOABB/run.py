@@ -0,0 +1,314 @@
+#!/usr/bin/python
+"""
+This script runs leave-one-subject-out and/or leave-one-session-out training, optionally with multiple seeds, in a
+single long-lived Python process (or in a bounded pool of worker processes).
+It is equivalent to run_experiments.sh, but heavy modules (torch, mne, moabb, speechbrain) are imported only once,
+data hparams are parsed only once per process and prepared subjects are reused among folds, instead of starting a new
+train.py process for each subject, session and run. This is convenient when training time is short (e.g., few epochs)
+and the startup overhead would dominate the overall time.
+Results are stored with the same layout as run_experiments.sh (output_folder/run<k>/<seed>/...), including
+run<k>_results.txt and aggregated_performance.txt files.
+
+Usage:
+    > python run.py --hparams=hparams/MotorImagery/BNCI2014001/EEGNet.yaml --data_folder=eeg_data \
+    --output_folder=results/MotorImagery/BNCI2014001/EEGNet --nsbj=9 --nsess=2 --seed=1986 --nruns=2 \
+    --number_of_epochs=10
+
+Additional flags (e.g., --number_of_epochs=10) are passed to the hparam file as overrides.
+"""
+
+import argparse
+import contextlib
+import io
+import logging
+import multiprocessing
+import os
+import random
+import string
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from train import load_hparams, prepare_datasets, train_fold
+from utils.parse_results import report_results
+from utils.slots import use_slot
+
+logger = logging.getLogger(__name__)
+
+# Data hparams already loaded in the current process (keys: command line arguments)
+data_hparams = {}
+
+
+def get_data_hparams(argv):
+    """This function returns the hparams used to prepare the datasets, loading them only once per process.
+    Target subject and session are placeholders in hparam files: they are set to 0 here and then replaced with the
+    ones of each fold."""
+    key = tuple(argv)
+    if key not in data_hparams:
+        _, _, _, data_hparams[key] = load_hparams(
+            argv + ["--target_subject_idx", "0", "--target_session_idx", "0"]
+        )
+    return data_hparams[key]
+
+
+def run_fold(argv, target_subject_idx, target_session_idx):
+    """This function prepares the datasets of a fold, then trains and evaluates the network."""
+    hparams = get_data_hparams(argv)
+    hparams["target_subject_idx"] = target_subject_idx
+    hparams["target_session_idx"] = target_session_idx
+    print(
+        "Subject {0}, session {1}".format(
+            target_subject_idx, target_session_idx
+        )
+    )
+    tail_path, datasets = prepare_datasets(hparams)
+    if datasets is None:
+        raise ValueError(
+            "Unknown data iterator: {0}".format(hparams["data_iterator_name"])
+        )
+    train_fold(
+        argv
+        + [
+            "--target_subject_idx",
+            str(target_subject_idx),
+            "--target_session_idx",
+            str(target_session_idx),
+        ],
+        tail_path,
+        datasets,
+    )
+
+
+def run_fold_safe(argv, target_subject_idx, target_session_idx):
+    """This function runs a fold and logs errors instead of raising them, so that the remaining folds are run
+    anyway (as run_experiments.sh does). It returns True if the fold was successfully completed."""
+    try:
+        run_fold(argv, target_subject_idx, target_session_idx)
+    except Exception:
+        logger.exception(
+            "Error in subject {0}, session {1} ({2})".format(
+                target_subject_idx, target_session_idx, " ".join(argv)
+            )
+        )
+        return False
+    return True
+
+
+def tee(text, fpath):
+    """This function prints a text and appends it to a file."""
+    print(text, end="")
+    with open(fpath, "a") as fout:
+        fout.write(text)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run multiple trainings on MOABB datasets in a single process"
+    )
+    parser.add_argument("--hparams", required=True, help="Hparam YAML file")
+    parser.add_argument("--data_folder", required=True, help="Data folder path")
+    parser.add_argument(
+        "--cached_data_folder",
+        default=None,
+        help="Cached data folder path (default: data_folder/pkl)",
+    )
+    parser.add_argument(
+        "--output_folder", required=True, help="Output folder path"
+    )
+    parser.add_argument(
+        "--nsbj", type=int, required=True, help="Number of subjects"
+    )
+    parser.add_argument(
+        "--nsess", type=int, required=True, help="Number of sessions"
+    )
+    parser.add_argument(
+        "--seed", type=int, default=None, help="Seed (random if not specified)",
+    )
+    parser.add_argument(
+        "--nruns", type=int, required=True, help="Number of runs"
+    )
+    parser.add_argument(
+        "--eval_metric",
+        default="acc",
+        help="Evaluation metric (e.g., acc or f1)",
+    )
+    parser.add_argument(
+        "--eval_set",
+        default="test",
+        choices=["dev", "test"],
+        help="Evaluation set. Default: test",
+    )
+    parser.add_argument(
+        "--train_mode",
+        default="leave-one-session-out",
+        choices=["leave-one-subject-out", "leave-one-session-out"],
+        help="The training mode. Default: leave-one-session-out",
+    )
+    parser.add_argument(
+        "--rnd_dir",
+        default="False",
+        help="If True the results are stored in a subdir of the output folder with a random name (useful to store "
+        "all the results of an hparam tuning). Default: False",
+    )
+    parser.add_argument(
+        "--results_db",
+        default=None,
+        help="SQLite database where the results of all folds are appended. Default: output_folder/results.db",
+    )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=1,
+        help="Number of worker processes running folds in parallel. Default: 1 (all folds run in this process)",
+    )
+    parser.add_argument(
+        "--pin_cpus",
+        default="False",
+        help="If True, each worker process is pinned to its own CPU cores (see utils/slots.py). Default: False",
+    )
+    FLAGS, additional_flags = parser.parse_known_args()
+
+    metric_file = (
+        "valid_metrics.pkl" if FLAGS.eval_set == "dev" else "test_metrics.pkl"
+    )
+    seed = FLAGS.seed if FLAGS.seed is not None else random.randint(0, 32767)
+    cached_data_folder = FLAGS.cached_data_folder
+    if cached_data_folder is None:
+        cached_data_folder = os.path.join(FLAGS.data_folder, "pkl")
+    output_folder = FLAGS.output_folder
+    if FLAGS.rnd_dir == "True":
+        output_folder = os.path.join(
+            output_folder, "".join(random.choices(string.ascii_letters, k=6))
+        )
+
+    results_db = FLAGS.results_db
+    if results_db is None:
+        results_db = os.path.join(output_folder, "results.db")
+
+    os.makedirs(output_folder, exist_ok=True)
+    os.makedirs(FLAGS.data_folder, exist_ok=True)
+    os.makedirs(cached_data_folder, exist_ok=True)
+
+    # Print command line arguments and save to file
+    flags = [
+        ("hparams", FLAGS.hparams),
+        ("data_folder", FLAGS.data_folder),
+        ("cached_data_folder", cached_data_folder),
+        ("output_folder", output_folder),
+        ("nsbj", FLAGS.nsbj),
+        ("nsess", FLAGS.nsess),
+        ("seed", seed),
+        ("nruns", FLAGS.nruns),
+        ("eval_metric", FLAGS.eval_metric),
+        ("eval_set", FLAGS.eval_set),
+        ("train_mode", FLAGS.train_mode),
+        ("rnd_dir", FLAGS.rnd_dir),
+        ("results_db", results_db),
+        ("num_workers", FLAGS.num_workers),
+        ("pin_cpus", FLAGS.pin_cpus),
+        ("additional flags", " ".join(additional_flags)),
+    ]
+    with open(os.path.join(output_folder, "flags.txt"), "w") as fout:
+        for name, value in flags:
+            print("{0}: {1}".format(name, value))
+            fout.write("{0}: {1}\n".format(name, value))
+
+    # Defining all folds of all runs (with different seeds)
+    target_session_idxs = (
+        [0]
+        if FLAGS.train_mode == "leave-one-subject-out"
+        else list(range(FLAGS.nsess))
+    )
+    runs = []
+    for i in range(FLAGS.nruns):
+        output_folder_exp = os.path.join(
+            output_folder, "run{0}".format(i + 1), str(seed + i)
+        )
+        argv = [
+            FLAGS.hparams,
+            "--seed",
+            str(seed + i),
+            "--data_folder",
+            FLAGS.data_folder,
+            "--cached_data_folder",
+            cached_data_folder,
+            "--output_folder",
+            output_folder_exp,
+            "--results_db",
+            results_db,
+            "--data_iterator_name",
+            FLAGS.train_mode,
+        ] + additional_flags
+        folds = [
+            (argv, target_subject_idx, target_session_idx)
+            for target_session_idx in target_session_idxs
+            for target_subject_idx in range(FLAGS.nsbj)
+        ]
+        runs.append((output_folder_exp, folds))
+
+    executor = None
+    if FLAGS.num_workers > 1:
+        # each worker takes a resource slot (CPU threads/cores and GPU), unless slots are already configured
+        # (e.g., by run_hparam_optimization.sh)
+        if "MOABB_N_SLOTS" not in os.environ:
+            os.environ["MOABB_N_SLOTS"] = str(FLAGS.num_workers)
+            os.environ["MOABB_SLOTS_DIR"] = os.path.join(output_folder, "slots")
+            os.environ["MOABB_PIN_CPUS"] = FLAGS.pin_cpus
+        # spawned (not forked) workers, to safely use CUDA in each of them
+        executor = ProcessPoolExecutor(
+            max_workers=FLAGS.num_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=use_slot,
+        )
+        runs = [
+            (
+                output_folder_exp,
+                [executor.submit(run_fold_safe, *fold) for fold in folds],
+            )
+            for output_folder_exp, folds in runs
+        ]
+    else:
+        use_slot()
+
+    for i, (output_folder_exp, folds) in enumerate(runs):
+        if executor is not None:
+            completed = [future.result() for future in folds]
+        else:
+            completed = [run_fold_safe(*fold) for fold in folds]
+        if not all(completed):
+            logger.warning(
+                "{0} folds failed in {1}".format(
+                    len(completed) - sum(completed), output_folder_exp
+                )
+            )
+
+        # Store the results
+        results = io.StringIO()
+        with contextlib.redirect_stdout(results):
+            report_results(output_folder_exp, metric_file, [FLAGS.eval_metric])
+        tee(
+            results.getvalue(),
+            os.path.join(output_folder, "run{0}_results.txt".format(i + 1)),
+        )
+
+    if executor is not None:
+        executor.shutdown()
+
+    print("Final Results (Performance Aggregation)")
+    aggregation = subprocess.run(
+        [
+            sys.executable,
+            os.path.join(
+                os.path.dirname(os.path.abspath(__file__)),
+                "utils",
+                "aggregate_results.py",
+            ),
+            output_folder,
+            FLAGS.eval_metric,
+        ],
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    tee(
+        aggregation.stdout,
+        os.path.join(output_folder, "aggregated_performance.txt"),
+    )
@@ -27,6 +27,7 @@ eval_metric="acc"
 eval_set="test"
 train_mode="leave-one-session-out"
 rnd_dir=False
+results_db=""
 additional_flags=""
 
 # Function to print argument descriptions and exit
@@ -45,6 +46,7 @@ print_argument_descriptions() {
     echo "  --eval_set dev or test            Evaluation set. Default: test"
     echo "  --train_mode mode                 The training mode can be leave-one-subject-out or leave-one-session-out. Default: leave-one-session-out"
     echo "  --rnd_dir                         If True the results are stored in a subdir of the output folder with a random name (useful to store all the results of an hparam tuning).  Default: False"
+    echo "  --results_db db_path              SQLite database where the results of all folds are appended. Default: output_folder/results.db"
     exit 1
 }
 
@@ -126,6 +128,12 @@ while [[ $# -gt 0 ]]; do
       shift
       ;;
 
+    --results_db)
+      results_db="$2"
+      shift
+      shift
+      ;;
+
 
     --help)
       print_argument_descriptions
@@ -175,6 +183,11 @@ if [ "$rnd_dir" = True ]; then
     output_folder="$output_folder/$rnd_dirname"
 fi
 
+# Assign default value to results_db
+if [ -z "$results_db" ]; then
+    results_db="$output_folder/results.db"
+fi
+
 # Make sure  the output_folder is created
 mkdir -p $output_folder
 
@@ -192,6 +205,7 @@ mkdir -p $output_folder
     echo "eval_set: $eval_set"
     echo "train_mode: $train_mode"
     echo "rnd_dir: $rnd_dir"
+    echo "results_db: $results_db"
     echo "additional flags: $additional_flags"
 } | tee "$output_folder/flags.txt"
 
@@ -208,7 +222,7 @@ run_experiment() {
 
   for target_subject_idx in $(seq 0 1 $(( nsbj - 1 ))); do
     echo "Subject $target_subject_idx"
-    python train.py $hparams --seed=$seed --data_folder=$data_folder --cached_data_folder=$cached_data_folder --output_folder=$output_folder_exp\
+    python train.py $hparams --seed=$seed --data_folder=$data_folder --cached_data_folder=$cached_data_folder --output_folder=$output_folder_exp --results_db=$results_db\
       --target_subject_idx=$target_subject_idx --target_session_idx=$target_session_idx \
       --data_iterator_name="$train_mode" $additional_flags
   done
@@ -32,6 +32,9 @@
 # 2. Run the orion-hunt command for hyperparameter tuning.
 #    By default, TPE (Tree-structured Parzen Estimator) hyperparameter tuning is
 #    performed, as specified in the default orion config file at hparams/orion/hparams_tpe.yaml.
+#    With --fidelity epochs (or subjects), a multi-fidelity search is performed instead with ASHA
+#    (hparams/orion/hparams_asha.yaml): trials are first run with few epochs (or subjects) and only
+#    the most promising ones are promoted to higher fidelities (successive halving).
 # 3. Save the best hyperparameters, which can be viewed using torch-info.
 # 4. Loop until flags like @orion_step<stepid> are found in the YAML file.
 #
@@ -62,7 +65,14 @@ nruns_eval=10
 eval_metric="acc"
 train_mode="leave-one-session-out"
 seed=1986
-config_file="hparams/orion/hparams_tpe.yaml"
+config_file=""
+fidelity="none"
+fidelity_min=""
+fidelity_max=""
+fidelity_base=3
+n_workers=1
+pin_cpus=False
+slot_gpus=""
 mne_dir=""
 orion_db_address=""
 orion_db_type="PickledDB"
@@ -88,7 +98,14 @@ print_argument_descriptions() {
     echo "  --eval_metric metric [Optional]       Evaluation metric description. Default:acc"
     echo "  --seed random_seed [Optional]         Seed (random if not specified)"
     echo "  --train_mode mode [Optional]          The training mode can be leave-one-subject-out or leave-one-session-out. Default: leave-one-session-out"
-    echo "  --config_file config_file [Optional]  Orion config file. Default: hparams/orion/hparams_tpe.yaml"
+    echo "  --config_file config_file [Optional]  Orion config file. Default: hparams/orion/hparams_tpe.yaml (hparams/orion/hparams_asha.yaml with --fidelity)"
+    echo "  --fidelity type [Optional]            Multi-fidelity search: none, epochs (number of training epochs) or subjects (number of subjects). Default: none"
+    echo "  --fidelity_min int [Optional]         Lowest fidelity. Default: 100 epochs or 1 subject"
+    echo "  --fidelity_max int [Optional]         Highest fidelity. Default: 1000 epochs or nsbj_hpsearch subjects"
+    echo "  --fidelity_base int [Optional]        Reduction factor between fidelities (only the best 1/base trials are promoted). Default: 3"
+    echo "  --n_workers int [Optional]            Number of hparam trials run in parallel. Each trial uses a slot of cpu threads (and gpu) of the machine. Default: 1"
+    echo "  --pin_cpus Bool [Optional]            When set to True, each parallel trial is pinned to its own cpu cores. Default: False"
+    echo "  --slot_gpus gpus [Optional]           Comma-separated list of gpus (e.g., 0,1) assigned round-robin to parallel trials. Default: all gpus for all trials"
     echo "  --mne_dir mne_dir [Optional]          MNE directory. Need it different from your home (see notes on MNE in README.md)"
     echo "  --orion_db_address [Optional]         Path of the database where orion will store hparams and performance"
     echo "  --orion_db_type db_type [Optional]    Type of the dataset that orion will use. Default: PickledDB"
@@ -194,6 +211,48 @@ while [[ $# -gt 0 ]]; do
       shift
       ;;
 
+    --fidelity)
+      fidelity="$2"
+      shift
+      shift
+      ;;
+
+    --fidelity_min)
+      fidelity_min="$2"
+      shift
+      shift
+      ;;
+
+    --fidelity_max)
+      fidelity_max="$2"
+      shift
+      shift
+      ;;
+
+    --fidelity_base)
+      fidelity_base="$2"
+      shift
+      shift
+      ;;
+
+    --n_workers)
+      n_workers="$2"
+      shift
+      shift
+      ;;
+
+    --pin_cpus)
+      pin_cpus="$2"
+      shift
+      shift
+      ;;
+
+    --slot_gpus)
+      slot_gpus="$2"
+      shift
+      shift
+      ;;
+
     --mne_dir)
       mne_dir="$2"
       shift
@@ -265,6 +324,28 @@ if [ -z "$cached_data_folder" ]; then
 fi
 
 
+# Multi-fidelity search: fidelity flag (and default orion config file)
+fidelity_flag=""
+if [ "$fidelity" = "epochs" ]; then
+    fidelity_min=${fidelity_min:-100}
+    fidelity_max=${fidelity_max:-1000}
+    fidelity_flag="--number_of_epochs~\"fidelity($fidelity_min, $fidelity_max, base=$fidelity_base)\""
+elif [ "$fidelity" = "subjects" ]; then
+    fidelity_min=${fidelity_min:-1}
+    fidelity_max=${fidelity_max:-$nsbj_hpsearch}
+    fidelity_flag="--nsbj~\"fidelity($fidelity_min, $fidelity_max, base=$fidelity_base)\""
+elif [ "$fidelity" != "none" ]; then
+    echo "ERROR: Unknown fidelity '$fidelity' (it can be none, epochs or subjects)."
+    print_argument_descriptions
+fi
+if [ -z "$config_file" ]; then
+    if [ "$fidelity" = "none" ]; then
+        config_file="hparams/orion/hparams_tpe.yaml"
+    else
+        config_file="hparams/orion/hparams_asha.yaml"
+    fi
+fi
+
 # Set orion db address if specified
 if [ -z "$orion_db_address" ]; then
     orion_db_address=$output_folder'/'$exp_name'.pkl'
@@ -272,6 +353,15 @@ fi
 export ORION_DB_ADDRESS=$orion_db_address
 export ORION_DB_TYPE=$orion_db_type
 
+# Parallel trials: each training process takes one of n_workers slots (cpu threads/cores and gpu, see utils/slots.py)
+# The orion database is shared by the workers (PickledDB accesses are serialized with a file lock)
+if [ "$n_workers" -gt 1 ]; then
+    export MOABB_N_SLOTS=$n_workers
+    export MOABB_SLOTS_DIR=$output_folder/slots
+    export MOABB_PIN_CPUS=$pin_cpus
+    export MOABB_SLOT_GPUS=$slot_gpus
+fi
+
 echo "-------------------------------------"
 echo "Experiment Name: $exp_name"
 echo "Output Folder: $output_folder"
@@ -289,9 +379,11 @@ echo "Training modality: $train_mode"
 echo "Seed: $seed"
 echo "Additional Flags: $additional_flags"
 echo "Orion Config File: $config_file"
+echo "Fidelity: $fidelity $fidelity_flag"
 echo "Orion Database type: $orion_db_type"
 echo "Orion Database file: $orion_db_address"
 echo "Experiment Max Trials: $exp_max_trials"
+echo "Parallel Trials: $n_workers"
 echo "-------------------------------------"
 
 
@@ -349,6 +441,33 @@ function extract_best_params() {
     echo "$formatted_params"
 }
 
+# Function for extracting the best hparams of a multi-fidelity search (see --fidelity)
+# The best trial is selected among the trials run at the highest fidelity reached, since the objectives of trials
+# stopped at lower rungs (e.g., with few epochs) are not comparable. The fidelity dimension is not returned.
+function extract_best_params_fidelity() {
+    local exp_name="$1"
+    local fidelity_name="$2"
+    python - "$exp_name" "$fidelity_name" <<'EOF'
+import sys
+from orion.client import get_experiment
+
+fidelity_name = "/" + sys.argv[2]
+trials = [
+    trial
+    for trial in get_experiment(sys.argv[1]).fetch_trials_by_status("completed")
+    if trial.objective is not None
+]
+max_fidelity = max(trial.params[fidelity_name] for trial in trials)
+best_trial = min(
+    [trial for trial in trials if trial.params[fidelity_name] == max_fidelity],
+    key=lambda trial: trial.objective.value,
+)
+for name, value in best_trial.params.items():
+    if name != fidelity_name:
+        print("{0}: {1}".format(name.lstrip("/"), value))
+EOF
+}
+
 # Running hparam tuning (loop over multiple steps)
 step_id=1
 hparams_step=$hparams
@@ -380,14 +499,27 @@ while [ -n "$opt_flags" ]; do
     echo "**********************************************************************************************"
     echo
     # Setting up orion command
-    orion_hunt_command="orion hunt -n $exp_name_step -c $config_file --exp-max-trials $exp_max_trials \
+    # With --fidelity subjects, the number of subjects is set by the fidelity dimension only
+    nsbj_flag="--nsbj $nsbj_hpsearch"
+    if [ "$fidelity" = "subjects" ]; then
+        nsbj_flag=""
+    fi
+    orion_hunt_command="orion hunt -n $exp_name_step -c $config_file --exp-max-trials $exp_max_trials --n-workers $n_workers \
     	./run_experiments.sh --hparams $hparams_step --data_folder $data_folder --seed $seed \
-    	--output_folder $output_folder_step/exp  --nsbj $nsbj_hpsearch --nsess $nsess_hpsearch --nruns $nruns \
-    	--eval_metric $eval_metric --eval_set dev --train_mode $train_mode --rnd_dir $store_all $additional_flags"
+    	--output_folder $output_folder_step/exp $nsbj_flag --nsess $nsess_hpsearch --nruns $nruns \
+    	--eval_metric $eval_metric --eval_set dev --train_mode $train_mode --rnd_dir $store_all \
+    	--results_db $output_folder_step/results.db $additional_flags"
 
 
     # Appending the optimization flags
-    orion_hunt_command="$orion_hunt_command $opt_flags"
+    # With a fidelity, each step is a multi-fidelity search (ASHA requires a fidelity dimension): the fidelity
+    # dimension replaces the search on the same parameter (if any) and is added once to the command
+    if [ "$fidelity" = "epochs" ]; then
+        opt_flags=$(sed -E 's/--number_of_epochs~"[^"]*"//' <<< "$opt_flags")
+    elif [ "$fidelity" = "subjects" ]; then
+        opt_flags=$(sed -E 's/--nsbj~"[^"]*"//' <<< "$opt_flags")
+    fi
+    orion_hunt_command="$orion_hunt_command $opt_flags $fidelity_flag"
 
     echo $orion_hunt_command &> "$output_folder_step/orion_hunt_command.txt"
 
@@ -411,7 +543,16 @@ while [ -n "$opt_flags" ]; do
     best_trial_line=$(grep -n "best trial:" $output_folder_step/orion-info.txt | cut -d ":" -f 1)
 
     # Extract and store the best set of hparams
-    best_params_output=$(extract_best_params "$output_folder_step/orion-info.txt")
+    # With a fidelity, the best trial is taken at the highest fidelity, and the fidelity is pinned to its maximum
+    # (number of epochs) or left to the final evaluation (number of subjects, --nsbj)
+    if [ "$fidelity" = "epochs" ]; then
+        best_params_output=$(extract_best_params_fidelity "$exp_name_step" number_of_epochs)
+        best_params_output=$(printf "%s\nnumber_of_epochs: %s" "$best_params_output" "$fidelity_max")
+    elif [ "$fidelity" = "subjects" ]; then
+        best_params_output=$(extract_best_params_fidelity "$exp_name_step" nsbj)
+    else
+        best_params_output=$(extract_best_params "$output_folder_step/orion-info.txt")
+    fi
     best_hparams_file="$output_folder_step/best_hparams.txt"
     echo "$best_params_output" > $best_hparams_file
 
@@ -441,7 +582,8 @@ echo
 final_yaml_file="$output_folder/best_hparams.yaml"
 scp $best_yaml_file $final_yaml_file
 
-# Running evaluation on the test set for the best models
+# Running evaluation on the test set for the best models (sequentially, with all the resources of the machine)
+unset MOABB_N_SLOTS
  ./run_experiments.sh --hparams $final_yaml_file --data_folder $data_folder \
   --seed $seed --output_folder $output_folder/best --nsbj $nsbj --nsess $nsess \
   --nruns $nruns_eval --eval_metric $eval_metric --eval_set test \
@@ -14,18 +14,39 @@ Mirco Ravanelli, 2023
 
 import pickle
 import os
+import time
 import torch
 from hyperpyyaml import load_hyperpyyaml
 from torch.nn import init
+from torch.utils.data import DataLoader
 import numpy as np
 import logging
 import sys
-from utils.dataio_iterators import LeaveOneSessionOut, LeaveOneSubjectOut
-from torchinfo import summary
+from utils.dataio_iterators import (
+    LeaveOneSessionOut,
+    LeaveOneSubjectOut,
+    DeviceTensorLoader,
+    get_device_loaders,
+)
+from utils.checkpoint_averager import CheckpointAverager
+from utils.slots import use_slot
+from utils.results_db import append_fold
+from utils.metric_accumulator import MetricAccumulator
+from utils.compiled_model import CompiledModel
+from utils.stage_timer import StageTimer
 import speechbrain as sb
 
 
 class MOABBBrain(sb.Brain):
+    # In-memory averager of the saved models (see avg_models_in_memory), created at the beginning of fit()
+    checkpoint_averager = None
+    # Accumulator of predictions and targets of evaluation stages, created at the first evaluation stage
+    metric_accumulator = None
+    # Timer of the stages of training epochs (see stage_timing), created at the beginning of fit()
+    stage_timer = None
+    # Relative lengths of the trials passed to augment (all ones), allocated at the first augmented batch
+    augment_lengths = None
+
     def init_model(self, model):
         """Function to initialize neural network modules"""
         for mod in model.modules():
@@ -40,20 +61,52 @@ class MOABBBrain(sb.Brain):
 
     def compute_forward(self, batch, stage):
         "Given an input batch it computes the model output."
-        inputs = batch[0].to(self.device)
+        inputs = self.prepare_inputs(batch, stage)
+        return self.modules.model(inputs)
+
+    def prepare_inputs(self, batch, stage):
+        "Given an input batch it returns the network inputs (after data augmentation and normalization)."
+        # EEG signals can be stored with lower precision (see storage_dtype), computations are in float32
+        inputs = batch[0].to(self.device).float()
+        self.lap("fetch")
 
         # Perform data augmentation
         if stage == sb.Stage.TRAIN and hasattr(self.hparams, "augment"):
+            batch_size = inputs.shape[0]
+            if (
+                self.augment_lengths is None
+                or self.augment_lengths.shape[0] < batch_size
+            ):
+                self.augment_lengths = torch.ones(
+                    batch_size, device=self.device
+                )
             inputs, _ = self.hparams.augment(
-                inputs.squeeze(3),
-                lengths=torch.ones(inputs.shape[0], device=self.device),
+                inputs.squeeze(3), lengths=self.augment_lengths[:batch_size],
             )
             inputs = inputs.unsqueeze(3)
+            self.lap("augment")
 
         # Normalization
         if hasattr(self.hparams, "normalize"):
             inputs = self.hparams.normalize(inputs)
-        return self.modules.model(inputs)
+            self.lap("normalize")
+        return inputs
+
+    def lap(self, name):
+        """Assigns the time elapsed since the previous stage boundary to the stage name (if stage timing is enabled,
+        see utils/stage_timer.py)."""
+        if self.stage_timer is not None:
+            self.stage_timer.lap(name)
+
+    def make_dataloader(
+        self, dataset, stage, ckpt_prefix="dataloader-", **loader_kwargs
+    ):
+        """Device-resident loaders are used as they are, other datasets are wrapped into DataLoaders."""
+        if isinstance(dataset, DeviceTensorLoader):
+            return dataset
+        return super().make_dataloader(
+            dataset, stage, ckpt_prefix=ckpt_prefix, **loader_kwargs
+        )
 
     def compute_objectives(self, predictions, batch, stage):
         "Given the network predictions and targets computes the loss."
@@ -71,51 +124,86 @@ class MOABBBrain(sb.Brain):
             ),
         )
         if stage != sb.Stage.TRAIN:
-            # From log to linear predictions
-            tmp_preds = torch.exp(predictions)
-            self.preds.extend(tmp_preds.detach().cpu().numpy())
-            self.targets.extend(batch[1].detach().cpu().numpy())
+            # From log to linear predictions (accumulated on the device)
+            self.metric_accumulator.append(torch.exp(predictions), batch[1])
         else:
             if hasattr(self.hparams, "lr_annealing"):
                 self.hparams.lr_annealing.on_batch_end(self.optimizer)
+        if self.stage_timer is not None:
+            # forward pass and loss
+            self.stage_timer.lap("forward")
+            self.stage_timer.add_samples(batch[0].shape[0])
         return loss
 
+    def on_fit_batch_end(self, batch, outputs, loss, should_step):
+        """Gets called at the end of each training step (after the backward pass and the optimizer step)."""
+        self.lap("backward")
+
     def on_fit_start(self,):
         """Gets called at the beginning of ``fit()``"""
         self.init_model(self.hparams.model)
+        if self.hparams.compile_model:
+            # forward and backward passes are compiled (the parameters are shared with hparams.model)
+            self.modules.model = CompiledModel(self.hparams.model)
         self.init_optimizers()
+        early_stopping = getattr(self.hparams, "early_stopping", None)
+        if self.hparams.avg_models_in_memory or (
+            self.hparams.test_with == "last"
+            and early_stopping is not None
+            and early_stopping.enabled
+        ):
+            # with early stopping the last epoch is not known in advance: the most recent models are kept in memory
+            # (instead of saving a checkpoint at each epoch) and the averaged one is saved when evaluation starts
+            self.checkpoint_averager = CheckpointAverager(
+                num_to_keep=self.hparams.avg_models
+            )
+        if self.hparams.stage_timing:
+            self.stage_timer = StageTimer(device=self.device)
+        self.save_model_summary()
+
+    def save_model_summary(self):
+        """Saves the summary of the network (layers, output shapes and number of parameters) in exp_dir/model.txt.
+        The summary is not computed again if it was already saved (e.g., when resuming a training)."""
+        summary_path = os.path.join(self.hparams.exp_dir, "model.txt")
+        if os.path.isfile(summary_path):
+            return
+        # imported here, out of the startup path
+        from torchinfo import summary
+
         in_shape = (
             (1,)
             + tuple(np.floor(self.hparams.input_shape[1:-1]).astype(int))
             + (1,)
         )
         model_summary = summary(self.hparams.model, input_size=in_shape)
-        with open(
-            os.path.join(self.hparams.exp_dir, "model.txt"), "w"
-        ) as text_file:
+        with open(summary_path, "w") as text_file:
             text_file.write(str(model_summary))
 
     def on_stage_start(self, stage, epoch=None):
         "Gets called when a stage (either training, validation, test) starts."
+        if self.stage_timer is not None:
+            if stage == sb.Stage.TRAIN:
+                self.stage_timer.reset()
+            self.stage_timer.start_stage(stage.name.lower())
         if stage != sb.Stage.TRAIN:
-            self.preds = []
-            self.targets = []
+            if self.metric_accumulator is None:
+                self.metric_accumulator = MetricAccumulator()
+            self.metric_accumulator.reset()
 
     def on_stage_end(self, stage, stage_loss, epoch=None):
         """Gets called at the end of a epoch."""
+        # end of the last batch fetch
+        self.lap("fetch")
         if stage == sb.Stage.TRAIN:
             self.train_loss = stage_loss
         else:
-            preds = np.array(self.preds)
-            y_pred = np.argmax(preds, axis=-1)
-            y_true = self.targets
+            # predictions are moved to the host only once (scores only for metrics of scores, e.g. AUC)
             self.last_eval_stats = {
                 "loss": stage_loss,
             }
-            for metric_key in self.hparams.metrics.keys():
-                self.last_eval_stats[metric_key] = self.hparams.metrics[
-                    metric_key
-                ](y_true=y_true, y_pred=y_pred)
+            accumulator = self.metric_accumulator
+            for metric_key, metric in self.hparams.metrics.items():
+                self.last_eval_stats[metric_key] = accumulator.compute(metric)
             if stage == sb.Stage.VALID:
                 # Learning rate scheduler
                 if hasattr(self.hparams, "lr_annealing"):
@@ -135,11 +223,13 @@ class MOABBBrain(sb.Brain):
                         valid_stats=self.last_eval_stats,
                     )
 
+                self.lap("metrics")
                 if epoch == 1:
                     self.best_eval_stats = self.last_eval_stats
 
                 # The current model is saved if it is the best or the last
-                is_best = self.check_if_best(
+                # (the model of the first epoch is the best so far, so that a model is always saved)
+                is_best = epoch == 1 or self.check_if_best(
                     self.last_eval_stats,
                     self.best_eval_stats,
                     keys=[self.hparams.test_key],
@@ -148,6 +238,11 @@ class MOABBBrain(sb.Brain):
                     epoch
                     > self.hparams.number_of_epochs - self.hparams.avg_models
                 )
+                early_stopping = getattr(self.hparams, "early_stopping", None)
+                if early_stopping is not None and early_stopping.enabled:
+                    # with early stopping the last epoch is not known in advance
+                    # the last avg_models models are kept in memory (see on_fit_start)
+                    is_last = True
 
                 # Check if we have to save the model
                 if self.hparams.test_with == "last" and is_last:
@@ -157,26 +252,49 @@ class MOABBBrain(sb.Brain):
                 else:
                     save_ckpt = False
 
-                # Saving the checkpoint
+                # Saving the checkpoint (in memory or on disk)
                 if save_ckpt:
-                    min_keys, max_keys = [], []
-                    if self.hparams.test_key == "loss":
-                        min_keys = [self.hparams.test_key]
-                    else:
-                        max_keys = [self.hparams.test_key]
                     meta = {}
                     for eval_key in self.last_eval_stats.keys():
                         if eval_key != "cm":
                             meta[str(eval_key)] = float(
                                 self.last_eval_stats[eval_key]
                             )
-                    self.checkpointer.save_and_keep_only(
-                        meta=meta,
-                        num_to_keep=self.hparams.avg_models,
-                        min_keys=min_keys,
-                        max_keys=max_keys,
+                    if self.checkpoint_averager is not None:
+                        self.checkpoint_averager.add(
+                            self.hparams.model.state_dict(),
+                            meta=dict(meta, epoch=epoch),
+                        )
+                    else:
+                        # with test_with: 'last' only the most recent models are kept
+                        min_keys, max_keys = [], []
+                        if self.hparams.test_with == "best":
+                            if self.hparams.test_key == "loss":
+                                min_keys = [self.hparams.test_key]
+                            else:
+                                max_keys = [self.hparams.test_key]
+                        self.checkpointer.save_and_keep_only(
+                            meta=meta,
+                            num_to_keep=self.hparams.avg_models,
+                            min_keys=min_keys,
+                            max_keys=max_keys,
+                        )
+
+                # Early stopping (the epoch counter stops after the current epoch)
+                if early_stopping is not None and early_stopping.step(
+                    epoch, self.last_eval_stats
+                ):
+                    self.hparams.epoch_counter.limit = epoch
+                    self.hparams.train_logger.log_stats(
+                        stats_meta={
+                            "early stopping at epoch": epoch,
+                            "reason": early_stopping.reason,
+                        },
                     )
 
+                self.lap("checkpoint")
+                self.log_stage_times(epoch)
+
             elif stage == sb.Stage.TEST:
                 self.hparams.train_logger.log_stats(
                     stats_meta={
@@ -184,38 +302,98 @@ class MOABBBrain(sb.Brain):
                     },
                     test_stats=self.last_eval_stats,
                 )
-                # save the averaged checkpoint at the end of the evaluation stage
-                # delete the rest of the intermediate checkpoints
-                # ACC is set to 1.1 so checkpointer only keeps the averaged checkpoint
-                if self.hparams.avg_models > 1:
-                    min_keys, max_keys = [], []
-                    if self.hparams.test_key == "loss":
-                        min_keys = [self.hparams.test_key]
-                        fake_meta = {self.hparams.test_key: 0.0, "epoch": epoch}
-                    else:
-                        max_keys = [self.hparams.test_key]
-                        fake_meta = {self.hparams.test_key: 1.1, "epoch": epoch}
-                    self.checkpointer.save_and_keep_only(
-                        meta=fake_meta,
-                        min_keys=min_keys,
-                        max_keys=max_keys,
-                        num_to_keep=1,
-                    )
+
+    def log_stage_times(self, epoch):
+        """Writes the stage times of the epoch in the train log and in stage_times.jsonl (next to model.txt)."""
+        if self.stage_timer is None:
+            return
+        stage_stats = self.stage_timer.get_stats()
+        self.hparams.train_logger.log_stats(
+            stats_meta={"stage times (s) at epoch": epoch},
+            train_stats=stage_stats.get("train"),
+            valid_stats=stage_stats.get("valid"),
+        )
+        self.stage_timer.write(
+            os.path.join(self.hparams.exp_dir, "stage_times.jsonl"),
+            epoch=epoch,
+        )
+
+    def save_averaged_checkpoint(self, epoch=None):
+        """Saves the current (averaged) model as the only checkpoint.
+        ACC is set to 1.1 (loss to 0.0) so checkpointer only keeps the averaged checkpoint."""
+        min_keys, max_keys = [], []
+        if self.hparams.test_key == "loss":
+            min_keys = [self.hparams.test_key]
+            fake_meta = {self.hparams.test_key: 0.0, "epoch": epoch}
+        else:
+            max_keys = [self.hparams.test_key]
+            fake_meta = {self.hparams.test_key: 1.1, "epoch": epoch}
+        self.checkpointer.save_and_keep_only(
+            meta=fake_meta, min_keys=min_keys, max_keys=max_keys, num_to_keep=1,
+        )
 
     def on_evaluate_start(self, max_key=None, min_key=None):
         """Perform checkpoint average if needed"""
         super().on_evaluate_start()
 
-        ckpts = self.checkpointer.find_checkpoints(
-            max_key=max_key, min_key=min_key
-        )
-        ckpt = sb.utils.checkpoints.average_checkpoints(
-            ckpts, recoverable_name="model", device=self.device
-        )
-
-        self.hparams.model.load_state_dict(ckpt, strict=True)
+        if (
+            self.checkpoint_averager is None
+            or len(self.checkpoint_averager) == 0
+        ):
+            # checkpoints saved on disk (also when no model is kept in memory, e.g. after the first evaluation, which
+            # saves the averaged model, in a resumed run or when evaluate is called without fit)
+            ckpts = self.checkpointer.find_checkpoints(
+                max_key=max_key, min_key=min_key
+            )
+            if len(ckpts) == 0:
+                raise RuntimeError(
+                    "No checkpoint to evaluate in {0} (no model kept in memory and no checkpoint saved on "
+                    "disk)".format(self.checkpointer.checkpoints_dir)
+                )
+            ckpt = sb.utils.checkpoints.average_checkpoints(
+                ckpts, recoverable_name="model", device=self.device
+            )
+            self.hparams.model.load_state_dict(ckpt, strict=True)
+            # save the averaged checkpoint and delete the rest of the intermediate checkpoints
+            # (before any evaluation stage, so that the checkpoint does not store the step of a stage)
+            if self.hparams.avg_models > 1 and len(ckpts) > 1:
+                self.save_averaged_checkpoint()
+        else:
+            # the models kept in memory are averaged only once and only the averaged model is saved on disk
+            # (the following evaluations use it, as recovered by the checkpointer)
+            epoch = self.checkpoint_averager.last_meta()["epoch"]
+            self.hparams.epoch_counter.current = epoch
+            self.hparams.model.load_state_dict(
+                self.checkpoint_averager.average(), strict=True
+            )
+            self.checkpoint_averager.clear()
+            self.save_averaged_checkpoint(epoch)
         self.hparams.model.eval()
 
+    def evaluate_splits(self, test_sets, max_key=None, min_key=None):
+        """Evaluates the model on several sets (dict: split -> dataset, e.g. test and validation sets) in a single
+        pass: checkpoints are loaded (and averaged) once, then each set is evaluated as in sb.Brain.evaluate.
+        Returns the evaluation stats of each split (see last_eval_stats)."""
+        self.on_evaluate_start(max_key=max_key, min_key=min_key)
+        eval_stats = {}
+        for split, test_set in test_sets.items():
+            if not isinstance(test_set, DataLoader):
+                test_set = self.make_dataloader(
+                    test_set, sb.Stage.TEST, ckpt_prefix=None
+                )
+            self.on_stage_start(sb.Stage.TEST, epoch=None)
+            self.modules.eval()
+            avg_test_loss = 0.0
+            with torch.no_grad():
+                for batch in test_set:
+                    self.step += 1
+                    loss = self.evaluate_batch(batch, stage=sb.Stage.TEST)
+                    avg_test_loss = self.update_average(loss, avg_test_loss)
+                self.on_stage_end(sb.Stage.TEST, avg_test_loss, None)
+            self.step = 0
+            eval_stats[split] = self.last_eval_stats
+        return eval_stats
+
     def check_if_best(
         self, last_eval_stats, best_eval_stats, keys,
     ):
@@ -236,8 +414,8 @@ class MOABBBrain(sb.Brain):
         return is_best
 
 
-def run_experiment(hparams, run_opts, datasets):
-    """This function performs a single training (e.g., single cross-validation fold)"""
+def create_brain(hparams, run_opts, datasets):
+    """This function creates the Brain object (with its checkpointer and logger) for a single training."""
     idx_examples = np.arange(datasets["train"].dataset.tensors[0].shape[0])
     n_examples_perclass = [
         idx_examples[
@@ -268,7 +446,7 @@ def run_experiment(hparams, run_opts, datasets):
     )
     logger.info(
         "Training set avg value: {0}".format(
-            datasets["train"].dataset.tensors[0].mean()
+            datasets["train"].dataset.tensors[0].mean(dtype=torch.float32)
         )
     )
     datasets_summary = "Number of examples: {0} (training), {1} (validation), {2} (test)".format(
@@ -285,54 +463,98 @@ def run_experiment(hparams, run_opts, datasets):
         run_opts=run_opts,
         checkpointer=checkpointer,
     )
+    return brain
+
+
+def evaluate_brain(brain, hparams, datasets, train_time=None):
+    """This function evaluates a trained network on test and validation sets and stores the results."""
+    # evaluation after loading model using specific key (checkpoints are loaded once for both sets)
+    eval_stats = perform_evaluation(
+        brain, hparams, datasets, dataset_keys=["test", "valid"]
+    )
+
+    # appending the results of the fold to the results database
+    if hparams["results_db"] is not None:
+        append_fold(
+            hparams["results_db"],
+            fold={
+                "dataset": hparams["dataset"].code,
+                "model": hparams["model"].__class__.__name__,
+                "iterator": hparams["data_iterator_name"],
+                "subject": hparams["dataset"].subject_list[
+                    hparams["target_subject_idx"]
+                ],
+                "session": hparams["target_session_idx"],
+                "seed": hparams["seed"],
+                "trial": os.environ.get("ORION_TRIAL_ID"),
+            },
+            eval_stats=eval_stats,
+            train_time=train_time,
+            hparams=hparams,
+            exp_dir=hparams["exp_dir"],
+        )
+
+
+def run_experiment(hparams, run_opts, datasets):
+    """This function performs a single training (e.g., single cross-validation fold)"""
+    brain = create_brain(hparams, run_opts, datasets)
+    # moving whole sets on the device once (mini-batches are then obtained by indexing)
+    if hparams["device_resident_data"]:
+        datasets = get_device_loaders(datasets, brain.device)
     # training
+    start_time = time.time()
     brain.fit(
         epoch_counter=hparams["epoch_counter"],
         train_set=datasets["train"],
         valid_set=datasets["valid"],
         progressbar=False,
     )
-    # evaluation after loading model using specific key
-    perform_evaluation(brain, hparams, datasets, dataset_key="test")
-    # After the first evaluation only 1 checkpoint (best overall or averaged) is stored.
-    # Setting avg_models to 1 to prevent deleting the checkpoint in subsequent calls of the evaluation stage.
-    brain.hparams.avg_models = 1
-    perform_evaluation(brain, hparams, datasets, dataset_key="valid")
+    evaluate_brain(
+        brain, hparams, datasets, train_time=time.time() - start_time
+    )
 
 
-def perform_evaluation(brain, hparams, datasets, dataset_key="test"):
-    """This function perform the evaluation stage on a dataset and save the performance metrics in a pickle file"""
+def perform_evaluation(brain, hparams, datasets, dataset_keys=["test"]):
+    """This function performs the evaluation stage on the datasets in dataset_keys (in a single pass, see
+    MOABBBrain.evaluate_splits) and saves the performance metrics of each dataset in a pickle file
+    (<dataset_key>_metrics.pkl). The performance metrics are also returned (dict: dataset_key -> metrics)."""
     min_key, max_key = None, None
     if hparams["test_key"] == "loss":
         min_key = hparams["test_key"]
     else:
         max_key = hparams["test_key"]
     # perform evaluation
-    brain.evaluate(
-        datasets[dataset_key],
-        progressbar=False,
+    eval_stats = brain.evaluate_splits(
+        {dataset_key: datasets[dataset_key] for dataset_key in dataset_keys},
         min_key=min_key,
         max_key=max_key,
     )
-    # saving metrics on the desired dataset in a pickle file
-    metrics_fpath = os.path.join(
-        hparams["exp_dir"], "{0}_metrics.pkl".format(dataset_key)
-    )
-    with open(metrics_fpath, "wb") as handle:
-        pickle.dump(
-            brain.last_eval_stats, handle, protocol=pickle.HIGHEST_PROTOCOL
+    # saving metrics on the desired datasets in pickle files
+    for dataset_key in dataset_keys:
+        metrics_fpath = os.path.join(
+            hparams["exp_dir"], "{0}_metrics.pkl".format(dataset_key)
         )
+        with open(metrics_fpath, "wb") as handle:
+            pickle.dump(
+                eval_stats[dataset_key],
+                handle,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+    return eval_stats
 
 
-if __name__ == "__main__":
-    argv = sys.argv[1:]
-    # loading hparams to prepare the dataset and the data iterators
+def load_hparams(argv):
+    """This function parses command line arguments and loads the hparams (hparam file and overrides)."""
     hparams_file, run_opts, overrides = sb.core.parse_arguments(argv)
     with open(hparams_file) as fin:
         hparams = load_hyperpyyaml(fin, overrides)
+    return hparams_file, run_opts, overrides, hparams
 
-    # defining data iterator to use
-    print("Prepare dataset iterators...")
+
+def prepare_datasets(hparams):
+    """This function prepares the datasets (training, validation and test sets) of the fold specified in hparams
+    (target subject, target session and data iterator).
+    It returns None, None if the data iterator is not supported."""
     data_iterator = None
 
     if hparams["data_iterator_name"] == "leave-one-session-out":
@@ -344,48 +566,76 @@ if __name__ == "__main__":
             seed=hparams["seed"]
         )  # cross-subject and cross-session
 
-    if data_iterator is not None:
-        tail_path, datasets = data_iterator.prepare(
-            data_folder=hparams["data_folder"],
-            dataset=hparams["dataset"],
-            cached_data_folder=hparams["cached_data_folder"],
-            batch_size=hparams["batch_size"],
-            valid_ratio=hparams["valid_ratio"],
-            target_subject_idx=hparams["target_subject_idx"],
-            target_session_idx=hparams["target_session_idx"],
-            events_to_load=hparams["events_to_load"],
-            original_sample_rate=hparams["original_sample_rate"],
-            sample_rate=hparams["sample_rate"],
-            fmin=hparams["fmin"],
-            fmax=hparams["fmax"],
-            tmin=hparams["tmin"],
-            tmax=hparams["tmax"],
-            save_prepared_dataset=hparams["save_prepared_dataset"],
-            n_steps_channel_selection=hparams["n_steps_channel_selection"],
-        )
+    if data_iterator is None:
+        return None, None
+    return data_iterator.prepare(
+        data_folder=hparams["data_folder"],
+        dataset=hparams["dataset"],
+        cached_data_folder=hparams["cached_data_folder"],
+        batch_size=hparams["batch_size"],
+        valid_ratio=hparams["valid_ratio"],
+        target_subject_idx=hparams["target_subject_idx"],
+        target_session_idx=hparams["target_session_idx"],
+        events_to_load=hparams["events_to_load"],
+        original_sample_rate=hparams["original_sample_rate"],
+        sample_rate=hparams["sample_rate"],
+        fmin=hparams["fmin"],
+        fmax=hparams["fmax"],
+        tmin=hparams["tmin"],
+        tmax=hparams["tmax"],
+        save_prepared_dataset=hparams["save_prepared_dataset"],
+        cache_format=hparams["cache_format"],
+        wideband=hparams["wideband"],
+        save_prepared_folds=hparams["save_prepared_folds"],
+        storage_dtype=hparams["storage_dtype"],
+        n_steps_channel_selection=hparams["n_steps_channel_selection"],
+    )
 
-        # override C and T, to be sure that network input shape matches the dataset (e.g., after time cropping or channel sampling)
-        argv += [
-            "--T",
-            str(datasets["train"].dataset.tensors[0].shape[1]),
-            "--C",
-            str(datasets["train"].dataset.tensors[0].shape[-2]),
-            "--n_train_examples",
-            str(datasets["train"].dataset.tensors[0].shape[0]),
-        ]
-
-        # loading hparams for the each training and evaluation processes
-        hparams_file, run_opts, overrides = sb.core.parse_arguments(argv)
-        with open(hparams_file) as fin:
-            hparams = load_hyperpyyaml(fin, overrides)
-        hparams["exp_dir"] = os.path.join(hparams["output_folder"], tail_path)
-
-        # creating experiment directory
-        sb.create_experiment_directory(
-            experiment_directory=hparams["exp_dir"],
-            hyperparams_to_save=hparams_file,
-            overrides=overrides,
-        )
 
-        # Run training
-        run_experiment(hparams, run_opts, datasets)
+def load_fold_hparams(argv, tail_path, datasets):
+    """This function loads the hparams for the training and evaluation of a fold and creates the experiment directory.
+    C and T are overridden, to be sure that network input shape matches the dataset
+    (e.g., after time cropping or channel sampling)."""
+    argv = argv + [
+        "--T",
+        str(datasets["train"].dataset.tensors[0].shape[1]),
+        "--C",
+        str(datasets["train"].dataset.tensors[0].shape[-2]),
+        "--n_train_examples",
+        str(datasets["train"].dataset.tensors[0].shape[0]),
+    ]
+
+    # loading hparams for the each training and evaluation processes
+    hparams_file, run_opts, overrides, hparams = load_hparams(argv)
+    hparams["exp_dir"] = os.path.join(hparams["output_folder"], tail_path)
+
+    # creating experiment directory
+    sb.create_experiment_directory(
+        experiment_directory=hparams["exp_dir"],
+        hyperparams_to_save=hparams_file,
+        overrides=overrides,
+    )
+    return hparams, run_opts
+
+
+def train_fold(argv, tail_path, datasets):
+    """This function loads the hparams for the training and evaluation of a fold and runs the experiment."""
+    hparams, run_opts = load_fold_hparams(argv, tail_path, datasets)
+
+    # Run training
+    run_experiment(hparams, run_opts, datasets)
+
+
+if __name__ == "__main__":
+    # taking a resource slot (CPU threads/cores and GPU) when trainings run in parallel (see utils/slots.py)
+    use_slot()
+    argv = sys.argv[1:]
+    # loading hparams to prepare the dataset and the data iterators
+    _, _, _, hparams = load_hparams(argv)
+
+    # defining data iterator to use
+    print("Prepare dataset iterators...")
+    tail_path, datasets = prepare_datasets(hparams)
+
+    if datasets is not None:
+        train_fold(argv, tail_path, datasets)
@@ -0,0 +1,351 @@
+"""
+Batched data augmentation of EEG trials (optional replacement of augment in hparam files).
+
+EEGAugmenter applies the augmentations of the hparam files (CutCat, RandAmp, RandomShift on the time axis and AddNoise
+with white noise) as speechbrain.processing.augmentation.Augmenter does with parallel_augment, parallel_augment_fixed_bs
+and concat_original: the batch is split into as many slices as augmentations, each slice is augmented with a different
+augmentation (in a random order shared by the copies), and the repeat_augment augmented copies of the batch are
+concatenated to the original batch. However, all the copies are computed at once:
+- CutCat and RandomShift only move samples, so both are computed with a single gather of the original samples into a
+preallocated output buffer, (1 + repeat_augment) x batch size trials;
+- RandAmp and the attenuation of the signals of AddNoise are a single per-trial gain on the buffer;
+- white noise is only drawn for the trials augmented with AddNoise, and added in place.
+The parameters of the augmentations are drawn as by the augmenters on their slice: the number of CutCat segments, the
+shift of RandomShift and whether AddNoise is applied (mix_prob) are drawn once per slice, the gain of RandAmp and the
+SNR of AddNoise once per trial, and AddNoise normalizes the noisy trials if normalize is True. Each augmented copy has
+its own random generator (seeded from seed), so that the copies are reproducible and do not depend on the other random
+draws of the training. The hparam files use speechbrain's Augmenter; EEGAugmenter can be used instead with:
+
+    augment: !new:utils.augmentation.EEGAugmenter
+        concat_original: True
+        repeat_augment: !ref <repeat_augment>
+        seed: !ref <seed>
+        cutcat: !ref <cutcat>
+        rand_amp: !ref <rand_amp>
+        time_shift: !ref <time_shift>
+        augment_noise: !ref <add_noise_white>
+"""
+
+import torch
+
+
+def uniform_to_int(u, low, high):
+    """This function maps uniform draws in [0, 1) to integers uniformly drawn in [low, high]."""
+    return low + (u * (high - low + 1)).long()
+
+
+class EEGAugmenter(torch.nn.Module):
+    """Batched parallel augmentation of EEG trials (batch, time, channels).
+
+    Arguments
+    ---------
+    cutcat: speechbrain.processing.speech_augmentation.CutCat
+        Combination of segments of trials: the odd segments of each trial are taken from the previous trial of its
+        slice (the last trial of the slice for the first one, as torch.roll(x, 1) in CutCat). If None, it is not
+        applied.
+    rand_amp: speechbrain.processing.speech_augmentation.RandAmp
+        Random gain. If None, it is not applied.
+    time_shift: speechbrain.processing.speech_augmentation.RandomShift
+        Random circular shift on the time axis (dim=1). If None, it is not applied.
+    augment_noise: speechbrain.processing.speech_augmentation.AddNoise
+        Injection of white noise (csv_file=None) with a random SNR, applied with probability mix_prob to its slice.
+        If None, it is not applied.
+    repeat_augment: int
+        Number of augmented copies of the batch. If 0, the batch is not augmented.
+    concat_original: bool
+        If True, the original batch is concatenated (first) with the augmented copies.
+    seed: int
+        Seed of the random generators of the augmented copies. If None, the seed of torch is used (e.g., the seed of
+        hparam files).
+
+    Example
+    -------
+    >>> from speechbrain.processing.speech_augmentation import RandAmp, RandomShift
+    >>> augment = EEGAugmenter(rand_amp=RandAmp(), time_shift=RandomShift(-10, 10), repeat_augment=2, seed=1)
+    >>> x = torch.randn(8, 100, 4)
+    >>> x_augmented, _ = augment(x)
+    >>> x_augmented.shape
+    torch.Size([24, 100, 4])
+    >>> torch.equal(x_augmented[:8], x)
+    True
+    >>> torch.equal(x_augmented, EEGAugmenter(rand_amp=RandAmp(), time_shift=RandomShift(-10, 10), repeat_augment=2, seed=1)(x)[0])
+    True
+    """
+
+    def __init__(
+        self,
+        cutcat=None,
+        rand_amp=None,
+        time_shift=None,
+        augment_noise=None,
+        repeat_augment=1,
+        concat_original=True,
+        seed=None,
+    ):
+        super().__init__()
+        if not isinstance(repeat_augment, int) or repeat_augment < 0:
+            raise ValueError("repeat_augment must be an integer >= 0.")
+        if time_shift is not None and time_shift.dim != 1:
+            raise ValueError("time_shift must shift the time axis (dim=1).")
+        if augment_noise is not None and augment_noise.csv_file is not None:
+            raise ValueError(
+                "augment_noise must inject white noise (csv_file=None)."
+            )
+        self.cutcat = cutcat
+        self.rand_amp = rand_amp
+        self.time_shift = time_shift
+        self.augment_noise = augment_noise
+        self.augmentations = [
+            name
+            for name in ["cutcat", "rand_amp", "time_shift", "augment_noise"]
+            if getattr(self, name) is not None
+        ]
+        self.repeat_augment = repeat_augment
+        self.concat_original = concat_original
+
+        # one generator per augmented copy (CPU, parameters of the augmentations), seeded from a common generator
+        seed = torch.initial_seed() if seed is None else seed
+        seeds = torch.randint(
+            2 ** 62,
+            (repeat_augment,),
+            generator=torch.Generator().manual_seed(seed),
+        )
+        self.generators = [torch.Generator().manual_seed(int(s)) for s in seeds]
+        # generator of the white noise (on the device of the trials), re-seeded by each copy
+        self.noise_generator = None
+        self.buffer = None
+        self.noise_buffer = None
+        self.indices = {}
+
+    def get_buffer(self, name, shape, like):
+        """Returns the first shape[0] trials of a preallocated buffer (reallocated if it is too small or on another
+        device)."""
+        buffer = getattr(self, name)
+        if (
+            buffer is None
+            or buffer.shape[0] < shape[0]
+            or buffer.shape[1:] != shape[1:]
+            or buffer.device != like.device
+            or buffer.dtype != like.dtype
+        ):
+            buffer = torch.empty(shape, device=like.device, dtype=like.dtype)
+            setattr(self, name, buffer)
+        return buffer[: shape[0]]
+
+    def get_indices(self, batch_size):
+        """Returns the slice of each trial of the batch and the previous trial of the same slice (as torch.roll in
+        CutCat). They are cached for each batch size."""
+        if batch_size not in self.indices:
+            trials = torch.arange(batch_size)
+            # slices of the batch (as in Augmenter with parallel_augment_fixed_bs)
+            bounds = torch.linspace(
+                0, batch_size, len(self.augmentations) + 1
+            ).to(torch.long)
+            slice_idx = torch.bucketize(trials, bounds[1:], right=True)
+            prev = torch.where(
+                trials == bounds[slice_idx],
+                bounds[slice_idx + 1] - 1,
+                trials - 1,
+            )
+            self.indices[batch_size] = slice_idx, prev
+        return self.indices[batch_size]
+
+    def sample_params(self, batch_size):
+        """Draws the parameters of the augmentations of each trial of the augmented copies. Each slice of the batch is
+        augmented with one augmentation; the other augmentations get their identity parameters (no source trial,
+        one CutCat segment, no shift, unit gain, no noise). As in the augmenters, the number of CutCat segments, the
+        shift and whether noise is added (mix_prob) are shared by the trials of a slice.
+
+        Returns
+        -------
+        params: dict
+            Parameters (CPU tensors) of the repeat_augment x batch_size augmented trials (src: trial providing the
+            odd CutCat segments, n_segments, shift, gain), the indices of the trials augmented with AddNoise in the
+            copies (noise_idx) and in the batch (noise_src), their noise factors, and the number of trials augmented
+            with AddNoise and the noise seed of each copy.
+        """
+        # order of the augmentations over the slices (shared by the copies, as in Augmenter)
+        order = torch.randperm(
+            len(self.augmentations), generator=self.generators[0]
+        )
+        # random draws of each copy: uniform draws of the parameters of the 4 augmentations for every trial (so that
+        # the draws do not depend on the order, the parameters of a slice are the draws of its first trial), draw of
+        # mix_prob and seed of the noise
+        draws, mix_draws, noise_seeds = [], [], []
+        for generator in self.generators:
+            draws.append(torch.rand(4, batch_size, generator=generator))
+            mix_draws.append(torch.rand(1, generator=generator))
+            noise_seeds.append(
+                int(torch.randint(2 ** 62, (1,), generator=generator))
+            )
+        draws = torch.stack(draws, dim=1)
+
+        slice_idx, prev = self.get_indices(batch_size)
+        # augmentation of each trial of each copy
+        augmentation = order[slice_idx].expand(len(self.generators), -1)
+        masks = {
+            name: augmentation == k for k, name in enumerate(self.augmentations)
+        }
+        no_mask = torch.zeros_like(augmentation, dtype=torch.bool)
+
+        src = torch.arange(batch_size).expand_as(augmentation)
+        n_segments = 1
+        if self.cutcat is not None:
+            src = torch.where(masks["cutcat"], prev, src)
+            n_segments = uniform_to_int(
+                draws[0, :, :1],
+                self.cutcat.min_num_segments,
+                self.cutcat.max_num_segments,
+            )
+        n_segments = torch.where(
+            masks.get("cutcat", no_mask), n_segments, torch.ones_like(src)
+        )
+
+        gain = torch.ones(augmentation.shape)
+        if self.rand_amp is not None:
+            amp = self.rand_amp.amp_low + draws[1] * (
+                self.rand_amp.amp_high - self.rand_amp.amp_low
+            )
+            gain = torch.where(masks["rand_amp"], amp, gain)
+
+        shift = 0
+        if self.time_shift is not None:
+            shift = uniform_to_int(
+                draws[2, :, :1],
+                self.time_shift.min_shift,
+                self.time_shift.max_shift,
+            )
+        shift = torch.where(
+            masks.get("time_shift", no_mask), shift, torch.zeros_like(src)
+        )
+
+        noise_mask = masks.get("augment_noise", no_mask)
+        noise_factor = torch.zeros(augmentation.shape)
+        if self.augment_noise is not None:
+            # as in AddNoise: the slice is left unchanged if the draw is above mix_prob
+            mixed = torch.cat(mix_draws) <= self.augment_noise.mix_prob
+            noise_mask = noise_mask & mixed[:, None]
+            snr = self.augment_noise.snr_low + draws[3] * (
+                self.augment_noise.snr_high - self.augment_noise.snr_low
+            )
+            # as in AddNoise: the signal is attenuated by 1 - factor, the noise has factor x the signal amplitude
+            noise_factor = torch.where(
+                noise_mask, 1 / (10 ** (snr / 20) + 1), noise_factor
+            )
+            gain = torch.where(noise_mask, 1 - noise_factor, gain)
+        noise_idx = noise_mask.view(-1).nonzero().view(-1)
+        return {
+            "src": src.reshape(-1),
+            "n_segments": n_segments.view(-1),
+            "shift": shift.view(-1),
+            "gain": gain.view(-1),
+            "noise_idx": noise_idx,
+            "noise_src": noise_idx % batch_size,
+            "noise_factor": noise_factor.view(-1)[noise_idx],
+            "noise_counts": noise_mask.sum(dim=1).tolist(),
+            "noise_seeds": noise_seeds,
+        }
+
+    def forward(self, x, lengths=None):
+        """Augments a batch of trials.
+
+        Arguments
+        ---------
+        x: torch.Tensor (batch, time, channels)
+            Batch of trials.
+        lengths: torch.Tensor
+            Relative lengths of the trials (unused, trials have the same length). They are repeated as the trials.
+
+        Returns
+        -------
+        output: torch.Tensor ((1 + repeat_augment) x batch, time, channels)
+            Original (if concat_original) and augmented trials. It is a view of a buffer overwritten at the next call.
+        lengths: torch.Tensor
+            Relative lengths of the output trials (None if lengths is None).
+        """
+        if self.repeat_augment == 0 or len(self.augmentations) == 0:
+            return x, lengths
+        batch_size, n_times = x.shape[0], x.shape[1]
+        n_augmented = self.repeat_augment * batch_size
+        n_original = batch_size if self.concat_original else 0
+        output = self.get_buffer(
+            "buffer", (n_original + n_augmented,) + x.shape[1:], x
+        )
+        if self.concat_original:
+            output[:batch_size].copy_(x)
+        augmented = output[n_original:]
+        params = self.sample_params(batch_size)
+
+        # CutCat and RandomShift: augmented[k, t] = x[src_trial[k, t], src_time[k, t]]
+        idx = torch.stack(
+            [params["src"], params["n_segments"], params["shift"]]
+        ).to(x.device)
+        src, n_segments, shift = idx[:, :, None].unbind()
+        times = torch.arange(n_times, device=x.device)
+        # segment of each time sample (the n segments start at int(j * n_times / n), as in CutCat)
+        segment = ((times + 1) * n_segments - 1) // n_times
+        src_trial = torch.where(
+            segment % 2 == 1,
+            src,
+            torch.arange(batch_size, device=x.device).repeat(
+                self.repeat_augment
+            )[:, None],
+        )
+        # shifted by s: output[t] = input[t - s] (as torch.roll)
+        src_time = (times - shift) % n_times
+        torch.index_select(
+            x.reshape(batch_size * n_times, -1),
+            0,
+            (src_trial * n_times + src_time).view(-1),
+            out=augmented.view(n_augmented * n_times, -1),
+        )
+
+        # RandAmp and attenuation of AddNoise
+        augmented.mul_(
+            params["gain"]
+            .to(x.device)
+            .view((n_augmented,) + (1,) * (x.dim() - 1))
+        )
+
+        # AddNoise (white noise with factor x RMS of the trial, per channel)
+        n_noise = params["noise_idx"].shape[0]
+        if n_noise > 0:
+            noise = self.get_buffer("noise_buffer", (n_noise,) + x.shape[1:], x)
+            if (
+                self.noise_generator is None
+                or self.noise_generator.device != x.device
+            ):
+                self.noise_generator = torch.Generator(device=x.device)
+            # noise of each augmented copy (with its own seed)
+            for seed, noise_copy in zip(
+                params["noise_seeds"], noise.split(params["noise_counts"])
+            ):
+                self.noise_generator.manual_seed(seed)
+                torch.randn(
+                    noise_copy.shape,
+                    generator=self.noise_generator,
+                    out=noise_copy,
+                )
+            # ratio of the RMS of signal and noise (the RMS is the norm on the time axis up to the same factor)
+            signal_norm = torch.linalg.vector_norm(
+                x[params["noise_src"].to(x.device)], dim=1, keepdim=True
+            )
+            noise_norm = torch.linalg.vector_norm(noise, dim=1, keepdim=True)
+            noise_factor = params["noise_factor"].to(x.device)
+            noise.mul_(
+                noise_factor.view((n_noise,) + (1,) * (x.dim() - 1))
+                * signal_norm
+                / (noise_norm + 1e-14)
+            )
+            noise_idx = params["noise_idx"].to(x.device)
+            augmented.index_add_(0, noise_idx, noise)
+            if self.augment_noise.normalize:
+                # as in AddNoise: trials are scaled down so that the maximum amplitude of each channel is at most 1
+                abs_max = augmented[noise_idx].abs().amax(dim=1, keepdim=True)
+                augmented.index_copy_(
+                    0, noise_idx, augmented[noise_idx] / abs_max.clamp(min=1.0),
+                )
+
+        if lengths is not None:
+            lengths = lengths.repeat(output.shape[0] // batch_size)
+        return output, lengths
@@ -0,0 +1,151 @@
+#!/usr/bin/python
+"""
+Microbenchmark of the attention implementations of EEGConformer (fused scaled-dot-product attention vs. explicit
+matrix products and softmax, see attn_use_sdpa in hparam files).
+
+For each hparam file, the network is built with the hparams of the file (i.e., with the input shape (T, C) and the
+batch size of the dataset) and the time of forward and backward passes (training) and of forward passes (inference)
+is measured with both implementations, together with the peak memory (on CUDA devices only). The maximum absolute
+difference between the outputs of the two implementations is also reported.
+
+Usage:
+    > python utils/benchmark_attention.py --device cuda:0
+    > python utils/benchmark_attention.py hparams/MotorImagery/BNCI2014001/EEGConformer.yaml --device cpu
+"""
+
+import argparse
+import copy
+import glob
+import os
+import sys
+import time
+import torch
+from hyperpyyaml import load_hyperpyyaml
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from models.EEGConformer import MultiHeadAttention  # noqa: E402
+
+# Values of the placeholders of hparam files (they do not affect the network)
+PLACEHOLDER_OVERRIDES = {
+    "data_folder": "",
+    "cached_data_folder": "",
+    "output_folder": "",
+    "data_iterator_name": "leave-one-session-out",
+    "target_subject_idx": 0,
+    "target_session_idx": 0,
+}
+
+
+def load_models(hparams_file):
+    """This function builds the network of an hparam file with both attention implementations (with the same
+    parameters). It returns the two networks (fused and explicit attention), the input shape (T, C) and the batch
+    size."""
+    with open(hparams_file) as fin:
+        hparams = load_hyperpyyaml(fin, PLACEHOLDER_OVERRIDES)
+    model_sdpa = hparams["model"]
+    model = copy.deepcopy(model_sdpa)
+    for module in model_sdpa.modules():
+        if isinstance(module, MultiHeadAttention):
+            module.use_sdpa = True
+    for module in model.modules():
+        if isinstance(module, MultiHeadAttention):
+            module.use_sdpa = False
+    return (
+        model_sdpa,
+        model,
+        (hparams["T"], hparams["C"]),
+        hparams["batch_size"],
+    )
+
+
+def synchronize(device):
+    """This function waits for the operations queued on a CUDA device."""
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+
+
+def measure(model, x, n_repeats, train=True):
+    """This function measures the average time (ms) of a forward (and backward, if train) pass and the peak memory
+    (MB, on CUDA devices only)."""
+    device = x.device
+    model.train(train)
+    for i in range(n_repeats + 3):
+        if i == 3:
+            # the first passes are warm-up passes
+            synchronize(device)
+            if device.type == "cuda":
+                torch.cuda.reset_peak_memory_stats(device)
+            start_time = time.perf_counter()
+        if train:
+            model.zero_grad(set_to_none=True)
+            model(x).sum().backward()
+        else:
+            with torch.no_grad():
+                model(x)
+    synchronize(device)
+    elapsed = (time.perf_counter() - start_time) / n_repeats * 1000
+    peak_memory = None
+    if device.type == "cuda":
+        peak_memory = torch.cuda.max_memory_allocated(device) / 2 ** 20
+    return elapsed, peak_memory
+
+
+def format_memory(peak_memory):
+    """This function formats a peak memory value."""
+    return "n/a" if peak_memory is None else "{0:.1f}MB".format(peak_memory)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark of the attention implementations of EEGConformer"
+    )
+    parser.add_argument(
+        "hparams",
+        nargs="*",
+        help="Hparam files (default: all EEGConformer hparam files of MotorImagery datasets)",
+    )
+    parser.add_argument("--device", default="cpu", help="Device")
+    parser.add_argument(
+        "--n_repeats", type=int, default=20, help="Number of measured passes"
+    )
+    FLAGS = parser.parse_args()
+
+    hparams_files = FLAGS.hparams
+    if len(hparams_files) == 0:
+        hparams_files = sorted(
+            glob.glob(
+                os.path.join(
+                    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                    "hparams",
+                    "MotorImagery",
+                    "*",
+                    "EEGConformer.yaml",
+                )
+            )
+        )
+    device = torch.device(FLAGS.device)
+
+    for hparams_file in hparams_files:
+        model_sdpa, model, (T, C), batch_size = load_models(hparams_file)
+        model_sdpa, model = model_sdpa.to(device), model.to(device)
+        x = torch.randn(batch_size, T, C, 1, device=device)
+
+        with torch.no_grad():
+            max_diff = (
+                (model_sdpa.eval()(x) - model.eval()(x)).abs().max().item()
+            )
+        print(
+            "{0} (T={1}, C={2}, batch size={3}), max abs output difference: {4:.2e}".format(
+                hparams_file, T, C, batch_size, max_diff
+            )
+        )
+        for name, train in [("forward+backward", True), ("forward", False)]:
+            for label, net in [("sdpa", model_sdpa), ("explicit", model)]:
+                elapsed, peak_memory = measure(
+                    net, x, FLAGS.n_repeats, train=train
+                )
+                print(
+                    "    {0:16s} {1:8s} {2:8.2f}ms  peak memory: {3}".format(
+                        name, label, elapsed, format_memory(peak_memory)
+                    )
+                )
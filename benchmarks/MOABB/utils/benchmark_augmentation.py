@@ -0,0 +1,173 @@
+#!/usr/bin/python
+"""
+Benchmark of data augmentation (batched EEGAugmenter vs. speechbrain Augmenter of the hparam files).
+
+For each hparam file (i.e., each model and dataset), the augmenters of the file (CutCat, RandAmp, RandomShift and
+AddNoise) are applied to random batches with the input shape (T, C) and the batch size of the file, by EEGAugmenter and
+by speechbrain.processing.augmentation.Augmenter (configured as in the hparam files), as in
+MOABBBrain.prepare_inputs. The average time (ms) of an augmentation is reported for each value of repeat_augment,
+together with its share of a training step (augmentation, normalization, forward pass, loss, backward pass and
+optimizer step on the augmented batch).
+
+Usage:
+    > python utils/benchmark_augmentation.py --device cpu
+    > python utils/benchmark_augmentation.py hparams/MotorImagery/BNCI2014001/EEGNet.yaml --repeat_augment 1 2 4
+"""
+
+import argparse
+import glob
+import os
+import sys
+import time
+import torch
+from speechbrain.processing.augmentation import Augmenter
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.augmentation import EEGAugmenter  # noqa: E402
+from utils.benchmark_attention import synchronize  # noqa: E402
+from utils.benchmark_compile import load_hparams  # noqa: E402
+
+
+def create_augmenters(hparams, repeat_augment):
+    """This function creates the speechbrain Augmenter and the EEGAugmenter with the augmenters of an hparam file."""
+    augmentations = {
+        "cutcat": hparams["cutcat"],
+        "rand_amp": hparams["rand_amp"],
+        "time_shift": hparams["time_shift"],
+        "augment_noise": hparams["add_noise_white"],
+    }
+    augmenter = Augmenter(
+        parallel_augment=True,
+        concat_original=True,
+        parallel_augment_fixed_bs=True,
+        repeat_augment=repeat_augment,
+        shuffle_augmentations=True,
+        min_augmentations=4,
+        max_augmentations=4,
+        **augmentations,
+    )
+    eeg_augmenter = EEGAugmenter(
+        repeat_augment=repeat_augment, seed=hparams["seed"], **augmentations
+    )
+    return augmenter, eeg_augmenter
+
+
+def augment(augmenter, x):
+    """This function augments a batch (batch, time, channels, 1) as MOABBBrain.prepare_inputs."""
+    inputs, _ = augmenter(
+        x.squeeze(3), lengths=torch.ones(x.shape[0], device=x.device)
+    )
+    return inputs.unsqueeze(3)
+
+
+def measure(augmenter, x, n_repeats, n_warmup=3):
+    """This function measures the average time (ms) of an augmentation."""
+    for i in range(n_repeats + n_warmup):
+        if i == n_warmup:
+            synchronize(x.device)
+            start_time = time.perf_counter()
+        augment(augmenter, x)
+    synchronize(x.device)
+    return (time.perf_counter() - start_time) / n_repeats * 1000
+
+
+def measure_step(hparams, model, optimizer, augmenter, x, y, n_repeats):
+    """This function measures the average time (ms) of a training step (augmentation, normalization, forward pass,
+    loss, backward pass and optimizer step)."""
+    model.train()
+    for i in range(n_repeats + 3):
+        if i == 3:
+            synchronize(x.device)
+            start_time = time.perf_counter()
+        inputs = hparams["normalize"](augment(augmenter, x))
+        targets = torch.cat(inputs.shape[0] // y.shape[0] * [y])
+        optimizer.zero_grad(set_to_none=True)
+        loss = torch.nn.functional.nll_loss(model(inputs), targets)
+        loss.backward()
+        optimizer.step()
+    synchronize(x.device)
+    return (time.perf_counter() - start_time) / n_repeats * 1000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark of data augmentation (EEGAugmenter vs. speechbrain Augmenter)"
+    )
+    parser.add_argument(
+        "hparams",
+        nargs="*",
+        help="Hparam files (default: all hparam files, i.e. all models and datasets)",
+    )
+    parser.add_argument("--device", default="cpu", help="Device")
+    parser.add_argument(
+        "--repeat_augment",
+        type=int,
+        nargs="+",
+        default=[1, 2, 4],
+        help="Numbers of augmented copies of the batch",
+    )
+    parser.add_argument(
+        "--n_repeats",
+        type=int,
+        default=50,
+        help="Number of measured augmentations",
+    )
+    FLAGS = parser.parse_args()
+
+    hparams_files = FLAGS.hparams
+    if len(hparams_files) == 0:
+        hparams_files = sorted(
+            glob.glob(
+                os.path.join(
+                    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                    "hparams",
+                    "*",
+                    "*",
+                    "*.yaml",
+                )
+            )
+        )
+    device = torch.device(FLAGS.device)
+
+    for hparams_file in hparams_files:
+        hparams = load_hparams(hparams_file)
+        model = hparams["model"].to(device)
+        optimizer = hparams["optimizer"](model.parameters())
+        x = torch.randn(
+            hparams["batch_size"], hparams["T"], hparams["C"], 1, device=device
+        )
+        y = torch.randint(
+            hparams["n_classes"], (hparams["batch_size"],), device=device
+        )
+        print(
+            "{0} (T={1}, C={2}, batch size={3})".format(
+                hparams_file, hparams["T"], hparams["C"], hparams["batch_size"]
+            )
+        )
+        for repeat_augment in FLAGS.repeat_augment:
+            augmenter, eeg_augmenter = create_augmenters(
+                hparams, repeat_augment
+            )
+            times, shares = [], []
+            for aug in [augmenter, eeg_augmenter]:
+                times.append(measure(aug, x, FLAGS.n_repeats))
+                step_time = measure_step(
+                    hparams,
+                    model,
+                    optimizer,
+                    aug,
+                    x,
+                    y,
+                    max(1, FLAGS.n_repeats // 5),
+                )
+                shares.append(times[-1] / step_time)
+            print(
+                "    repeat_augment {0}  Augmenter {1:7.2f}ms ({2:4.1%} of step)  EEGAugmenter {3:7.2f}ms ({4:4.1%} of step)  speedup {5:.2f}x".format(
+                    repeat_augment,
+                    times[0],
+                    shares[0],
+                    times[1],
+                    shares[1],
+                    times[0] / times[1],
+                )
+            )
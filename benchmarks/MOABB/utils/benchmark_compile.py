@@ -0,0 +1,124 @@
+#!/usr/bin/python
+"""
+Benchmark of compiled training steps (see compile_model in hparam files).
+
+For each hparam file (i.e., each model and dataset), the network is built with the hparams of the file (input shape
+(T, C), number of classes, batch size and optimizer) and the number of training steps (forward pass, loss, backward
+pass and optimizer step) per second is measured with the eager network and with the compiled network. The compilation
+time (first compiled steps) is reported separately. If compilation fails, the eager network is used (as in train.py)
+and the failure is reported.
+
+Usage:
+    > python utils/benchmark_compile.py --device cpu
+    > python utils/benchmark_compile.py hparams/MotorImagery/BNCI2014001/EEGNet.yaml --n_steps 50
+"""
+
+import argparse
+import copy
+import glob
+import os
+import sys
+import time
+import torch
+from hyperpyyaml import load_hyperpyyaml
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.benchmark_attention import (  # noqa: E402
+    PLACEHOLDER_OVERRIDES,
+    synchronize,
+)
+from utils.compiled_model import CompiledModel  # noqa: E402
+
+
+def load_hparams(hparams_file):
+    """This function loads an hparam file (with placeholder values)."""
+    with open(hparams_file) as fin:
+        return load_hyperpyyaml(fin, PLACEHOLDER_OVERRIDES)
+
+
+def measure(model, optimizer, x, y, n_steps, n_warmup=3):
+    """This function measures the number of training steps per second. It returns the steps per second and the time
+    (s) of the warm-up steps (including the compilation time for compiled networks)."""
+    device = x.device
+    model.train()
+    start_time = time.perf_counter()
+    for i in range(n_steps + n_warmup):
+        if i == n_warmup:
+            synchronize(device)
+            warmup_time = time.perf_counter() - start_time
+            start_time = time.perf_counter()
+        optimizer.zero_grad(set_to_none=True)
+        loss = torch.nn.functional.nll_loss(model(x), y)
+        loss.backward()
+        optimizer.step()
+    synchronize(device)
+    return n_steps / (time.perf_counter() - start_time), warmup_time
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark of eager and compiled training steps"
+    )
+    parser.add_argument(
+        "hparams",
+        nargs="*",
+        help="Hparam files (default: all hparam files, i.e. all models and datasets)",
+    )
+    parser.add_argument("--device", default="cpu", help="Device")
+    parser.add_argument(
+        "--n_steps", type=int, default=20, help="Number of measured steps"
+    )
+    FLAGS = parser.parse_args()
+
+    hparams_files = FLAGS.hparams
+    if len(hparams_files) == 0:
+        hparams_files = sorted(
+            glob.glob(
+                os.path.join(
+                    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                    "hparams",
+                    "*",
+                    "*",
+                    "*.yaml",
+                )
+            )
+        )
+    device = torch.device(FLAGS.device)
+
+    for hparams_file in hparams_files:
+        hparams = load_hparams(hparams_file)
+        model = hparams["model"].to(device)
+        compiled_model = CompiledModel(copy.deepcopy(model))
+        x = torch.randn(
+            hparams["batch_size"], hparams["T"], hparams["C"], 1, device=device
+        )
+        y = torch.randint(
+            hparams["n_classes"], (hparams["batch_size"],), device=device
+        )
+
+        eager_steps, _ = measure(
+            model, hparams["optimizer"](model.parameters()), x, y, FLAGS.n_steps
+        )
+        compiled_steps, compile_time = measure(
+            compiled_model,
+            hparams["optimizer"](compiled_model.parameters()),
+            x,
+            y,
+            FLAGS.n_steps,
+        )
+        print(
+            "{0} (T={1}, C={2}, batch size={3})".format(
+                hparams_file, hparams["T"], hparams["C"], hparams["batch_size"]
+            )
+        )
+        print(
+            "    eager {0:8.2f} steps/s  compiled {1:8.2f} steps/s  speedup {2:.2f}x  warm-up (compilation) {3:.1f}s{4}".format(
+                eager_steps,
+                compiled_steps,
+                compiled_steps / eager_steps,
+                compile_time,
+                ""
+                if compiled_model.compiled is not None
+                else "  (compilation failed, eager fallback)",
+            )
+        )
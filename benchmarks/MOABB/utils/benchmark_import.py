@@ -0,0 +1,114 @@
+#!/usr/bin/python
+"""
+Import-time benchmark of the training scripts (startup cost paid by each training process, e.g. during hparam tuning).
+
+Each module (default: train and run) is imported in a new Python process with -X importtime, n_repeats times. The
+best import time is reported, together with the slowest packages imported (cumulative import time). The benchmark
+also guards the lazy imports (see utils/registry.py): it fails (exit status 1) if a module imports one of
+LAZY_MODULES at startup, or if its import time exceeds --max_time.
+
+Usage:
+    > python utils/benchmark_import.py
+    > python utils/benchmark_import.py train --n_repeats 5 --max_time 5
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+# Modules that must only be imported when they are used (e.g., when preparing datasets)
+LAZY_MODULES = [
+    "moabb",
+    "mne.channels",
+    "torchinfo",
+    "scipy.signal",
+    "sklearn",
+    "matplotlib",
+    "pyriemann",
+]
+
+
+def measure_import(module, cwd):
+    """This function imports a module in a new Python process and returns the cumulative import time (s) of each
+    imported module."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + module],
+        cwd=cwd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    import_times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:") :].split("|")
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue  # header
+        import_times[fields[2].strip()] = int(fields[1]) / 1e6
+    return import_times
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Import-time benchmark of the training scripts"
+    )
+    parser.add_argument(
+        "modules",
+        nargs="*",
+        default=["train", "run"],
+        help="Modules to import (default: train and run)",
+    )
+    parser.add_argument(
+        "--n_repeats", type=int, default=3, help="Number of imports"
+    )
+    parser.add_argument(
+        "--n_top", type=int, default=8, help="Number of reported packages"
+    )
+    parser.add_argument(
+        "--max_time",
+        type=float,
+        default=None,
+        help="Maximum import time (s). If exceeded, the benchmark fails",
+    )
+    FLAGS = parser.parse_args()
+
+    cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    failed = False
+    for module in FLAGS.modules:
+        import_times = min(
+            [measure_import(module, cwd) for i in range(FLAGS.n_repeats)],
+            key=lambda times: times[module],
+        )
+        print(
+            "{0}: {1:.2f}s (best of {2})".format(
+                module, import_times[module], FLAGS.n_repeats
+            )
+        )
+        packages = sorted(
+            [
+                (name, import_time)
+                for name, import_time in import_times.items()
+                if "." not in name and name != module
+            ],
+            key=lambda item: -item[1],
+        )
+        for name, import_time in packages[: FLAGS.n_top]:
+            print("    {0:30s} {1:6.2f}s".format(name, import_time))
+
+        eager_modules = [name for name in LAZY_MODULES if name in import_times]
+        if len(eager_modules) > 0:
+            print(
+                "    FAILED: {0} imported at startup".format(
+                    ", ".join(eager_modules)
+                )
+            )
+            failed = True
+        if FLAGS.max_time is not None and import_times[module] > FLAGS.max_time:
+            print(
+                "    FAILED: import time above {0:.2f}s".format(FLAGS.max_time)
+            )
+            failed = True
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,117 @@
+#!/usr/bin/python
+"""
+Latency benchmark of the streaming decoder (see inference.py).
+
+A synthetic continuous stream (white noise with the C channels of the network, at the original sampling rate of the
+dataset) is pushed to the decoder in chunks, as an online acquisition would do. For each decoded window (one every
+hop), the latency is the time between the arrival of the chunk completing the window and the output of the class
+probabilities (pre-processing and forward pass). The median (p50), the 99th percentile (p99) and the maximum latency
+are reported, together with the latency relative to the hop (the decoder keeps up with the stream only if it is < 1).
+
+The decoder is created from the experiment directory of a trained network, or from an hparam file (the network is
+then randomly initialized, which does not affect the latency).
+
+Usage:
+    > python utils/benchmark_streaming.py results/MotorImagery/BNCI2014001/EEGNet/1986/leave-one-session-out/sub-001/session_E
+    > python utils/benchmark_streaming.py hparams/MotorImagery/BNCI2014001/EEGNet.yaml --hop 0.05 --device cpu
+"""
+
+import argparse
+import os
+import sys
+import time
+import numpy as np
+from hyperpyyaml import load_hyperpyyaml
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from inference import StreamingDecoder  # noqa: E402
+from utils.benchmark_attention import PLACEHOLDER_OVERRIDES  # noqa: E402
+
+
+def create_decoder(path, hop, pad, device):
+    """This function creates the decoder of a trained network (experiment directory) or of a randomly initialized
+    network (hparam file)."""
+    if os.path.isdir(path):
+        return StreamingDecoder.from_exp_dir(
+            path, hop=hop, pad=pad, device=device
+        )
+    with open(path) as fin:
+        hparams = load_hyperpyyaml(fin, PLACEHOLDER_OVERRIDES)
+    return StreamingDecoder(
+        hparams, hparams["model"], hop=hop, pad=pad, device=device
+    )
+
+
+def measure_latency(decoder, duration, chunk, n_warmup=10, seed=1234):
+    """This function streams duration seconds of white noise in chunks of chunk seconds and returns the latency (ms)
+    of each decoded window (warm-up windows excluded)."""
+    rng = np.random.default_rng(seed)
+    chunk_length = max(1, int(round(chunk * decoder.srate_in)))
+    n_chunks = int(np.ceil(duration * decoder.srate_in / chunk_length))
+    latencies = []
+    for i in range(n_chunks):
+        x = 1e-5 * rng.standard_normal(
+            (chunk_length, decoder.buffer.data.shape[1]), dtype=np.float32
+        )
+        start_time = time.perf_counter()
+        outputs = decoder.push(x)
+        elapsed = (time.perf_counter() - start_time) * 1000
+        if len(outputs) > 0:
+            # windows decoded from the same chunk wait for each other
+            latencies.extend([elapsed] * len(outputs))
+    return np.array(latencies[n_warmup:])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Latency benchmark of the streaming decoder"
+    )
+    parser.add_argument(
+        "path", help="Experiment directory of a trained network, or hparam file"
+    )
+    parser.add_argument(
+        "--hop",
+        type=float,
+        default=0.1,
+        help="Time (s) between decoded windows",
+    )
+    parser.add_argument(
+        "--chunk",
+        type=float,
+        default=0.02,
+        help="Time (s) of the chunks of the stream",
+    )
+    parser.add_argument(
+        "--pad",
+        type=float,
+        default=None,
+        help="Time (s) of the stream kept before the decoded window. Default: 3 / fmin (at least 1 s)",
+    )
+    parser.add_argument(
+        "--duration",
+        type=float,
+        default=60.0,
+        help="Time (s) of the synthetic stream",
+    )
+    parser.add_argument("--device", default="cpu", help="Device")
+    FLAGS = parser.parse_args()
+
+    decoder = create_decoder(FLAGS.path, FLAGS.hop, FLAGS.pad, FLAGS.device)
+    latencies = measure_latency(decoder, FLAGS.duration, FLAGS.chunk)
+    hop_ms = decoder.hop_length / decoder.srate_in * 1000
+    p50, p99 = np.percentile(latencies, [50, 99])
+    print(
+        "{0} (T={1}, C={2}, window {3:.2f}s, hop {4:.0f}ms, chunk {5:.0f}ms)".format(
+            FLAGS.path,
+            decoder.T,
+            decoder.C,
+            decoder.T / decoder.srate,
+            hop_ms,
+            FLAGS.chunk * 1000,
+        )
+    )
+    print(
+        "    {0} windows  latency p50 {1:.2f}ms  p99 {2:.2f}ms  max {3:.2f}ms  p99/hop {4:.3f}".format(
+            latencies.shape[0], p50, p99, latencies.max(), p99 / hop_ms
+        )
+    )
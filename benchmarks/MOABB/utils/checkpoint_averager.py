@@ -0,0 +1,63 @@
+"""
+In-memory averaging of model checkpoints.
+
+During training, the parameters of the models to average (the last or the best ones, see test_with and avg_models in
+hparam files) are kept in memory instead of being written to disk as checkpoints at each epoch, and read back at
+evaluation time. The average is computed only once, and only the averaged model is saved as a checkpoint.
+"""
+
+from collections import deque
+from speechbrain.utils.checkpoints import average_state_dicts
+
+
+class CheckpointAverager(object):
+    """In-memory averager of the parameters (state dicts) of a model saved during training.
+    As speechbrain checkpointer (with keep_recent=True), the num_to_keep most recently added state dicts are kept.
+
+    Arguments
+    ---------
+    num_to_keep: int
+        Number of state dicts to keep (and average).
+
+    Example
+    -------
+    >>> import torch
+    >>> model = torch.nn.Linear(2, 1)
+    >>> averager = CheckpointAverager(num_to_keep=2)
+    >>> averager.add(model.state_dict(), meta={"acc": 0.5, "epoch": 1})
+    >>> len(averager)
+    1
+    >>> model.load_state_dict(averager.average())
+    <All keys matched successfully>
+    """
+
+    def __init__(self, num_to_keep):
+        self.entries = deque(maxlen=num_to_keep)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, state_dict, meta=None):
+        """Stores a copy (on cpu) of a state dict, with its meta information (e.g., epoch and metrics)."""
+        state_dict = {
+            key: value.detach().to("cpu", copy=True)
+            for key, value in state_dict.items()
+        }
+        self.entries.append((meta, state_dict))
+
+    def last_meta(self):
+        """Returns the meta information of the most recently added state dict."""
+        return self.entries[-1][0]
+
+    def average(self):
+        """Returns the average of the stored state dicts."""
+        return average_state_dicts(
+            [
+                {key: value.clone() for key, value in state_dict.items()}
+                for _, state_dict in self.entries
+            ]
+        )
+
+    def clear(self):
+        """Removes all the stored state dicts."""
+        self.entries.clear()
@@ -0,0 +1,82 @@
+"""
+Compiled training steps (see compile_model in hparam files).
+
+The network is compiled with torch.compile, so that both its forward pass and its backward pass (traced by
+AOTAutograd) run as compiled graphs. Compilation is lazy: torch.compile only fails at the first call of the compiled
+network (e.g., no C++ compiler, unsupported operators), or later when a new input shape triggers a recompilation. In
+these cases the eager network is used for the rest of the training, so that enabling compile_model never breaks a
+training.
+
+The backward graph is compiled at the first backward pass, outside the forward pass of the network: the first training
+step is therefore checked in the forward pass (with a backward pass on the compiled graph), so that failures of the
+backward compilation fall back to the eager network as well.
+"""
+
+import logging
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+class CompiledModel(torch.nn.Module):
+    """Network compiled with torch.compile, falling back to the eager network if compilation fails.
+
+    Arguments
+    ---------
+    model: torch.nn.Module
+        Network to compile. Its parameters are shared with the compiled network (the network is saved and loaded as
+        usual, e.g. by the checkpointer).
+    **compile_kwargs: dict
+        Arguments of torch.compile (e.g., mode or dynamic).
+
+    Example
+    -------
+    >>> model = CompiledModel(torch.nn.Linear(4, 2))
+    >>> model.disable()
+    >>> model(torch.rand(3, 4)).shape
+    torch.Size([3, 2])
+    >>> model.compiled is None
+    True
+    """
+
+    def __init__(self, model, **compile_kwargs):
+        super().__init__()
+        self.model = model
+        self.compiled = None
+        self.backward_checked = False
+        try:
+            # not registered as a submodule, the parameters are those of model
+            object.__setattr__(
+                self, "compiled", torch.compile(model, **compile_kwargs)
+            )
+        except Exception as e:
+            self.disable(e)
+
+    def disable(self, error=None):
+        """Switches to the eager network."""
+        if error is not None:
+            logger.warning(
+                "torch.compile failed, the eager network is used: {0}".format(
+                    error
+                )
+            )
+        object.__setattr__(self, "compiled", None)
+
+    def check_backward(self, outputs):
+        """Compiles and runs the backward graph of the compiled network (the gradients are not accumulated)."""
+        params = [p for p in self.model.parameters() if p.requires_grad]
+        torch.autograd.grad(
+            outputs.sum(), params, retain_graph=True, allow_unused=True
+        )
+        self.backward_checked = True
+
+    def forward(self, *args, **kwargs):
+        if self.compiled is not None:
+            try:
+                outputs = self.compiled(*args, **kwargs)
+                if not self.backward_checked and outputs.requires_grad:
+                    self.check_backward(outputs)
+                return outputs
+            except Exception as e:
+                self.disable(e)
+        return self.model(*args, **kwargs)
@@ -16,7 +16,11 @@ from itertools import islice
 import torch
 from torch.utils.data import TensorDataset, DataLoader
 import os
+from functools import partial
 from utils.prepare import prepare_data
+from utils.fold_cache import fold_dtype, load_or_prepare_fold
+from utils.subject_pool import get_subject_pool
+from utils.montage import get_montage_index
 
 
 def nth(iterable, n, default=None):
@@ -47,35 +51,48 @@ def get_idx_train_valid_classbalanced(idx_train, valid_ratio, y):
     return idx_train, idx_valid
 
 
+def to_input_tensor(x):
+    """This function converts EEG signals (N_examples, T, C) into a tensor (N_examples, T, C, 1) with the same data type.
+    Contiguous and writable arrays are wrapped without copies. Other arrays (e.g., read-only views of
+    memory-mapped files) are copied."""
+    x = np.ascontiguousarray(x)
+    if not x.flags.writeable:
+        x = x.copy()
+    return torch.from_numpy(x[..., None])
+
+
+def get_fold_arrays(xyidx_train, xyidx_valid, xyidx_test, dtype="float32"):
+    """This function returns the dictionary of a fold with contiguous EEG signals (N_examples, T, C) of type dtype,
+    labels and indices of the examples for training, validation and test sets."""
+    fold = {}
+    for name, (x, y, idx) in zip(
+        ["train", "valid", "test"], [xyidx_train, xyidx_valid, xyidx_test]
+    ):
+        fold["x_" + name] = np.ascontiguousarray(x, dtype=dtype)
+        fold["y_" + name] = np.asarray(y)
+        fold["idx_" + name] = np.asarray(idx)
+    return fold
+
+
 def get_dataloader(batch_size, xy_train, xy_valid, xy_test):
     """This function returns dataloaders for training, validation and test"""
     x_train, y_train = xy_train[0], xy_train[1]
     x_valid, y_valid = xy_valid[0], xy_valid[1]
     x_test, y_test = xy_test[0], xy_test[1]
 
-    inps = torch.Tensor(
-        x_train.reshape(
-            (x_train.shape[0], x_train.shape[1], x_train.shape[2], 1,)
-        )
-    )
+    inps = to_input_tensor(x_train)
     tgts = torch.tensor(y_train, dtype=torch.long)
     ds = TensorDataset(inps, tgts)
     train_loader = DataLoader(
         ds, batch_size=batch_size, shuffle=True, pin_memory=True
     )
 
-    inps = torch.Tensor(
-        x_valid.reshape(
-            (x_valid.shape[0], x_valid.shape[1], x_valid.shape[2], 1,)
-        )
-    )
+    inps = to_input_tensor(x_valid)
     tgts = torch.tensor(y_valid, dtype=torch.long)
     ds = TensorDataset(inps, tgts)
     valid_loader = DataLoader(ds, batch_size=batch_size, pin_memory=True)
 
-    inps = torch.Tensor(
-        x_test.reshape((x_test.shape[0], x_test.shape[1], x_test.shape[2], 1,))
-    )
+    inps = to_input_tensor(x_test)
     tgts = torch.tensor(y_test, dtype=torch.long)
     ds = TensorDataset(inps, tgts)
     test_loader = DataLoader(ds, batch_size=batch_size, pin_memory=True)
@@ -83,6 +100,60 @@ def get_dataloader(batch_size, xy_train, xy_valid, xy_test):
     return train_loader, valid_loader, test_loader
 
 
+class DeviceTensorLoader(object):
+    """Loader yielding mini-batches of in-memory tensors that are stored on a device.
+    The whole set is moved to the device only once, and each mini-batch is obtained by indexing the stored tensors
+    (with a random permutation computed on the device when shuffling). This avoids the per-batch collation, pinning
+    and host-to-device copies of DataLoader, that dominate the step time of small models and datasets.
+
+    Arguments
+    ---------
+    dataset: torch.utils.data.TensorDataset
+        Dataset to load. It is kept as attribute (as in DataLoader), while its tensors are copied to the device.
+    batch_size: int
+        Mini-batch size.
+    shuffle: bool
+        Flag to shuffle the examples at each iteration over the set.
+    device: str
+        Device where tensors are stored (e.g., 'cuda:0' or 'cpu').
+    """
+
+    def __init__(self, dataset, batch_size, shuffle=False, device="cpu"):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.device = device
+        self.tensors = [t.to(device) for t in dataset.tensors]
+
+    def __len__(self):
+        return int(np.ceil(self.tensors[0].shape[0] / self.batch_size))
+
+    def __iter__(self):
+        n_examples = self.tensors[0].shape[0]
+        if self.shuffle:
+            idx = torch.randperm(n_examples, device=self.device)
+            for start in range(0, n_examples, self.batch_size):
+                idx_batch = idx[start : start + self.batch_size]
+                yield [t[idx_batch] for t in self.tensors]
+        else:
+            for start in range(0, n_examples, self.batch_size):
+                yield [t[start : start + self.batch_size] for t in self.tensors]
+
+
+def get_device_loaders(datasets, device):
+    """This function returns device-resident loaders (see DeviceTensorLoader) with the same datasets and batch size of
+    the given dataloaders (keys: 'train', 'valid', 'test'). Only the training set is shuffled, as in get_dataloader."""
+    return {
+        key: DeviceTensorLoader(
+            loader.dataset,
+            batch_size=loader.batch_size,
+            shuffle=key == "train",
+            device=device,
+        )
+        for key, loader in datasets.items()
+    }
+
+
 def crop_signals(x, srate, interval_in, interval_out):
     """Function that crops signals within a fixed window"""
     time = np.arange(interval_in[0], interval_in[1], 1 / srate)
@@ -94,42 +165,30 @@ def crop_signals(x, srate, interval_in, interval_out):
 def get_neighbour_channels(
     adjacency_mtx, ch_names, n_steps=1, seed_nodes=["Cz"]
 ):
-    """Function that samples a subset of channels from a seed channel including neighbour channels within a fixed number of steps in the adjacency matrix."""
-    sel_channels = []
-    for i in np.arange(n_steps):
-        tmp_sel_channels = []
-        for node in seed_nodes:
-            idx_node = np.where(node == np.array(ch_names))[0][0]
-            idx_linked_nodes = np.where(adjacency_mtx[idx_node, :] > 0)[
-                0
-            ]  # find indices linked to the node
-            linked_channels = np.array(ch_names)[idx_linked_nodes]
-            tmp_sel_channels.extend(list(linked_channels))
-        seed_nodes = tmp_sel_channels
-        sel_channels.extend(tmp_sel_channels)
-    sel_channels = np.unique(sel_channels)
-    return sel_channels
-
-
-def sample_channels(x, adjacency_mtx, ch_names, n_steps, seed_nodes=["Cz"]):
-    """Function that select only selected channels from the input data"""
-    sel_channels = get_neighbour_channels(
-        adjacency_mtx, ch_names, n_steps=n_steps, seed_nodes=seed_nodes
+    """Function that samples a subset of channels from a seed channel including neighbour channels within a fixed number of steps in the adjacency matrix.
+    Neighbourhoods are memoized in the montage index of the channels (see utils/montage.py)."""
+    return get_montage_index(ch_names, adjacency_mtx).get_neighbour_channels(
+        n_steps=n_steps, seed_nodes=seed_nodes
     )
-    sel_channels = list(sel_channels)
-    idx_sel_channels = []
-    for k, ch in enumerate(ch_names):
-        if ch in sel_channels:
-            idx_sel_channels.append(k)
-    idx_sel_channels = np.array(idx_sel_channels)  # idx selected channels
+
+
+def sample_channels(
+    x, adjacency_mtx, ch_names, n_steps, seed_nodes=["Cz"], verbose=True
+):
+    """Function that select only selected channels from the input data (in the order of ch_names)"""
+    idx_sel_channels = get_montage_index(
+        ch_names, adjacency_mtx
+    ).get_neighbourhood(n_steps=n_steps, seed_nodes=seed_nodes)
 
     if idx_sel_channels.shape[0] != x.shape[1]:
         x = x[:, idx_sel_channels, :]
-        sel_channels_ = np.array(ch_names)[idx_sel_channels]
-        sel_channels_ = list(sel_channels_)
-        # should correspond to sel_channels ordered based on ch_names ordering
-        print("Sampling channels: {0}".format(sel_channels_))
-    else:
+        if verbose:
+            print(
+                "Sampling channels: {0}".format(
+                    [ch_names[k] for k in idx_sel_channels]
+                )
+            )
+    elif verbose:
         print("Sampling all channels available: {0}".format(ch_names))
     return x
 
@@ -169,6 +228,10 @@ class LeaveOneSessionOut(object):
         tmax=None,
         save_prepared_dataset=None,
         n_steps_channel_selection=None,
+        cache_format="npy",
+        wideband=None,
+        save_prepared_folds=False,
+        storage_dtype="float32",
     ):
         """This function returns the pre-processed datasets (training, validation and test sets).
 
@@ -177,7 +240,7 @@ class LeaveOneSessionOut(object):
         data_folder: str
             String containing the path where data were downloaded.
         cached_data_folder: str
-            String containing the path where data will be cached (into .pkl files) during preparation.
+            String containing the path where data will be cached (into .npy or .pkl files) during preparation.
             This is convenient to speed up overall training when performing multiple trainings on EEG signals
             pre-processed always in the same way.
         dataset: moabb.datasets.?
@@ -209,9 +272,25 @@ class LeaveOneSessionOut(object):
             Stop time of the EEG epoch, with respect to the event as defined in the dataset (s).
             See MOABB documentation and reference publications of each dataset for additional details about datasets.
         save_prepared_dataset: bool
-            Flag to save the prepared dataset into a pkl file.
+            Flag to save the prepared dataset into a cache file.
         n_steps_channel_selection: int
             Number of steps to perform when sampling a subset of channels from a seed channel, based on the adjacency matrix.
+        cache_format: str
+            Format of the cached dataset: 'npy' (EEG signals are memory-mapped and sliced without reading whole files)
+            or 'pkl' (legacy format).
+        wideband: list
+            Low and high cut-off frequencies of a wide band on which the dataset is prepared and cached (Hz).
+            The band-pass filtering between fmin and fmax is then applied in memory, sharing the same cache among
+            different fmin and fmax values. If None, the dataset is prepared and cached directly between fmin and fmax.
+        save_prepared_folds: bool
+            Flag to save the pre-processed fold (final training, validation and test arrays) into a cache directory,
+            named after a content hash of all the parameters used to compute it.
+            This is convenient when repeating trainings on the same fold (e.g., with different seeds or hyperparameters
+            not affecting data pre-processing). Cached folds are model-ready: EEG signals are stored in float32, whatever
+            storage_dtype (which is part of the fold parameters).
+        storage_dtype: str
+            Data type of the EEG signals stored in the cache and in memory (e.g., 'float32' or 'float16').
+            Signals are cast to float32 only when fed to the network, batch by batch.
         ...
 
         Returns
@@ -222,6 +301,96 @@ class LeaveOneSessionOut(object):
             Dictionary containing all sets (keys: 'train', 'test', 'valid').
          ---------
         """
+        fold_params = {
+            "iterator": self.iterator_tag,
+            "dataset": dataset.code,
+            "subject": dataset.subject_list[target_subject_idx],
+            "session": target_session_idx,
+            "events_to_load": events_to_load,
+            "srate_in": original_sample_rate,
+            "srate_out": sample_rate,
+            "fmin": fmin,
+            "fmax": fmax,
+            "wideband": wideband,
+            "valid_ratio": valid_ratio,
+            "tmin": tmin,
+            "tmax": tmax,
+            "n_steps_channel_selection": n_steps_channel_selection,
+            "dtype": storage_dtype,
+            "fold_dtype": fold_dtype,
+        }
+        fold = load_or_prepare_fold(
+            cached_data_folder
+            if cached_data_folder is not None
+            else data_folder,
+            dataset.code,
+            fold_params,
+            partial(
+                self._prepare_fold,
+                data_folder=data_folder,
+                cached_data_folder=cached_data_folder,
+                dataset=dataset,
+                valid_ratio=valid_ratio,
+                target_subject_idx=target_subject_idx,
+                target_session_idx=target_session_idx,
+                events_to_load=events_to_load,
+                original_sample_rate=original_sample_rate,
+                sample_rate=sample_rate,
+                fmin=fmin,
+                fmax=fmax,
+                tmin=tmin,
+                tmax=tmax,
+                save_prepared_dataset=save_prepared_dataset,
+                n_steps_channel_selection=n_steps_channel_selection,
+                cache_format=cache_format,
+                wideband=wideband,
+                storage_dtype=storage_dtype,
+            ),
+            save_prepared_folds=save_prepared_folds,
+        )
+
+        # dataloaders
+        train_loader, valid_loader, test_loader = get_dataloader(
+            batch_size,
+            (fold["x_train"], fold["y_train"]),
+            (fold["x_valid"], fold["y_valid"]),
+            (fold["x_test"], fold["y_test"]),
+        )
+        datasets = {}
+        datasets["train"] = train_loader
+        datasets["valid"] = valid_loader
+        datasets["test"] = test_loader
+        tail_path = os.path.join(
+            self.iterator_tag,
+            "sub-{0}".format(
+                str(dataset.subject_list[target_subject_idx]).zfill(3)
+            ),
+            fold["info"]["session"],
+        )
+        return tail_path, datasets
+
+    def _prepare_fold(
+        self,
+        data_folder,
+        cached_data_folder,
+        dataset,
+        valid_ratio,
+        target_subject_idx,
+        target_session_idx,
+        events_to_load,
+        original_sample_rate,
+        sample_rate,
+        fmin,
+        fmax,
+        tmin,
+        tmax,
+        save_prepared_dataset,
+        n_steps_channel_selection,
+        cache_format,
+        wideband,
+        storage_dtype,
+    ):
+        """This function computes the arrays of the training, validation and test sets of the fold."""
         interval = [tmin, tmax]
 
         # preparing or loading dataset
@@ -236,6 +405,9 @@ class LeaveOneSessionOut(object):
             fmax=fmax,
             idx_subject_to_prepare=target_subject_idx,
             save_prepared_dataset=save_prepared_dataset,
+            cache_format=cache_format,
+            wideband=wideband,
+            storage_dtype=storage_dtype,
         )
 
         x = data_dict["x"]
@@ -322,12 +494,14 @@ class LeaveOneSessionOut(object):
                 data_dict["adjacency_mtx"],
                 data_dict["channels"],
                 n_steps=n_steps_channel_selection,
+                verbose=False,
             )
             x_test = sample_channels(
                 x_test,
                 data_dict["adjacency_mtx"],
                 data_dict["channels"],
                 n_steps=n_steps_channel_selection,
+                verbose=False,
             )
 
         # swap axes: from (N_examples, C, T) to (N_examples, T, C)
@@ -335,22 +509,14 @@ class LeaveOneSessionOut(object):
         x_valid = np.swapaxes(x_valid, -1, -2)
         x_test = np.swapaxes(x_test, -1, -2)
 
-        # dataloaders
-        train_loader, valid_loader, test_loader = get_dataloader(
-            batch_size, (x_train, y_train), (x_valid, y_valid), (x_test, y_test)
-        )
-        datasets = {}
-        datasets["train"] = train_loader
-        datasets["valid"] = valid_loader
-        datasets["test"] = test_loader
-        tail_path = os.path.join(
-            self.iterator_tag,
-            "sub-{0}".format(
-                str(dataset.subject_list[target_subject_idx]).zfill(3)
-            ),
-            sessions[target_session_idx],
+        fold = get_fold_arrays(
+            (x_train, y_train, idx_train),
+            (x_valid, y_valid, idx_valid),
+            (x_test, y_test, idx_test),
+            dtype=storage_dtype,
         )
-        return tail_path, datasets
+        fold["info"] = {"session": sessions[target_session_idx]}
+        return fold
 
 
 class LeaveOneSubjectOut(object):
@@ -388,6 +554,10 @@ class LeaveOneSubjectOut(object):
         tmax=None,
         save_prepared_dataset=None,
         n_steps_channel_selection=None,
+        cache_format="npy",
+        wideband=None,
+        save_prepared_folds=False,
+        storage_dtype="float32",
     ):
         """This function returns the pre-processed datasets (training, validation and test sets).
 
@@ -396,7 +566,7 @@ class LeaveOneSubjectOut(object):
         data_folder: str
             String containing the path where data were downloaded.
         cached_data_folder: str
-            String containing the path where data will be cached (into .pkl files) during preparation.
+            String containing the path where data will be cached (into .npy or .pkl files) during preparation.
             This is convenient to speed up overall training when performing multiple trainings on EEG signals
             pre-processed always in the same way.
         dataset: moabb.datasets.?
@@ -430,9 +600,25 @@ class LeaveOneSubjectOut(object):
             Stop time of the EEG epoch, with respect to the event as defined in the dataset (s).
             See MOABB documentation and reference publications of each dataset for additional details about datasets.
         save_prepared_dataset: bool
-            Flag to save the prepared dataset into a pkl file.
+            Flag to save the prepared dataset into a cache file.
         n_steps_channel_selection: int
             Number of steps to perform when sampling a subset of channels from a seed channel, based on the adjacency matrix.
+        cache_format: str
+            Format of the cached dataset: 'npy' (EEG signals are memory-mapped and sliced without reading whole files)
+            or 'pkl' (legacy format).
+        wideband: list
+            Low and high cut-off frequencies of a wide band on which the dataset is prepared and cached (Hz).
+            The band-pass filtering between fmin and fmax is then applied in memory, sharing the same cache among
+            different fmin and fmax values. If None, the dataset is prepared and cached directly between fmin and fmax.
+        save_prepared_folds: bool
+            Flag to save the pre-processed fold (final training, validation and test arrays) into a cache directory,
+            named after a content hash of all the parameters used to compute it.
+            This is convenient when repeating trainings on the same fold (e.g., with different seeds or hyperparameters
+            not affecting data pre-processing). Cached folds are model-ready: EEG signals are stored in float32, whatever
+            storage_dtype (which is part of the fold parameters).
+        storage_dtype: str
+            Data type of the EEG signals stored in the cache and in memory (e.g., 'float32' or 'float16').
+            Signals are cast to float32 only when fed to the network, batch by batch.
         ...
 
         Returns
@@ -443,6 +629,95 @@ class LeaveOneSubjectOut(object):
             Dictionary containing all sets (keys: 'train', 'test', 'valid').
          ---------
         """
+        fold_params = {
+            "iterator": self.iterator_tag,
+            "dataset": dataset.code,
+            "subject": dataset.subject_list[target_subject_idx],
+            "session": None,
+            "events_to_load": events_to_load,
+            "srate_in": original_sample_rate,
+            "srate_out": sample_rate,
+            "fmin": fmin,
+            "fmax": fmax,
+            "wideband": wideband,
+            "valid_ratio": valid_ratio,
+            "tmin": tmin,
+            "tmax": tmax,
+            "n_steps_channel_selection": n_steps_channel_selection,
+            "dtype": storage_dtype,
+            "fold_dtype": fold_dtype,
+        }
+        fold = load_or_prepare_fold(
+            cached_data_folder
+            if cached_data_folder is not None
+            else data_folder,
+            dataset.code,
+            fold_params,
+            partial(
+                self._prepare_fold,
+                data_folder=data_folder,
+                cached_data_folder=cached_data_folder,
+                dataset=dataset,
+                valid_ratio=valid_ratio,
+                target_subject_idx=target_subject_idx,
+                target_session_idx=target_session_idx,
+                events_to_load=events_to_load,
+                original_sample_rate=original_sample_rate,
+                sample_rate=sample_rate,
+                fmin=fmin,
+                fmax=fmax,
+                tmin=tmin,
+                tmax=tmax,
+                save_prepared_dataset=save_prepared_dataset,
+                n_steps_channel_selection=n_steps_channel_selection,
+                cache_format=cache_format,
+                wideband=wideband,
+                storage_dtype=storage_dtype,
+            ),
+            save_prepared_folds=save_prepared_folds,
+        )
+
+        # dataloaders
+        train_loader, valid_loader, test_loader = get_dataloader(
+            batch_size,
+            (fold["x_train"], fold["y_train"]),
+            (fold["x_valid"], fold["y_valid"]),
+            (fold["x_test"], fold["y_test"]),
+        )
+        datasets = {}
+        datasets["train"] = train_loader
+        datasets["valid"] = valid_loader
+        datasets["test"] = test_loader
+        tail_path = os.path.join(
+            self.iterator_tag,
+            "sub-{0}".format(
+                str(dataset.subject_list[target_subject_idx]).zfill(3)
+            ),
+        )
+        return tail_path, datasets
+
+    def _prepare_fold(
+        self,
+        data_folder,
+        cached_data_folder,
+        dataset,
+        valid_ratio,
+        target_subject_idx,
+        target_session_idx,
+        events_to_load,
+        original_sample_rate,
+        sample_rate,
+        fmin,
+        fmax,
+        tmin,
+        tmax,
+        save_prepared_dataset,
+        n_steps_channel_selection,
+        cache_format,
+        wideband,
+        storage_dtype,
+    ):
+        """This function computes the arrays of the training, validation and test sets of the fold."""
         interval = [tmin, tmax]
         if len(dataset.subject_list) < 2:
             raise (
@@ -451,8 +726,8 @@ class LeaveOneSubjectOut(object):
                 )
             )
 
-        # preparing or loading test set
-        data_dict = prepare_data(
+        # pool of prepared subjects, shared among the folds computed in this process
+        subject_pool = get_subject_pool(
             data_folder=data_folder,
             cached_data_folder=cached_data_folder,
             dataset=dataset,
@@ -461,15 +736,12 @@ class LeaveOneSubjectOut(object):
             srate_out=sample_rate,
             fmin=fmin,
             fmax=fmax,
-            idx_subject_to_prepare=target_subject_idx,
             save_prepared_dataset=save_prepared_dataset,
+            cache_format=cache_format,
+            wideband=wideband,
+            storage_dtype=storage_dtype,
         )
 
-        x_test = data_dict["x"]
-        y_test = data_dict["y"]
-        original_interval = data_dict["interval"]
-        srate = data_dict["srate"]
-
         subject_idx_train = [
             i
             for i in np.arange(len(dataset.subject_list))
@@ -490,55 +762,52 @@ class LeaveOneSubjectOut(object):
             )
         )
 
-        x_train, y_train, x_valid, y_valid = [], [], [], []
-        for subject_idx in subject_idx_train:
-            # preparing or loading training/valid set
-            data_dict = prepare_data(
-                data_folder=data_folder,
-                cached_data_folder=cached_data_folder,
-                dataset=dataset,
-                events_to_load=events_to_load,
-                srate_in=original_sample_rate,
-                srate_out=sample_rate,
-                fmin=fmin,
-                fmax=fmax,
-                idx_subject_to_prepare=subject_idx,
-                save_prepared_dataset=save_prepared_dataset,
-            )
-
-            tmp_x_train = data_dict["x"]
-            tmp_y_train = data_dict["y"]
-            tmp_metadata = data_dict["metadata"]
-
-            # defining training and validation indices from subjects and sessions in a balanced way
-            idx_train, idx_valid = [], []
-            for session in np.unique(tmp_metadata.session):
-                idx = np.where(tmp_metadata.session == session)[0]
-                # validation set definition (equal proportion btw classes)
-                (
-                    tmp_idx_train,
-                    tmp_idx_valid,
-                ) = get_idx_train_valid_classbalanced(
-                    idx, valid_ratio, tmp_y_train
-                )
-                idx_train.extend(tmp_idx_train)
-                idx_valid.extend(tmp_idx_valid)
-            idx_train = np.array(idx_train)
-            idx_valid = np.array(idx_valid)
-
-            tmp_x_valid = tmp_x_train[idx_valid, ...]
-            tmp_y_valid = tmp_y_train[idx_valid]
-            tmp_x_train = tmp_x_train[idx_train, ...]
-            tmp_y_train = tmp_y_train[idx_train]
-
-            x_train.extend(tmp_x_train)
-            y_train.extend(tmp_y_train)
-            x_valid.extend(tmp_x_valid)
-            y_valid.extend(tmp_y_valid)
-        x_train = np.array(x_train)
-        y_train = np.array(y_train)
-        x_valid = np.array(x_valid)
-        y_valid = np.array(y_valid)
+        # indices of the selected examples, as (subject index, example indices) pairs for the subject pool
+        pool_idx_train, pool_idx_valid = [], []
+        # indices of the selected examples, as (subject, example index within the subject) pairs
+        sbj_idx_train, sbj_idx_valid = [], []
+        # the subjects of the fold are pinned in the pool until their examples are gathered, so that each subject is
+        # prepared once per fold (see SubjectPool.pinned)
+        with subject_pool.pinned():
+            # preparing or loading test set
+            data_dict = subject_pool.get(target_subject_idx)
+
+            x_test = data_dict["x"]
+            y_test = data_dict["y"]
+            original_interval = data_dict["interval"]
+            srate = data_dict["srate"]
+
+            for subject_idx in subject_idx_train:
+                # preparing or loading training/valid set
+                tmp_data_dict = subject_pool.get(subject_idx)
+                tmp_y_train = tmp_data_dict["y"]
+                tmp_metadata = tmp_data_dict["metadata"]
+
+                # defining training and validation indices from subjects and sessions in a balanced way
+                idx_train, idx_valid = [], []
+                for session in np.unique(tmp_metadata.session):
+                    idx = np.where(tmp_metadata.session == session)[0]
+                    # validation set definition (equal proportion btw classes)
+                    (
+                        tmp_idx_train,
+                        tmp_idx_valid,
+                    ) = get_idx_train_valid_classbalanced(
+                        idx, valid_ratio, tmp_y_train
+                    )
+                    idx_train.extend(tmp_idx_train)
+                    idx_valid.extend(tmp_idx_valid)
+                idx_train = np.array(idx_train, dtype=int)
+                idx_valid = np.array(idx_valid, dtype=int)
+
+                pool_idx_train.append((subject_idx, idx_train))
+                pool_idx_valid.append((subject_idx, idx_valid))
+                subject = dataset.subject_list[subject_idx]
+                sbj_idx_train.extend([(subject, i) for i in idx_train])
+                sbj_idx_valid.extend([(subject, i) for i in idx_valid])
+
+            # gathering the selected examples of all subjects into preallocated arrays
+            x_train, y_train = subject_pool.gather(pool_idx_train)
+            x_valid, y_valid = subject_pool.gather(pool_idx_valid)
 
         # time cropping
         if interval != original_interval:
@@ -574,12 +843,14 @@ class LeaveOneSubjectOut(object):
                 data_dict["adjacency_mtx"],
                 data_dict["channels"],
                 n_steps=n_steps_channel_selection,
+                verbose=False,
             )
             x_test = sample_channels(
                 x_test,
                 data_dict["adjacency_mtx"],
                 data_dict["channels"],
                 n_steps=n_steps_channel_selection,
+                verbose=False,
             )
 
         # swap axes: from (N_examples, C, T) to (N_examples, T, C)
@@ -587,18 +858,11 @@ class LeaveOneSubjectOut(object):
         x_valid = np.swapaxes(x_valid, -1, -2)
         x_test = np.swapaxes(x_test, -1, -2)
 
-        # dataloaders
-        train_loader, valid_loader, test_loader = get_dataloader(
-            batch_size, (x_train, y_train), (x_valid, y_valid), (x_test, y_test)
-        )
-        datasets = {}
-        datasets["train"] = train_loader
-        datasets["valid"] = valid_loader
-        datasets["test"] = test_loader
-        tail_path = os.path.join(
-            self.iterator_tag,
-            "sub-{0}".format(
-                str(dataset.subject_list[target_subject_idx]).zfill(3)
-            ),
+        fold = get_fold_arrays(
+            (x_train, y_train, np.array(sbj_idx_train)),
+            (x_valid, y_valid, np.array(sbj_idx_valid)),
+            (x_test, y_test, np.arange(x_test.shape[0])),
+            dtype=storage_dtype,
         )
-        return tail_path, datasets
+        fold["info"] = {"subject_ids_train": subject_ids_train}
+        return fold
@@ -0,0 +1,76 @@
+"""
+Early stopping of trainings on MOABB datasets.
+
+The policy monitors a validation metric (e.g., the test_key of hparam files) at the end of each epoch and stops the
+training when it has not improved for a given number of epochs (patience).
+"""
+
+
+class EarlyStopping(object):
+    """Early stopping policy based on a validation metric.
+    The training stops when the monitored metric has not improved by more than min_delta for patience consecutive
+    epochs, but not before min_epochs epochs.
+
+    Arguments
+    ---------
+    key: str
+        Monitored validation metric (e.g., "loss", "acc" or "f1"). Loss is minimized, the other metrics are maximized.
+    patience: int
+        Number of epochs without improvement before stopping. If 0, early stopping is disabled.
+    min_delta: float
+        Minimum change of the monitored metric counted as an improvement.
+    min_epochs: int
+        Minimum number of epochs before stopping.
+
+    Example
+    -------
+    >>> early_stopping = EarlyStopping(key="acc", patience=2)
+    >>> [early_stopping.step(epoch, {"acc": acc}) for epoch, acc in enumerate([0.5, 0.6, 0.6, 0.55], start=1)]
+    [False, False, False, True]
+    >>> early_stopping.reason
+    'no improvement of valid acc for 2 epochs (best: 6.00e-01 at epoch 2)'
+    """
+
+    def __init__(self, key="loss", patience=0, min_delta=0.0, min_epochs=1):
+        self.key = key
+        self.patience = patience
+        self.min_delta = min_delta
+        self.min_epochs = min_epochs
+        self.best_value = None
+        self.best_epoch = None
+        self.reason = None
+
+    @property
+    def enabled(self):
+        """Whether early stopping is enabled (patience > 0)."""
+        return self.patience > 0
+
+    def is_improvement(self, value):
+        """Checks if a value of the monitored metric improves the best one by more than min_delta."""
+        if self.best_value is None:
+            return True
+        if self.key == "loss":
+            return value < self.best_value - self.min_delta
+        return value > self.best_value + self.min_delta
+
+    def step(self, epoch, eval_stats):
+        """Updates the policy with the validation metrics of an epoch. Returns True if the training has to stop."""
+        if not self.enabled:
+            return False
+        value = float(eval_stats[self.key])
+        if self.is_improvement(value):
+            self.best_value = value
+            self.best_epoch = epoch
+            return False
+        if (
+            epoch - self.best_epoch >= self.patience
+            and epoch >= self.min_epochs
+        ):
+            self.reason = "no improvement of valid {0} for {1} epochs (best: {2:.2e} at epoch {3})".format(
+                self.key,
+                epoch - self.best_epoch,
+                self.best_value,
+                self.best_epoch,
+            )
+            return True
+        return False
@@ -0,0 +1,72 @@
+"""
+Inter-process file locks.
+
+Locks are exclusive advisory locks (fcntl.flock) on lock files, so that they are shared by all processes running on
+the same machine (e.g., parallel trainings launched by run_experiments.sh or Orion). Locks are automatically released
+by the operating system when the process holding them terminates. On platforms without fcntl (e.g., Windows), locks
+are no-ops.
+"""
+
+import os
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class FileLock(object):
+    """Exclusive inter-process lock on a lock file (the file is created if needed and never deleted).
+
+    Arguments
+    ---------
+    lock_fpath: str
+        Path of the lock file.
+    blocking: bool
+        If True, acquire() waits until the lock is available; otherwise it returns False if the lock is held by
+        another process.
+
+    Example
+    -------
+    >>> with FileLock("/tmp/example.lock"):
+    ...     pass
+    """
+
+    def __init__(self, lock_fpath, blocking=True):
+        self.lock_fpath = lock_fpath
+        self.blocking = blocking
+        self.handle = None
+
+    def acquire(self):
+        """Acquires the lock. Returns True if the lock was acquired, False otherwise (non-blocking locks only)."""
+        lock_dir = os.path.dirname(self.lock_fpath)
+        if lock_dir != "" and not os.path.isdir(lock_dir):
+            os.makedirs(lock_dir, exist_ok=True)
+        self.handle = open(self.lock_fpath, "a")
+        if fcntl is None:
+            return True
+        try:
+            fcntl.flock(
+                self.handle.fileno(),
+                fcntl.LOCK_EX | (0 if self.blocking else fcntl.LOCK_NB),
+            )
+        except BlockingIOError:
+            self.handle.close()
+            self.handle = None
+            return False
+        return True
+
+    def release(self):
+        """Releases the lock."""
+        if self.handle is not None:
+            if fcntl is not None:
+                fcntl.flock(self.handle.fileno(), fcntl.LOCK_UN)
+            self.handle.close()
+            self.handle = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
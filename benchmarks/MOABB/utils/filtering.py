@@ -0,0 +1,64 @@
+"""
+Band-pass filtering of prepared MOABB epochs.
+
+Epochs cached on a wide frequency band can be band-passed in memory on any narrower band (e.g., for each
+hyperparameter optimization trial changing fmin and fmax), instead of re-running the whole MOABB/MNE pipeline.
+The filtering is zero-phase (forward-backward Butterworth filter in second-order sections), as the IIR filtering
+applied by MOABB paradigms, and it is vectorized over the whole (N_examples, C, T) array.
+Note that filtering is applied on epochs and not on continuous recordings, thus the first and last samples of each
+epoch can slightly differ from the ones obtained by preparing the dataset directly on the target band.
+"""
+
+from collections import OrderedDict
+
+
+def bandpass_filter(x, srate, fmin, fmax, order=4):
+    """This function band-pass filters EEG signals along the last axis (time) with a zero-phase Butterworth filter.
+    fmin (or fmax) can be None to apply a low-pass (or high-pass) filter only.
+    The filtered signals keep the data type of x."""
+    # imported here, out of the startup path of trainings without in-memory filtering
+    from scipy.signal import butter, sosfiltfilt
+
+    if fmin is None and fmax is None:
+        return x
+    if fmin is None:
+        sos = butter(order, fmax, btype="lowpass", fs=srate, output="sos")
+    elif fmax is None:
+        sos = butter(order, fmin, btype="highpass", fs=srate, output="sos")
+    else:
+        sos = butter(
+            order, [fmin, fmax], btype="bandpass", fs=srate, output="sos"
+        )
+    return sosfiltfilt(sos, x, axis=-1).astype(x.dtype, copy=False)
+
+
+class FilterBank(object):
+    """Band-pass filter bank with memoization of the filtered signals.
+    The most recently filtered signals are kept in memory (least-recently-used policy), keyed by the source signals
+    and the band, so that the same band is computed only once for each source.
+
+    Arguments
+    ---------
+    maxsize: int
+        Maximum number of filtered arrays kept in memory.
+    order: int
+        Order of the Butterworth filter.
+    """
+
+    def __init__(self, maxsize=16, order=4):
+        self.maxsize = maxsize
+        self.order = order
+        self.cache = OrderedDict()
+
+    def __call__(self, key, x, srate, fmin, fmax):
+        """Returns the signals x (identified by key) band-passed between fmin and fmax."""
+        band_key = (key, srate, fmin, fmax)
+        if band_key in self.cache:
+            self.cache.move_to_end(band_key)
+            return self.cache[band_key]
+        x_filt = bandpass_filter(x, srate, fmin, fmax, order=self.order)
+        if self.maxsize > 0:
+            self.cache[band_key] = x_filt
+            if len(self.cache) > self.maxsize:
+                self.cache.popitem(last=False)
+        return x_filt
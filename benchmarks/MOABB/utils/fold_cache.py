@@ -0,0 +1,116 @@
+"""
+Cache of pre-processed cross-validation folds for MOABB datasets.
+
+Each fold (training, validation and test sets after sampling of the validation set, time cropping, channel sampling,
+axes swapping and type casting) is stored in a directory named after a content hash of all the parameters used to
+compute it. Repeated trainings on the same fold (e.g., with different seeds or hyperparameters not affecting the
+pre-processing) can thus load the final arrays directly, skipping the whole pre-processing.
+Cached folds are model-ready: EEG signals are stored in float32 (fold_dtype), whatever the data type of the prepared
+subjects (storage_dtype, part of the fold parameters).
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import numpy as np
+
+# Data type of the EEG signals of cached folds
+fold_dtype = "float32"
+
+fold_array_keys = [
+    "x_train",
+    "y_train",
+    "x_valid",
+    "y_valid",
+    "x_test",
+    "y_test",
+    "idx_train",
+    "idx_valid",
+    "idx_test",
+]
+
+
+def get_fold_key(fold_params):
+    """This function returns the content hash identifying a fold, computed from the parameters used to compute it."""
+    fold_params = json.dumps(fold_params, sort_keys=True, default=str)
+    return hashlib.sha1(fold_params.encode("utf-8")).hexdigest()
+
+
+def get_fold_dir(cached_data_folder, dataset_code, fold_params):
+    """This function returns the directory where the fold identified by the given parameters is cached."""
+    return os.path.join(
+        cached_data_folder,
+        "MOABB_folds",
+        dataset_code,
+        get_fold_key(fold_params),
+    )
+
+
+def get_model_ready_fold(fold):
+    """This function returns the fold with EEG signals cast to fold_dtype (without copies if already of that type)."""
+    fold = dict(fold)
+    for key in ["x_train", "x_valid", "x_test"]:
+        fold[key] = np.ascontiguousarray(fold[key], dtype=fold_dtype)
+    return fold
+
+
+def save_fold(fold_dir, fold, fold_params=None):
+    """This function saves a fold (dictionary containing arrays and a 'info' dictionary) into fold_dir.
+    EEG signals are saved in fold_dtype (see get_model_ready_fold).
+    Files are first written in a temporary directory that is then renamed, so that a partially written fold is never
+    read."""
+    fold = get_model_ready_fold(fold)
+    tmp_dir = fold_dir + ".tmp-{0}".format(os.getpid())
+    os.makedirs(tmp_dir)
+    for key in fold_array_keys:
+        np.save(os.path.join(tmp_dir, key + ".npy"), fold[key])
+    with open(os.path.join(tmp_dir, "info.pkl"), "wb") as handle:
+        pickle.dump(
+            {"info": fold.get("info", {}), "params": fold_params},
+            handle,
+            protocol=pickle.HIGHEST_PROTOCOL,
+        )
+    try:
+        os.rename(tmp_dir, fold_dir)
+    except OSError:
+        # the same fold was saved by another process in the meantime
+        shutil.rmtree(tmp_dir)
+
+
+def load_fold(fold_dir):
+    """This function loads a cached fold. It returns None if the fold is not cached."""
+    if not os.path.isfile(os.path.join(fold_dir, "info.pkl")):
+        return None
+    fold = {}
+    for key in fold_array_keys:
+        fold[key] = np.load(os.path.join(fold_dir, key + ".npy"))
+    with open(os.path.join(fold_dir, "info.pkl"), "rb") as handle:
+        fold["info"] = pickle.load(handle)["info"]
+    return fold
+
+
+def load_or_prepare_fold(
+    cached_data_folder,
+    dataset_code,
+    fold_params,
+    prepare_fn,
+    save_prepared_folds=True,
+):
+    """This function returns the fold identified by fold_params, loaded from the cache if available.
+    Otherwise, the fold is computed by prepare_fn (called without arguments) and, if save_prepared_folds is True,
+    saved into the cache. When the cache is used, the returned fold is model-ready (see get_model_ready_fold), either
+    loaded or computed."""
+    if not save_prepared_folds:
+        return prepare_fn()
+    fold_dir = get_fold_dir(cached_data_folder, dataset_code, fold_params)
+    fold = load_fold(fold_dir)
+    if fold is not None:
+        print("Using cached fold at: {0}".format(fold_dir))
+        return fold
+    # the fold is used as it is cached (model-ready, see get_model_ready_fold)
+    fold = get_model_ready_fold(prepare_fn())
+    print("Saving the fold at {0}".format(fold_dir))
+    save_fold(fold_dir, fold, fold_params)
+    return fold
@@ -0,0 +1,163 @@
+"""
+Accumulation of network predictions during evaluation stages.
+
+Predictions and targets of each mini-batch are copied into buffers allocated on the device of the network (no
+transfer to the host and no Python objects per example). The buffers are reused across epochs (they grow only if a
+larger set is evaluated), and the accumulated predictions are moved to the host only once, at the end of the stage.
+The confusion matrix is accumulated on the device mini-batch by mini-batch, and metrics of scores (e.g., AUC) are
+computed on the accumulated probabilities instead of the predicted labels (see MetricAccumulator.compute).
+"""
+
+import functools
+import inspect
+import sklearn.metrics
+import torch
+
+
+def get_metric_function(metric):
+    """Returns the function of a metric (e.g., the sklearn function of a partial defined with !name: in a yaml file)
+    and its keyword arguments."""
+    keywords = {}
+    while isinstance(metric, functools.partial):
+        keywords = dict(metric.keywords, **keywords)
+        metric = metric.func
+    return metric, keywords
+
+
+def is_score_metric(metric):
+    """Returns True if a metric is computed on scores (probabilities), e.g., sklearn.metrics.roc_auc_score."""
+    metric, _ = get_metric_function(metric)
+    try:
+        parameters = inspect.signature(metric).parameters
+    except (TypeError, ValueError):
+        return False
+    return "y_score" in parameters or "y_prob" in parameters
+
+
+class MetricAccumulator(object):
+    """Accumulator of predictions (e.g., class probabilities) and targets of an evaluation stage.
+
+    Example
+    -------
+    >>> accumulator = MetricAccumulator()
+    >>> accumulator.append(torch.tensor([[0.9, 0.1], [0.2, 0.8]]), torch.tensor([0, 0]))
+    >>> accumulator.append(torch.tensor([[0.3, 0.7]]), torch.tensor([1]))
+    >>> y_true, y_pred = accumulator.get_labels()
+    >>> y_true.tolist(), y_pred.tolist()
+    ([0, 0, 1], [0, 1, 1])
+    >>> accumulator.get_confusion_matrix().tolist()
+    [[1, 1], [0, 1]]
+    >>> float(accumulator.compute(sklearn.metrics.roc_auc_score))
+    0.5
+    """
+
+    def __init__(self):
+        self.preds = None
+        self.targets = None
+        self.cm = None
+        self.labels = None
+        self.n_examples = 0
+
+    def reset(self):
+        """Empties the accumulator (buffers are kept for the next stage)."""
+        self.n_examples = 0
+        self.labels = None
+        if self.cm is not None:
+            self.cm.zero_()
+
+    def allocate(self, preds, targets, capacity):
+        """Allocates buffers for capacity examples (with the shape, data type and device of preds and targets), keeping
+        the examples accumulated so far."""
+        new_preds = torch.empty(
+            (capacity,) + tuple(preds.shape[1:]),
+            dtype=preds.dtype,
+            device=preds.device,
+        )
+        new_targets = torch.empty(
+            (capacity,) + tuple(targets.shape[1:]),
+            dtype=targets.dtype,
+            device=preds.device,
+        )
+        if self.n_examples > 0:
+            new_preds[: self.n_examples] = self.preds[: self.n_examples]
+            new_targets[: self.n_examples] = self.targets[: self.n_examples]
+        self.preds, self.targets = new_preds, new_targets
+
+    def append(self, preds, targets):
+        """Appends the predictions and targets of a mini-batch (targets are moved to the device of predictions)."""
+        n_new = preds.shape[0]
+        if (
+            self.preds is None
+            or self.preds.shape[1:] != preds.shape[1:]
+            or self.preds.dtype != preds.dtype
+            or self.preds.device != preds.device
+        ):
+            self.n_examples = 0
+            self.allocate(preds, targets, n_new)
+            self.cm = None
+            if preds.dim() == 2:
+                self.cm = torch.zeros(
+                    (preds.shape[1], preds.shape[1]),
+                    dtype=torch.long,
+                    device=preds.device,
+                )
+        elif self.n_examples + n_new > self.preds.shape[0]:
+            self.allocate(
+                preds,
+                targets,
+                max(2 * self.preds.shape[0], self.n_examples + n_new),
+            )
+        stop = self.n_examples + n_new
+        self.preds[self.n_examples : stop] = preds.detach()
+        self.targets[self.n_examples : stop] = targets.detach()
+        if self.cm is not None:
+            n_classes = self.cm.shape[0]
+            cells = self.targets[self.n_examples : stop].long() * n_classes
+            cells += preds.detach().argmax(dim=-1)
+            self.cm.view(-1).add_(
+                torch.bincount(cells, minlength=n_classes * n_classes)
+            )
+        self.n_examples = stop
+        self.labels = None
+
+    def get(self):
+        """Returns the accumulated predictions and targets (as numpy arrays)."""
+        return (
+            self.preds[: self.n_examples].cpu().numpy(),
+            self.targets[: self.n_examples].cpu().numpy(),
+        )
+
+    def get_labels(self):
+        """Returns the accumulated targets and predicted labels (argmax of the predictions) as numpy arrays.
+        Predicted labels are computed on the device, so that only labels are moved to the host (once per stage)."""
+        if self.labels is None:
+            self.labels = (
+                self.targets[: self.n_examples].cpu().numpy(),
+                self.preds[: self.n_examples].argmax(dim=-1).cpu().numpy(),
+            )
+        return self.labels
+
+    def get_confusion_matrix(self):
+        """Returns the confusion matrix accumulated mini-batch by mini-batch (n_classes, n_classes), with rows for
+        targets and columns for predicted labels as sklearn.metrics.confusion_matrix."""
+        return self.cm.cpu().numpy()
+
+    def compute(self, metric):
+        """Computes a metric (e.g., a sklearn metric function) on the accumulated examples.
+        The confusion matrix (sklearn.metrics.confusion_matrix without arguments) is the accumulated one. Metrics of
+        scores (see is_score_metric) are computed on the predicted probabilities (of the second class with two
+        classes, as in binary sklearn metrics), other metrics on the predicted labels."""
+        function, keywords = get_metric_function(metric)
+        if (
+            function is sklearn.metrics.confusion_matrix
+            and len(keywords) == 0
+            and self.cm is not None
+        ):
+            return self.get_confusion_matrix()
+        if is_score_metric(metric):
+            y_score, y_true = self.get()
+            if y_score.ndim == 2 and y_score.shape[1] == 2:
+                y_score = y_score[:, 1]
+            return metric(y_true, y_score)
+        y_true, y_pred = self.get_labels()
+        return metric(y_true=y_true, y_pred=y_pred)
@@ -0,0 +1,146 @@
+"""
+Channel-adjacency index of the montage of a dataset.
+
+The adjacency matrix of the EEG channels is computed by MNE (find_ch_adjacency) from the montage of a dataset. It was
+computed again for each subject when preparing a dataset, and channel selection (n_steps_channel_selection) searched
+the neighbours of the seed channels with nested loops over channel names, for each split of each fold.
+
+MontageIndex stores the adjacency in compressed sparse row (CSR) form with a map from channel names to indices, and
+memoizes the neighbourhood of the seed channels for each number of steps, so that selecting channels is a single
+fancy-index of the EEG signals. The index of a dataset is saved next to its cached subjects
+(MOABB_pickled/<code>/montage.npz), and reused when preparing the other subjects.
+"""
+
+import os
+import numpy as np
+
+# Montage indexes built in this process, by channel names and adjacency matrix (see get_montage_index)
+montage_indexes = {}
+
+
+class MontageIndex(object):
+    """Adjacency of the channels of a montage, with memoized neighbourhoods of seed channels.
+
+    Arguments
+    ---------
+    ch_names: list
+        Channel names.
+    adjacency_mtx: np.array or scipy.sparse matrix
+        Adjacency matrix of the channels (C, C). Channels i and j are adjacent if adjacency_mtx[i, j] > 0.
+
+    Example
+    -------
+    >>> adjacency_mtx = np.array([[1, 1, 0], [1, 1, 1], [0, 1, 1]])
+    >>> montage = MontageIndex(["C3", "Cz", "C4"], adjacency_mtx)
+    >>> montage.get_neighbourhood(n_steps=1, seed_nodes=["C3"])
+    array([0, 1])
+    >>> montage.get_neighbour_channels(n_steps=2, seed_nodes=["C3"])
+    array(['C3', 'C4', 'Cz'], dtype='<U2')
+    """
+
+    def __init__(self, ch_names, adjacency_mtx):
+        if hasattr(adjacency_mtx, "toarray"):
+            adjacency_mtx = adjacency_mtx.toarray()
+        adjacency_mtx = np.asarray(adjacency_mtx)
+        if adjacency_mtx.shape != (len(ch_names), len(ch_names)):
+            raise ValueError(
+                "The adjacency matrix {0} does not match the number of channels ({1})".format(
+                    adjacency_mtx.shape, len(ch_names)
+                )
+            )
+        rows, cols = np.nonzero(adjacency_mtx > 0)
+        self.ch_names = list(ch_names)
+        self.ch_index = {ch: k for k, ch in enumerate(self.ch_names)}
+        self.indptr = np.searchsorted(rows, np.arange(len(ch_names) + 1))
+        self.indices = cols
+        self.dtype = adjacency_mtx.dtype
+        self.neighbourhoods = {}
+
+    def get_adjacency_mtx(self):
+        """Returns the adjacency matrix as a dense array (C, C)."""
+        adjacency_mtx = np.zeros(
+            (len(self.ch_names), len(self.ch_names)), dtype=self.dtype
+        )
+        rows = np.repeat(np.arange(len(self.ch_names)), np.diff(self.indptr))
+        adjacency_mtx[rows, self.indices] = 1
+        return adjacency_mtx
+
+    def get_neighbourhood(self, n_steps=1, seed_nodes=["Cz"]):
+        """Returns the indices (in ascending order) of the channels linked to the seed channels within n_steps steps.
+        The seed channels are included only if they are linked to themselves (e.g., as in MNE adjacency matrices)."""
+        key = (tuple(seed_nodes), int(n_steps))
+        if key not in self.neighbourhoods:
+            missing = [ch for ch in seed_nodes if ch not in self.ch_index]
+            if len(missing) > 0:
+                raise ValueError(
+                    "Seed channels not found in the montage: {0}".format(
+                        missing
+                    )
+                )
+            frontier = np.unique([self.ch_index[ch] for ch in seed_nodes])
+            selected = np.zeros(len(self.ch_names), dtype=bool)
+            for i in range(int(n_steps)):
+                frontier = np.unique(
+                    np.concatenate(
+                        [
+                            self.indices[self.indptr[k] : self.indptr[k + 1]]
+                            for k in frontier
+                        ]
+                        + [np.zeros(0, dtype=self.indices.dtype)]
+                    )
+                )
+                selected[frontier] = True
+            self.neighbourhoods[key] = np.flatnonzero(selected)
+        return self.neighbourhoods[key]
+
+    def get_neighbour_channels(self, n_steps=1, seed_nodes=["Cz"]):
+        """Returns the names (in alphabetical order) of the channels linked to the seed channels within n_steps steps."""
+        return np.unique(
+            np.array(self.ch_names)[self.get_neighbourhood(n_steps, seed_nodes)]
+        )
+
+    def save(self, path):
+        """Saves the index (the file is replaced atomically, for concurrent processes)."""
+        tmp_path = "{0}.{1}.tmp".format(path, os.getpid())
+        with open(tmp_path, "wb") as fout:
+            np.savez(
+                fout,
+                ch_names=np.array(self.ch_names),
+                indptr=self.indptr,
+                indices=self.indices,
+                dtype=np.array(self.dtype.str),
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Loads an index saved with save."""
+        with np.load(path) as data:
+            montage = cls.__new__(cls)
+            montage.ch_names = [str(ch) for ch in data["ch_names"]]
+            montage.ch_index = {ch: k for k, ch in enumerate(montage.ch_names)}
+            montage.indptr = data["indptr"]
+            montage.indices = data["indices"]
+            montage.dtype = np.dtype(str(data["dtype"]))
+            montage.neighbourhoods = {}
+        return montage
+
+
+def get_montage_index(ch_names, adjacency_mtx):
+    """This function returns the montage index of the channels, built once per montage in each process."""
+    adjacency_mtx = np.asarray(adjacency_mtx)
+    key = (tuple(ch_names), adjacency_mtx.shape, (adjacency_mtx > 0).tobytes())
+    if key not in montage_indexes:
+        montage_indexes[key] = MontageIndex(ch_names, adjacency_mtx)
+    return montage_indexes[key]
+
+
+def load_montage_index(path, ch_names):
+    """This function loads the montage index saved at path, if it exists and matches the channel names (None
+    otherwise)."""
+    if path is None or not os.path.isfile(path):
+        return None
+    montage = MontageIndex.load(path)
+    if montage.ch_names != list(ch_names):
+        return None
+    return montage
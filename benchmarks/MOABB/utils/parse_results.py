@@ -259,6 +259,7 @@ def aggregate_metrics(
     verbose=1,
     metric_file="test_metrics.pkl",
     stat_metrics=["loss", "f1", "acc"],
+    results_folder=None,
 ) -> Tuple:
     """
     Parses results and computes statistics over all
@@ -269,12 +270,16 @@ def aggregate_metrics(
     verbode: int
     metric_file: str
     stat_metrics: list
+    results_folder: str
+        Path of the results folder (first command line argument if None).
 
     Returns
     -------
     overall_stat: tuple
     """
-    results_folder = Path(sys.argv[1])
+    if results_folder is None:
+        results_folder = sys.argv[1]
+    results_folder = Path(results_folder)
     vis_metrics = stat_metrics
 
     available_paradigms = list(
@@ -317,13 +322,27 @@ def aggregate_metrics(
     return overall_stat
 
 
-if __name__ == "__main__":
-    metric_file = sys.argv[2]
-    stat_metrics = sys.argv[3:]
+def report_results(results_folder, metric_file, stat_metrics) -> None:
+    """
+    Parses results, computes statistics over all paradigms and prints them.
+
+    Arguments
+    ---------
+    results_folder: str
+    metric_file: str
+    stat_metrics: list
+    """
     temp = aggregate_metrics(
-        verbose=1, metric_file=metric_file, stat_metrics=stat_metrics
+        verbose=1,
+        metric_file=metric_file,
+        stat_metrics=stat_metrics,
+        results_folder=results_folder,
     )
 
     print("\nAggregated results")
     for k in stat_metrics:
         print(k, temp[k], "+-", temp[k + "_std"])
+
+
+if __name__ == "__main__":
+    report_results(sys.argv[1], sys.argv[2], sys.argv[3:])
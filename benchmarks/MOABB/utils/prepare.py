@@ -8,33 +8,45 @@ Davide Borra, 2022
 """
 import mne
 import numpy as np
-from moabb.datasets import (
-    BNCI2014001,
-    BNCI2014004,
-    BNCI2015001,
-    BNCI2015004,
-    Lee2019_MI,
-    Shin2017A,
-    Zhou2016,
-)
-from moabb.datasets import BNCI2014009, EPFLP300, Lee2019_ERP, bi2015a
-from moabb.datasets import Lee2019_SSVEP
-from moabb.paradigms import MotorImagery, P300, SSVEP
-from mne.utils.config import set_config, get_config
+from mne.utils.config import set_config, get_config, get_config_path
 import os
 import pickle
+import shutil
+import time
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import argparse
-from mne.channels import find_ch_adjacency
-import scipy
+from utils.filtering import FilterBank
+from utils.file_lock import FileLock
+from utils.montage import MontageIndex, load_montage_index
+from utils.registry import LazyDataset, get_paradigm
 
 # Set mne verbosity
 mne.set_log_level(verbose="error")
 
+# Filter bank used to derive narrow-band signals from wide-band cached datasets
+filter_bank = FilterBank()
+
+# Data folders already set in the MNE configuration by this process
+mne_data_folders = set()
+
 
 def get_output_dict(
-    dataset, subject, events_to_load, srate_in, srate_out, fmin, fmax, verbose=0
+    dataset,
+    subject,
+    events_to_load,
+    srate_in,
+    srate_out,
+    fmin,
+    fmax,
+    storage_dtype="float32",
+    montage_path=None,
+    verbose=0,
 ):
-    """This function returns the dictionary with subject-specific data."""
+    """This function returns the dictionary with subject-specific data.
+    EEG signals are stored with the data type storage_dtype (e.g., 'float32' or 'float16').
+    The adjacency matrix of the channels is read from the montage index at montage_path, if available (see
+    load_data)."""
     output_dict = {}
     output_dict["code"] = dataset.code
     output_dict["subject_list"] = dataset.subject_list
@@ -65,7 +77,8 @@ def get_output_dict(
 
     paradigm = None
     if dataset.paradigm == "imagery":
-        paradigm = MotorImagery(
+        paradigm = get_paradigm(
+            "imagery",
             events=events_to_load,  # selecting all events or specific events
             n_classes=len(output_dict["events"]),  # setting number of classes
             fmin=fmin,  # band-pass filtering
@@ -74,14 +87,16 @@ def get_output_dict(
             resample=srate_out,  # downsample
         )
     elif dataset.paradigm == "p300":
-        paradigm = P300(
+        paradigm = get_paradigm(
+            "p300",
             fmin=fmin,  # band-pass filtering
             fmax=fmax,
             channels=None,  # all channels
             resample=srate_out,  # downsample
         )
     elif dataset.paradigm == "ssvep":
-        paradigm = SSVEP(
+        paradigm = get_paradigm(
+            "ssvep",
             events=events_to_load,  # selecting all events or specific events
             n_classes=len(output_dict["events"]),  # setting number of classes
             fmin=fmin,  # band-pass filtering
@@ -91,7 +106,7 @@ def get_output_dict(
         )
 
     x, y, labels, metadata, channels, adjacency_mtx, srate = load_data(
-        paradigm, dataset, [subject]
+        paradigm, dataset, [subject], montage_path=montage_path
     )
 
     if verbose == 1:
@@ -118,7 +133,7 @@ def get_output_dict(
 
     output_dict["channels"] = channels
     output_dict["adjacency_mtx"] = adjacency_mtx
-    output_dict["x"] = x
+    output_dict["x"] = x.astype(storage_dtype, copy=False)
     output_dict["y"] = y
     output_dict["labels"] = labels
     output_dict["metadata"] = metadata
@@ -129,15 +144,23 @@ def get_output_dict(
     return output_dict
 
 
-def load_data(paradigm, dataset, idx):
+def load_data(paradigm, dataset, idx, montage_path=None):
     """This function returns EEG signals and the corresponding labels using MOABB methods
-    In addition metadata, channel names and the sampling rate are provided too."""
+    In addition metadata, channel names and the sampling rate are provided too.
+    The adjacency matrix of the channels is computed once per dataset: it is saved in the montage index at
+    montage_path (see utils/montage.py) and read from it for the next subjects with the same channels."""
     x, labels, metadata = paradigm.get_data(dataset, idx, True)
     ch_names = x.info.ch_names
-    adjacency, _ = find_ch_adjacency(x.info, ch_type="eeg")
-    adjacency_mtx = scipy.sparse.csr_matrix.toarray(
-        adjacency
-    )  # from sparse mtx to ndarray
+    montage = load_montage_index(montage_path, ch_names)
+    if montage is None:
+        # imported here, out of the startup path of trainings on cached datasets
+        from mne.channels import find_ch_adjacency
+
+        adjacency, _ = find_ch_adjacency(x.info, ch_type="eeg")
+        montage = MontageIndex(ch_names, adjacency)
+        if montage_path is not None and not os.path.isfile(montage_path):
+            montage.save(montage_path)
+    adjacency_mtx = montage.get_adjacency_mtx()
 
     srate = x.info["sfreq"]
     x = x.get_data()
@@ -147,18 +170,196 @@ def load_data(paradigm, dataset, idx):
     return x, y, labels, metadata, ch_names, adjacency_mtx, srate
 
 
+def save_output_dict(output_dict, output_dict_fpath, cache_format="npy"):
+    """This function saves the dictionary with subject-specific data.
+
+    With cache_format="npy", the EEG signals are stored as a raw .npy file (that can be memory-mapped when loading),
+    while labels and the remaining fields (metadata, channels, adjacency matrix, etc.) are stored in small sidecar files
+    within a directory named as output_dict_fpath (without extension).
+    With cache_format="pkl", the whole dictionary is stored in a single pickle file (legacy format).
+    Files are first written with a temporary name and then renamed, so that a partially written cache is never read.
+    """
+    tmp_suffix = ".tmp-{0}".format(os.getpid())
+    if cache_format == "pkl":
+        tmp_fpath = output_dict_fpath + tmp_suffix
+        with open(tmp_fpath, "wb") as handle:
+            pickle.dump(output_dict, handle, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_fpath, output_dict_fpath)
+    elif cache_format == "npy":
+        output_dict_dir = os.path.splitext(output_dict_fpath)[0]
+        tmp_dir = output_dict_dir + tmp_suffix
+        os.makedirs(tmp_dir)
+        np.save(os.path.join(tmp_dir, "x.npy"), output_dict["x"])
+        np.save(os.path.join(tmp_dir, "y.npy"), output_dict["y"])
+        info = {k: v for k, v in output_dict.items() if k not in ["x", "y"]}
+        with open(os.path.join(tmp_dir, "info.pkl"), "wb") as handle:
+            pickle.dump(info, handle, protocol=pickle.HIGHEST_PROTOCOL)
+        if os.path.isdir(output_dict_dir) and not os.path.isfile(
+            os.path.join(output_dict_dir, "info.pkl")
+        ):
+            shutil.rmtree(output_dict_dir)  # incomplete cache
+        try:
+            os.rename(tmp_dir, output_dict_dir)
+        except OSError:
+            # the same cache was completed by another process in the meantime
+            shutil.rmtree(tmp_dir)
+    else:
+        raise ValueError("Unknown cache format: {0}".format(cache_format))
+
+
+def find_cached_output_dict(output_dict_fpath, cache_format="npy"):
+    """This function returns the format of the cached dictionary with subject-specific data (None if not cached).
+    The requested format is searched first, then the other one."""
+    output_dict_dir = os.path.splitext(output_dict_fpath)[0]
+    cached = {
+        "npy": os.path.isfile(os.path.join(output_dict_dir, "info.pkl")),
+        "pkl": os.path.isfile(output_dict_fpath),
+    }
+    if cached.get(cache_format, False):
+        return cache_format
+    for fmt in cached.keys():
+        if cached[fmt]:
+            return fmt
+    return None
+
+
+def load_output_dict(output_dict_fpath, cache_format="npy"):
+    """This function loads the dictionary with subject-specific data.
+    With cache_format="npy", EEG signals are memory-mapped (read-only) instead of being read in memory."""
+    if cache_format == "pkl":
+        with open(output_dict_fpath, "rb") as handle:
+            output_dict = pickle.load(handle)
+    elif cache_format == "npy":
+        output_dict_dir = os.path.splitext(output_dict_fpath)[0]
+        with open(os.path.join(output_dict_dir, "info.pkl"), "rb") as handle:
+            output_dict = pickle.load(handle)
+        output_dict["x"] = np.load(
+            os.path.join(output_dict_dir, "x.npy"), mmap_mode="r"
+        )
+        output_dict["y"] = np.load(os.path.join(output_dict_dir, "y.npy"))
+    else:
+        raise ValueError("Unknown cache format: {0}".format(cache_format))
+    return output_dict
+
+
+def set_mne_data_folder(data_folder):
+    """This function sets data_folder as download directory in the MNE configuration.
+    The configuration is updated once per data folder and process, and only for the entries that differ.
+    Writes are serialized among processes with a lock file, to avoid conflicts in parallel trainings."""
+    if data_folder in mne_data_folders:
+        return
+    mne_cfg = get_config()
+    if any([mne_cfg[a] != data_folder for a in mne_cfg.keys()]):
+        with FileLock(get_config_path() + ".lock"):
+            # re-reading the configuration, it could have been changed in the meantime
+            mne_cfg = get_config()
+            for a in mne_cfg.keys():
+                if mne_cfg[a] != data_folder:
+                    set_config(a, data_folder)
+    mne_data_folders.add(data_folder)
+
+
 def download_data(data_folder, dataset):
     """This function download a specific MOABB dataset in a directory."""
     # changing default download directory
-    mne_cfg = get_config()
-    for a in mne_cfg.keys():
-        if (
-            mne_cfg[a] != data_folder
-        ):  # reducing writes on mne cfg file to avoid conflicts in parallel trainings
-            set_config(a, data_folder)
+    set_mne_data_folder(data_folder)
     dataset.download()
 
 
+def prepare_subject(
+    dataset,
+    subject,
+    output_dir,
+    events_to_load,
+    srate_in,
+    srate_out,
+    fmin,
+    fmax,
+    save_prepared_dataset=True,
+    cache_format="npy",
+    storage_dtype="float32",
+    float64_output_dir=None,
+    verbose=0,
+):
+    """This function prepares (or loads from cache) the data of a single subject and returns its dictionary.
+    Concurrent processes preparing the same subject are serialized with a lock file (sub-XXX.lock in output_dir):
+    the first one prepares and saves the subject, the others wait and then load the saved cache.
+    If the subject is not cached in output_dir, its float64 cache in float64_output_dir (if given) is used instead:
+    signals are cast to storage_dtype and, with save_prepared_dataset, saved in output_dir."""
+    fname = "sub-{0}.pkl".format(str(subject).zfill(3))
+    output_dict_fpath = os.path.join(output_dir, fname)
+
+    # Single-flight preparation: when the subject has to be prepared (or converted) and saved, only the process
+    # holding the lock of the subject does it, while concurrent processes wait and then load the saved cache
+    lock = nullcontext()
+    if (
+        save_prepared_dataset
+        and find_cached_output_dict(
+            output_dict_fpath, cache_format=cache_format
+        )
+        != cache_format
+    ):
+        lock = FileLock(os.path.splitext(output_dict_fpath)[0] + ".lock")
+    with lock:
+        # Prepare dataset only if not already prepared
+        output_dict = {}
+        cached_fpath = output_dict_fpath
+        cached_format = find_cached_output_dict(
+            output_dict_fpath, cache_format=cache_format
+        )
+        if cached_format is None and float64_output_dir is not None:
+            cached_fpath = os.path.join(float64_output_dir, fname)
+            cached_format = find_cached_output_dict(
+                cached_fpath, cache_format=cache_format
+            )
+        if cached_format is not None:
+            print("Using cached dataset at: {0}".format(cached_fpath))
+            output_dict = load_output_dict(
+                cached_fpath, cache_format=cached_format
+            )
+            if output_dict["x"].dtype != np.dtype(storage_dtype):
+                output_dict["x"] = output_dict["x"].astype(storage_dtype)
+        else:
+            output_dict = get_output_dict(
+                dataset,
+                subject,
+                events_to_load,
+                srate_in,
+                srate_out,
+                fmin=fmin,
+                fmax=fmax,
+                storage_dtype=storage_dtype,
+                montage_path=os.path.join(
+                    os.path.dirname(output_dir), "montage.npz"
+                ),
+                verbose=verbose,
+            )
+
+        if save_prepared_dataset:
+            if (
+                cached_fpath == output_dict_fpath
+                and cached_format == cache_format
+            ):
+                print(
+                    "Skipping data saving, a cached dataset was found at {0}".format(
+                        output_dict_fpath
+                    )
+                )
+            else:
+                print("Saving the dataset at {0}".format(output_dict_fpath))
+                save_output_dict(
+                    output_dict, output_dict_fpath, cache_format=cache_format
+                )
+        return output_dict
+
+
+def _prepare_subject_worker(kwargs):
+    """Worker function used to prepare subjects in a process pool.
+    Only the subject id is sent back to the main process (data are saved on disk)."""
+    prepare_subject(**kwargs)
+    return kwargs["subject"]
+
+
 def prepare_data(
     data_folder,
     dataset,
@@ -170,9 +371,38 @@ def prepare_data(
     cached_data_folder=None,
     idx_subject_to_prepare=-1,
     save_prepared_dataset=True,
+    cache_format="npy",
+    num_workers=1,
+    wideband=None,
+    storage_dtype="float32",
     verbose=0,
 ):
-    """This function prepare all datasets and save them in a separate pickle for each subject."""
+    """This function prepare all datasets and save them in a separate cache for each subject.
+    Cached datasets can be saved as memory-mapped .npy files with small sidecar files (cache_format="npy")
+    or as a single pickle file per subject (cache_format="pkl", legacy format).
+    Legacy pickle files are still read when found, and converted to the requested format when saving.
+    When all subjects are prepared (idx_subject_to_prepare < 0), num_workers > 1 prepares subjects in parallel
+    in a pool of processes. The pool is only used when prepared subjects are saved (save_prepared_dataset=True):
+    otherwise, subjects are prepared in the main process and their dictionaries are returned (dict: subject -> data).
+    When wideband=[fmin_wide, fmax_wide] is given, subjects are prepared and cached on the wide band only, and the
+    returned signals are band-passed between fmin and fmax in memory (see utils/filtering.py). This way, a single
+    cache is shared among any fmin and fmax within the wide band (e.g., during hyperparameter optimization).
+    EEG signals are prepared, cached and returned with the data type storage_dtype: 'float32' (default) halves
+    memory and disk usage with respect to 'float64', while 'float16' quarters it (with a resolution of about 0.06 uV
+    for signals in volts). Caches with a data type different from 'float64' are stored in separate directories: when a
+    subject is not found there, its float64 cache (e.g., prepared before storage_dtype was introduced) is cast and
+    converted instead of preparing the subject again."""
+    band = [fmin, fmax]
+    if wideband is not None:
+        if (
+            wideband[0] is not None and (fmin is None or fmin < wideband[0])
+        ) or (wideband[1] is not None and (fmax is None or fmax > wideband[1])):
+            raise ValueError(
+                "The band [{0}, {1}] must be within the wide band {2}".format(
+                    fmin, fmax, wideband
+                )
+            )
+        fmin, fmax = wideband
 
     # Crete the data folder (if needed)
     if not os.path.exists(data_folder):
@@ -180,12 +410,7 @@ def prepare_data(
         os.makedirs(data_folder)
 
     # changing default download directory
-    mne_cfg = get_config()
-    for a in mne_cfg.keys():
-        if (
-            mne_cfg[a] != data_folder
-        ):  # reducing writes on mne cfg file to avoid conflicts in parallel trainings
-            set_config(a, data_folder)
+    set_mne_data_folder(data_folder)
     if cached_data_folder is None:
         cached_data_folder = data_folder
     tmp_output_dir = os.path.join(
@@ -199,56 +424,100 @@ def prepare_data(
                 ).zfill(4),
                 str(fmin).zfill(3),
                 str(fmax).zfill(3),
-            ),
+            )
+            + ("" if storage_dtype == "float64" else "_" + storage_dtype),
         )
     )
     if not os.path.isdir(tmp_output_dir):
-        os.makedirs(tmp_output_dir)
-
-    if idx_subject_to_prepare < 0:
-        subject_to_prepare = dataset.subject_list
-    else:
-        subject_to_prepare = [dataset.subject_list[idx_subject_to_prepare]]
-
-    for kk, subject in enumerate(subject_to_prepare):
-        fname = "sub-{0}.pkl".format(str(subject).zfill(3))
-        output_dict_fpath = os.path.join(tmp_output_dir, fname)
+        os.makedirs(tmp_output_dir, exist_ok=True)
+    float64_output_dir = None
+    if storage_dtype != "float64":
+        float64_output_dir = tmp_output_dir[: -len("_" + storage_dtype)]
+
+    subject_kwargs = dict(
+        dataset=dataset,
+        output_dir=tmp_output_dir,
+        events_to_load=events_to_load,
+        srate_in=srate_in,
+        srate_out=srate_out,
+        fmin=fmin,
+        fmax=fmax,
+        save_prepared_dataset=save_prepared_dataset,
+        cache_format=cache_format,
+        storage_dtype=storage_dtype,
+        float64_output_dir=float64_output_dir,
+        verbose=verbose,
+    )
 
-        # Prepare dataset only if not already prepared
-        output_dict = {}
-        if os.path.isfile(output_dict_fpath):
-            print("Using cached dataset at: {0}".format(output_dict_fpath))
-            with open(output_dict_fpath, "rb") as handle:
-                output_dict = pickle.load(handle)
-        else:
-            output_dict = get_output_dict(
-                dataset,
-                subject,
-                events_to_load,
-                srate_in,
-                srate_out,
-                fmin=fmin,
-                fmax=fmax,
-                verbose=verbose,
+    def select_band(output_dict):
+        """Band-passes the signals of a subject prepared on the wide band between fmin and fmax (if needed)."""
+        if wideband is not None and band != list(wideband):
+            output_dict = dict(output_dict)
+            output_dict["x"] = filter_bank(
+                (tmp_output_dir, output_dict["subject"]),
+                output_dict["x"],
+                output_dict["srate"],
+                band[0],
+                band[1],
             )
+            output_dict["fmin"], output_dict["fmax"] = band
+        return output_dict
+
+    if (
+        idx_subject_to_prepare > -1
+    ):  # iterating over only 1 subject, return its dictionary
+        output_dict = prepare_subject(
+            subject=dataset.subject_list[idx_subject_to_prepare],
+            **subject_kwargs,
+        )
+        return select_band(output_dict)
+
+    subject_to_prepare = dataset.subject_list
+    n_subjects = len(subject_to_prepare)
+    start_time = time.time()
+
+    def report(kk, subject):
+        """Prints progress and throughput of the preparation."""
+        elapsed = time.time() - start_time
+        print(
+            "Prepared {0}/{1} subjects of {2} (last: sub-{3}) - elapsed: {4:.1f} s, throughput: {5:.2f} subjects/min".format(
+                kk,
+                n_subjects,
+                dataset.code,
+                str(subject).zfill(3),
+                elapsed,
+                60 * kk / max(elapsed, 1e-6),
+            )
+        )
 
-        if save_prepared_dataset:
-            if os.path.isfile(output_dict_fpath):
-                print(
-                    "Skipping data saving, a cached dataset was found at {0}".format(
-                        output_dict_fpath
-                    )
+    if num_workers > 1 and not save_prepared_dataset:
+        # the subjects prepared by the workers would be discarded (they are not saved and sending them back to the
+        # main process would copy them): they are prepared in the main process and returned instead
+        print(
+            "Preparing subjects in the main process (prepared subjects are not saved)"
+        )
+        num_workers = 1
+
+    if num_workers > 1:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            futures = [
+                executor.submit(
+                    _prepare_subject_worker,
+                    dict(subject=subject, **subject_kwargs),
                 )
-            else:
-                print("Saving the dataset at {0}".format(output_dict_fpath))
-                with open(output_dict_fpath, "wb") as handle:
-                    pickle.dump(
-                        output_dict, handle, protocol=pickle.HIGHEST_PROTOCOL
-                    )
-        if (
-            idx_subject_to_prepare > -1
-        ):  # iterating over only 1 subject, return its dictionary
-            return output_dict
+                for subject in subject_to_prepare
+            ]
+            for kk, future in enumerate(as_completed(futures)):
+                report(kk + 1, future.result())
+    else:
+        output_dicts = {}
+        for kk, subject in enumerate(subject_to_prepare):
+            output_dict = prepare_subject(subject=subject, **subject_kwargs)
+            if not save_prepared_dataset:
+                output_dicts[subject] = select_band(output_dict)
+            report(kk + 1, subject)
+        if not save_prepared_dataset:
+            return output_dicts
 
 
 if __name__ == "__main__":
@@ -270,7 +539,19 @@ if __name__ == "__main__":
         "--cached_data_folder",
         type=str,
         default="/path/to/pickled/MOABB_datasets",
-        help="Folder where dataset will be prepared and saved as pkl",
+        help="Folder where dataset will be prepared and saved",
+    )
+    parser.add_argument(
+        "--cache_format",
+        type=str,
+        default="npy",
+        help="Format of the prepared dataset: npy (memory-mapped) or pkl (legacy)",
+    )
+    parser.add_argument(
+        "--storage_dtype",
+        type=str,
+        default="float32",
+        help="Data type of the prepared EEG signals: float64, float32 or float16",
     )
     parser.add_argument(
         "--to_download", type=int, default=0, help="Download flag"
@@ -278,6 +559,12 @@ if __name__ == "__main__":
     parser.add_argument(
         "--to_prepare", type=int, default=0, help="Prepare flag"
     )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=1,
+        help="Number of processes used to prepare subjects in parallel",
+    )
     parser.add_argument(
         "--fmin",
         type=float,
@@ -303,13 +590,13 @@ if __name__ == "__main__":
         "Zhou2016",
     ]
     mi_datasets = [
-        BNCI2014001(),
-        BNCI2014004(),
-        BNCI2015001(),
-        BNCI2015004(),
-        Lee2019_MI(),
-        Shin2017A(accept=True),
-        Zhou2016(),
+        LazyDataset("BNCI2014001"),
+        LazyDataset("BNCI2014004"),
+        LazyDataset("BNCI2015001"),
+        LazyDataset("BNCI2015004"),
+        LazyDataset("Lee2019_MI"),
+        LazyDataset("Shin2017A", accept=True),
+        LazyDataset("Zhou2016"),
     ]
     mi_srate_in_list = [250, 250, 512, 256, 1000, 1000, 250]
     mi_srate_out_list = [125, 125, 128, 128, 125, 125, 125]
@@ -325,10 +612,10 @@ if __name__ == "__main__":
     # SETTING UP P300 DATASETS
     p300_ds_names = ["BNCI2014009", "EPFLP300", "Lee2019_ERP", "bi2015a"]
     p300_datasets = [
-        BNCI2014009(),
-        EPFLP300(),
-        Lee2019_ERP(),
-        bi2015a(),
+        LazyDataset("BNCI2014009"),
+        LazyDataset("EPFLP300"),
+        LazyDataset("Lee2019_ERP"),
+        LazyDataset("bi2015a"),
     ]
     p300_srate_in_list = [256, 512, 1000, 512]
     p300_srate_out_list = [128, 128, 125, 128]
@@ -340,7 +627,7 @@ if __name__ == "__main__":
     ]
     # SETTING UP SSVEP DATASETS
     ssvep_ds_names = ["Lee2019_SSVEP"]
-    ssvep_datasets = [Lee2019_SSVEP()]
+    ssvep_datasets = [LazyDataset("Lee2019_SSVEP")]
     ssvep_srate_in_list = [1000]
     ssvep_srate_out_list = [125]
     ssvep_events_to_load = [None]
@@ -395,6 +682,9 @@ if __name__ == "__main__":
                 fmin=FLAGS.fmin,
                 fmax=FLAGS.fmax,
                 cached_data_folder=FLAGS.cached_data_folder,
+                cache_format=FLAGS.cache_format,
+                num_workers=FLAGS.num_workers,
+                storage_dtype=FLAGS.storage_dtype,
                 verbose=0,
             )
             print("Ended: {0}".format(dataset.code))
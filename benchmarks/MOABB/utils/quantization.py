@@ -0,0 +1,181 @@
+"""
+Post-training int8 quantization of trained networks for CPU inference (see quantize.py).
+
+Two kinds of quantization are combined:
+- static quantization of the convolutional stacks: runs of consecutive layers of torch.nn.Sequential containers that
+can be computed on int8 tensors (convolutions, batch normalization, ELU/ReLU/LeakyReLU activations, pooling and
+dropout), starting with a convolution, are wrapped into QuantizedBlocks (quantization of the inputs, int8 layers and
+dequantization of the outputs). The quantization parameters of the activations are calibrated on a few batches of
+training examples. Layers without int8 implementations (e.g., Square and Log of ShallowConvNet) are kept in float32;
+- dynamic quantization of the linear layers (sb.nnet.linear.Linear, e.g. the dense and attention modules): weights are
+stored in int8 and activations are quantized on the fly.
+
+The max-norm constraints of convolutional and linear layers (applied to the weights at each forward pass) are applied
+once and then disabled, since int8 weights cannot be renormalized.
+"""
+
+import copy
+import io
+import warnings
+import torch
+import torch.ao.quantization as tq
+import speechbrain as sb
+
+# Layers computed on int8 tensors in QuantizedBlocks
+QUANTIZABLE_LAYERS = (
+    sb.nnet.CNN.Conv2d,
+    sb.nnet.normalization.BatchNorm2d,
+    sb.nnet.pooling.Pooling2d,
+    torch.nn.ELU,
+    torch.nn.ReLU,
+    torch.nn.LeakyReLU,
+    torch.nn.Dropout,
+)
+
+
+class QuantizedBlock(torch.nn.Sequential):
+    """Sequence of layers computed on int8 tensors (inputs and outputs are float32 tensors)."""
+
+    def __init__(self, layers):
+        super().__init__(tq.QuantStub(), *layers, tq.DeQuantStub())
+
+
+def get_default_engine():
+    """This function returns the quantized engine used by default (x86 or fbgemm on x86 CPUs, qnnpack on ARM CPUs)."""
+    for engine in ["x86", "fbgemm", "qnnpack"]:
+        if engine in torch.backends.quantized.supported_engines:
+            return engine
+    return torch.backends.quantized.engine
+
+
+def disable_max_norm(model):
+    """This function applies the max-norm constraints of convolutional and linear layers to their weights (as in
+    their forward pass) and disables them."""
+    for module in model.modules():
+        if isinstance(module, sb.nnet.CNN.Conv2d):
+            layer = module.conv
+        elif isinstance(module, sb.nnet.linear.Linear):
+            layer = module.w
+        else:
+            continue
+        if module.max_norm is not None:
+            with torch.no_grad():
+                layer.weight.data = torch.renorm(
+                    layer.weight.data, p=2, dim=0, maxnorm=module.max_norm
+                )
+            module.max_norm = None
+
+
+def insert_quantized_blocks(module):
+    """This function wraps the runs of quantizable layers (starting with a convolution) of the torch.nn.Sequential
+    containers of module into QuantizedBlocks (in place). Convolutions that are not in torch.nn.Sequential containers
+    are wrapped alone. It returns the number of QuantizedBlocks."""
+    n_blocks = 0
+    if isinstance(module, torch.nn.Sequential) and not isinstance(
+        module, QuantizedBlock
+    ):
+        children, run = [], []
+        for name, child in list(module.named_children()) + [(None, None)]:
+            if isinstance(child, QUANTIZABLE_LAYERS) and (
+                len(run) > 0 or isinstance(child, sb.nnet.CNN.Conv2d)
+            ):
+                # layers shared by different positions (e.g., activations) are copied, to get their own observers
+                run.append((name, copy.deepcopy(child)))
+                continue
+            if len(run) > 0:
+                children.append(
+                    (
+                        "qblock_" + run[0][0],
+                        QuantizedBlock([layer for _, layer in run]),
+                    )
+                )
+                n_blocks += 1
+                run = []
+            if child is not None:
+                n_blocks += insert_quantized_blocks(child)
+                children.append((name, child))
+        module._modules.clear()
+        for name, child in children:
+            module.add_module(name, child)
+        return n_blocks
+
+    for name, child in module.named_children():
+        if isinstance(child, sb.nnet.CNN.Conv2d):
+            setattr(module, name, QuantizedBlock([child]))
+            n_blocks += 1
+        else:
+            n_blocks += insert_quantized_blocks(child)
+    return n_blocks
+
+
+def quantize_model(model, calibration_batches=None, engine=None):
+    """This function returns an int8 copy of a trained network (the network is not modified).
+
+    Arguments
+    ---------
+    model: torch.nn.Module
+        Trained network (on CPU).
+    calibration_batches: iterable
+        Network inputs used to calibrate the quantization parameters of the activations of the convolutional stacks.
+        If None, the network is not calibrated (e.g., when the quantized parameters are loaded afterwards from a
+        checkpoint).
+    engine: str
+        Quantized engine (see torch.backends.quantized.supported_engines). If None, see get_default_engine.
+
+    Returns
+    ---------
+    qmodel: torch.nn.Module
+        Quantized network.
+    """
+    engine = get_default_engine() if engine is None else engine
+    torch.backends.quantized.engine = engine
+    qmodel = copy.deepcopy(model).cpu().eval()
+    disable_max_norm(qmodel)
+
+    # static quantization of the convolutional stacks
+    if insert_quantized_blocks(qmodel) > 0:
+        qconfig = tq.get_default_qconfig(engine)
+        for module in qmodel.modules():
+            if isinstance(module, QuantizedBlock):
+                module.qconfig = qconfig
+        tq.prepare(qmodel, inplace=True)
+        if calibration_batches is not None:
+            with torch.no_grad():
+                for inputs in calibration_batches:
+                    qmodel(inputs)
+        with warnings.catch_warnings():
+            # uncalibrated layers (the quantization parameters are loaded afterwards)
+            warnings.filterwarnings("ignore", message="must run observer")
+            tq.convert(qmodel, inplace=True)
+
+    # dynamic quantization of the linear layers
+    return tq.quantize_dynamic(
+        qmodel, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+    )
+
+
+def get_quantized_state(qmodel):
+    """This function returns the state of a quantized network: its state dictionary and the quantization parameters
+    (scale and zero point) of its int8 layers, which are not all in the state dictionary (e.g., for ELU)."""
+    qparams = {
+        name: {"scale": module.scale, "zero_point": module.zero_point}
+        for name, module in qmodel.named_modules()
+        if isinstance(getattr(module, "scale", None), float)
+    }
+    return {"state_dict": qmodel.state_dict(), "qparams": qparams}
+
+
+def load_quantized_state(qmodel, state):
+    """This function loads the state of a quantized network (see get_quantized_state)."""
+    qmodel.load_state_dict(state["state_dict"])
+    modules = dict(qmodel.named_modules())
+    for name, qparams in state["qparams"].items():
+        modules[name].scale = qparams["scale"]
+        modules[name].zero_point = qparams["zero_point"]
+
+
+def get_model_size(model):
+    """This function returns the size (MB) of the state dictionary of a network, as saved on disk."""
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell() / 2 ** 20
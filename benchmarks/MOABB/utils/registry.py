@@ -0,0 +1,162 @@
+"""
+Lazy registry of MOABB datasets and paradigms.
+
+Importing moabb takes seconds (it imports, e.g., scikit-learn, pyriemann and matplotlib), and every training process
+paid it at startup, even when the prepared datasets were cached. Datasets and paradigms are thus referred to by name,
+and their classes are imported only when they are used (e.g., to download or prepare subjects).
+
+LazyDataset (see dataset in hparam files) wraps a MOABB dataset created at the first access to one of its attributes.
+The attributes needed to find the cached subjects (code, subject_list, n_sessions and paradigm) are saved in a small
+metadata file next to the cache (MOABB_pickled/<name>.json) when the dataset is first created, so that trainings on
+cached datasets do not import moabb at all. The metadata file is ignored if it was saved with another version of
+moabb or with other arguments of the dataset.
+"""
+
+import importlib
+import importlib.metadata
+import json
+import os
+
+# Supported datasets: name -> class. Other names are looked up in moabb.datasets
+DATASETS = {
+    "BNCI2014001": "moabb.datasets.BNCI2014001",
+    "BNCI2014004": "moabb.datasets.BNCI2014004",
+    "BNCI2015001": "moabb.datasets.BNCI2015001",
+    "BNCI2015004": "moabb.datasets.BNCI2015004",
+    "Lee2019_MI": "moabb.datasets.Lee2019_MI",
+    "Shin2017A": "moabb.datasets.Shin2017A",
+    "Zhou2016": "moabb.datasets.Zhou2016",
+    "BNCI2014009": "moabb.datasets.BNCI2014009",
+    "EPFLP300": "moabb.datasets.EPFLP300",
+    "Lee2019_ERP": "moabb.datasets.Lee2019_ERP",
+    "bi2015a": "moabb.datasets.bi2015a",
+    "Lee2019_SSVEP": "moabb.datasets.Lee2019_SSVEP",
+}
+
+# Paradigms of MOABB datasets (dataset.paradigm) -> class
+PARADIGMS = {
+    "imagery": "moabb.paradigms.MotorImagery",
+    "p300": "moabb.paradigms.P300",
+    "ssvep": "moabb.paradigms.SSVEP",
+}
+
+# Attributes of LazyDataset read from the metadata file (without creating the MOABB dataset)
+METADATA_KEYS = ["code", "subject_list", "n_sessions", "paradigm"]
+
+
+def import_class(path):
+    """This function imports a class from its path (module.Class)."""
+    module_name, class_name = path.rsplit(".", 1)
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def get_dataset_class(name):
+    """This function returns the class of a MOABB dataset from its name (e.g., BNCI2014001)."""
+    return import_class(DATASETS.get(name, "moabb.datasets." + name))
+
+
+def get_paradigm(paradigm, **kwargs):
+    """This function creates the MOABB paradigm of a dataset (dataset.paradigm, e.g. imagery) with kwargs."""
+    if paradigm not in PARADIGMS:
+        raise ValueError(
+            "Unknown paradigm {0} (supported paradigms: {1})".format(
+                paradigm, ", ".join(PARADIGMS.keys())
+            )
+        )
+    return import_class(PARADIGMS[paradigm])(**kwargs)
+
+
+def get_moabb_version():
+    """This function returns the installed version of moabb (without importing it)."""
+    try:
+        return importlib.metadata.version("moabb")
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+
+class LazyDataset(object):
+    """MOABB dataset created at the first access to its attributes.
+
+    Arguments
+    ---------
+    name: str
+        Name of the dataset (e.g., BNCI2014001, see DATASETS).
+    metadata_folder: str
+        Folder of the cached datasets (e.g., cached_data_folder), where the metadata file is saved. If None, the
+        metadata are not saved and the dataset is created at the first access to any attribute.
+    **kwargs: dict
+        Arguments of the dataset class (e.g., accept=True for Shin2017A).
+
+    Example
+    -------
+    >>> dataset = LazyDataset("BNCI2014001")
+    >>> dataset.name
+    'BNCI2014001'
+    >>> dataset.dataset is None
+    True
+    """
+
+    def __init__(self, name, metadata_folder=None, **kwargs):
+        self.name = name
+        self.metadata_folder = metadata_folder
+        self.kwargs = kwargs
+        self.dataset = None
+        self.metadata = self.load_metadata()
+
+    def __repr__(self):
+        return "LazyDataset({0})".format(self.name)
+
+    def get_metadata_path(self):
+        """Returns the path of the metadata file (None if metadata_folder is None)."""
+        if self.metadata_folder is None:
+            return None
+        return os.path.join(
+            self.metadata_folder, "MOABB_pickled", self.name + ".json"
+        )
+
+    def load_metadata(self):
+        """Returns the saved metadata of the dataset (None if they are missing or out of date)."""
+        metadata_path = self.get_metadata_path()
+        if metadata_path is None or not os.path.isfile(metadata_path):
+            return None
+        with open(metadata_path) as fin:
+            metadata = json.load(fin)
+        if (
+            metadata.get("moabb_version") != get_moabb_version()
+            or metadata.get("kwargs") != self.kwargs
+        ):
+            return None
+        return metadata
+
+    def save_metadata(self):
+        """Saves the metadata of the dataset (the file is replaced atomically, for concurrent processes)."""
+        metadata_path = self.get_metadata_path()
+        os.makedirs(os.path.dirname(metadata_path), exist_ok=True)
+        tmp_path = "{0}.{1}.tmp".format(metadata_path, os.getpid())
+        with open(tmp_path, "w") as fout:
+            json.dump(self.metadata, fout)
+        os.replace(tmp_path, metadata_path)
+
+    def resolve(self):
+        """Returns the MOABB dataset (created at the first call)."""
+        if self.dataset is None:
+            self.dataset = get_dataset_class(self.name)(**self.kwargs)
+            if self.metadata is None and self.metadata_folder is not None:
+                self.metadata = {
+                    "code": self.dataset.code,
+                    "subject_list": [int(s) for s in self.dataset.subject_list],
+                    "n_sessions": int(self.dataset.n_sessions),
+                    "paradigm": self.dataset.paradigm,
+                    "moabb_version": get_moabb_version(),
+                    "kwargs": self.kwargs,
+                }
+                self.save_metadata()
+        return self.dataset
+
+    def __getattr__(self, attr):
+        # only called for the attributes that are not set in __init__, i.e. the attributes of the MOABB dataset
+        if attr.startswith("__") or "metadata" not in self.__dict__:
+            raise AttributeError(attr)
+        if self.metadata is not None and attr in METADATA_KEYS:
+            return self.metadata[attr]
+        return getattr(self.resolve(), attr)
@@ -0,0 +1,288 @@
+#!/usr/bin/python
+"""
+Results database of trainings on MOABB datasets.
+
+At the end of each training (i.e., each fold), train.py appends the performance metrics, confusion matrices, training
+time and hparams of the fold to a single SQLite database. Folds are indexed by dataset, model, data iterator, target
+subject (subject id in the dataset), target session, seed and Orion trial, so that the results of large experiments (e.g., hparam tuning) can be
+summarized with a single query, without parsing result files.
+
+To summarize the results of a database (mean and standard deviation of a metric over folds):
+
+    > python utils/results_db.py results/MotorImagery/BNCI2014001/EEGNet/results.db --metric acc --split test \
+    --group_by model session
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import time
+import numpy as np
+
+# Keys indexing the folds
+FOLD_KEYS = [
+    "dataset",
+    "model",
+    "iterator",
+    "subject",
+    "session",
+    "seed",
+    "trial",
+]
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS folds (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        dataset TEXT,
+        model TEXT,
+        iterator TEXT,
+        subject INTEGER,
+        session INTEGER,
+        seed INTEGER,
+        trial TEXT,
+        exp_dir TEXT,
+        train_time REAL,
+        hparams TEXT,
+        created REAL
+    )""",
+    """CREATE TABLE IF NOT EXISTS metrics (
+        fold_id INTEGER REFERENCES folds(id),
+        split TEXT,
+        name TEXT,
+        value REAL
+    )""",
+    """CREATE TABLE IF NOT EXISTS confusion_matrices (
+        fold_id INTEGER REFERENCES folds(id),
+        split TEXT,
+        matrix TEXT
+    )""",
+    "CREATE INDEX IF NOT EXISTS folds_idx ON folds ({0})".format(
+        ", ".join(FOLD_KEYS)
+    ),
+    "CREATE INDEX IF NOT EXISTS folds_trial_idx ON folds (trial)",
+    "CREATE INDEX IF NOT EXISTS metrics_idx ON metrics (name, split, fold_id)",
+    "CREATE INDEX IF NOT EXISTS confusion_matrices_idx ON confusion_matrices (fold_id, split)",
+]
+
+
+def connect(db_path, timeout=60.0):
+    """This function opens a results database, creating it (and its tables) if needed.
+    Concurrent writers (e.g., parallel trainings) wait for each other up to timeout seconds."""
+    db_dir = os.path.dirname(db_path)
+    if db_dir != "" and not os.path.isdir(db_dir):
+        os.makedirs(db_dir, exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=timeout)
+    with conn:
+        for statement in SCHEMA:
+            conn.execute(statement)
+    return conn
+
+
+def get_scalar_hparams(hparams):
+    """This function returns the hparams that can be stored as JSON (numbers, strings, booleans and their lists)."""
+    scalar_types = (int, float, str, bool, type(None))
+    scalar_hparams = {}
+    for key, value in hparams.items():
+        if isinstance(value, scalar_types):
+            scalar_hparams[key] = value
+        elif isinstance(value, (list, tuple)) and all(
+            [isinstance(item, scalar_types) for item in value]
+        ):
+            scalar_hparams[key] = list(value)
+    return scalar_hparams
+
+
+def append_fold(
+    db_path, fold, eval_stats, train_time=None, hparams=None, exp_dir=None
+):
+    """This function appends the results of a fold to a results database (in a single transaction).
+
+    Arguments
+    ---------
+    db_path: str
+        Path of the database.
+    fold: dict
+        Keys of the fold (see FOLD_KEYS). The subject is the subject id of the dataset (not its index).
+    eval_stats: dict
+        Evaluation stats for each split (e.g., {"test": {"loss": 0.4, "acc": 0.8, "cm": ...}, "valid": ...}).
+        Confusion matrices ("cm") are stored as JSON lists, other stats as metrics.
+    train_time: float
+        Training time (s).
+    hparams: dict
+        Hparams of the fold (only the ones that can be stored as JSON are stored).
+    exp_dir: str
+        Experiment directory of the fold.
+
+    Returns
+    ---------
+    fold_id: int
+        Identifier of the fold in the database.
+    """
+    conn = connect(db_path)
+    try:
+        with conn:
+            cursor = conn.execute(
+                "INSERT INTO folds ({0}, exp_dir, train_time, hparams, created) VALUES ({1})".format(
+                    ", ".join(FOLD_KEYS),
+                    ", ".join(["?"] * (len(FOLD_KEYS) + 4)),
+                ),
+                [
+                    value.item() if isinstance(value, np.generic) else value
+                    for value in [fold.get(key) for key in FOLD_KEYS]
+                ]
+                + [
+                    exp_dir,
+                    train_time,
+                    json.dumps(
+                        get_scalar_hparams(hparams)
+                        if hparams is not None
+                        else {}
+                    ),
+                    time.time(),
+                ],
+            )
+            fold_id = cursor.lastrowid
+            for split, stats in eval_stats.items():
+                for name, value in stats.items():
+                    if name == "cm":
+                        conn.execute(
+                            "INSERT INTO confusion_matrices VALUES (?, ?, ?)",
+                            (
+                                fold_id,
+                                split,
+                                json.dumps(np.asarray(value).tolist()),
+                            ),
+                        )
+                    else:
+                        conn.execute(
+                            "INSERT INTO metrics VALUES (?, ?, ?, ?)",
+                            (fold_id, split, str(name), float(value)),
+                        )
+    finally:
+        conn.close()
+    return fold_id
+
+
+def query_metrics(
+    db_path,
+    metric,
+    split="test",
+    group_by=("dataset", "model", "iterator"),
+    where=None,
+):
+    """This function summarizes a metric over the folds of a results database.
+
+    Arguments
+    ---------
+    db_path: str
+        Path of the database.
+    metric: str
+        Metric to summarize (e.g., acc or f1).
+    split: str
+        Evaluation split (test or valid).
+    group_by: list
+        Fold keys used to group the folds (see FOLD_KEYS).
+    where: dict
+        Values of fold keys used to select the folds (e.g., {"trial": "a1b2c3"}).
+
+    Returns
+    ---------
+    rows: list
+        One dictionary for each group, with the values of the group keys, the number of folds (n) and the mean and
+        standard deviation of the metric (mean, std).
+    """
+    group_by = list(group_by)
+    where = {} if where is None else where
+    for key in group_by + list(where.keys()):
+        if key not in FOLD_KEYS:
+            raise ValueError(
+                "Unknown fold key: {0} (it can be {1})".format(
+                    key, ", ".join(FOLD_KEYS)
+                )
+            )
+    columns = ["folds.{0}".format(key) for key in group_by]
+    conditions = ["metrics.name = ?", "metrics.split = ?"] + [
+        "folds.{0} = ?".format(key) for key in where.keys()
+    ]
+    query = (
+        "SELECT {0} COUNT(metrics.value), AVG(metrics.value), AVG(metrics.value * metrics.value) "
+        "FROM metrics JOIN folds ON folds.id = metrics.fold_id WHERE {1}"
+    ).format(
+        "".join([column + ", " for column in columns]),
+        " AND ".join(conditions),
+    )
+    if len(columns) > 0:
+        query += " GROUP BY {0} ORDER BY {0}".format(", ".join(columns))
+
+    conn = connect(db_path)
+    try:
+        results = conn.execute(
+            query, [metric, split] + list(where.values())
+        ).fetchall()
+    finally:
+        conn.close()
+
+    rows = []
+    for result in results:
+        n, mean, mean_sq = result[len(group_by) :]
+        if n == 0:
+            continue
+        row = dict(zip(group_by, result[: len(group_by)]))
+        row["n"] = n
+        row["mean"] = mean
+        row["std"] = float(np.sqrt(max(mean_sq - mean ** 2, 0.0)))
+        rows.append(row)
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Summarize the results stored in a results database"
+    )
+    parser.add_argument("db_path", help="Results database path")
+    parser.add_argument(
+        "--metric", default="acc", help="Metric (e.g., acc or f1)"
+    )
+    parser.add_argument(
+        "--split",
+        default="test",
+        choices=["test", "valid"],
+        help="Evaluation split. Default: test",
+    )
+    parser.add_argument(
+        "--group_by",
+        nargs="*",
+        default=["dataset", "model", "iterator"],
+        help="Fold keys used to group the folds ({0}). Default: dataset model iterator".format(
+            ", ".join(FOLD_KEYS)
+        ),
+    )
+    parser.add_argument(
+        "--where",
+        nargs="*",
+        default=[],
+        help="Selection of the folds, as key=value pairs (e.g., trial=a1b2c3)",
+    )
+    FLAGS = parser.parse_args()
+
+    where = dict([condition.split("=", 1) for condition in FLAGS.where])
+    rows = query_metrics(
+        FLAGS.db_path,
+        FLAGS.metric,
+        split=FLAGS.split,
+        group_by=FLAGS.group_by,
+        where=where,
+    )
+    for row in rows:
+        print(
+            "{0}{1} {2:.4f} ± {3:.4f} (n={4})".format(
+                "".join(
+                    ["{0} {1} ".format(key, row[key]) for key in FLAGS.group_by]
+                ),
+                FLAGS.metric,
+                row["mean"],
+                row["std"],
+                row["n"],
+            )
+        )
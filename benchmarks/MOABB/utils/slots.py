@@ -0,0 +1,119 @@
+"""
+Resource slots for parallel trainings on the same machine.
+
+When multiple trainings run at once (e.g., parallel Orion trials with run_hparam_optimization.sh --n_workers, or
+parallel folds with run.py --num_workers), each training process takes one of the available slots and holds it (with a
+lock file) until it terminates. The slot defines the resources of the process: a budget of CPU threads
+(torch.set_num_threads), optionally the CPU cores the process is pinned to, and the GPU it uses. In this way concurrent
+trainings share the machine without oversubscribing it.
+
+Slots are configured with environment variables, so that they are inherited by all processes launched by Orion,
+run_experiments.sh and run.py:
+    MOABB_N_SLOTS: number of slots (if not set, slots are not used)
+    MOABB_SLOTS_DIR: folder containing the lock files of the slots (default: <tmp>/moabb_slots)
+    MOABB_SLOT_THREADS: number of threads of each slot (default: available CPU cores / number of slots)
+    MOABB_PIN_CPUS: if True, each slot is pinned to its own CPU cores (default: False)
+    MOABB_SLOT_GPUS: comma-separated list of GPUs assigned round-robin to the slots (e.g., 0,1)
+"""
+
+import logging
+import os
+import tempfile
+import time
+import torch
+from utils.file_lock import FileLock
+
+logger = logging.getLogger(__name__)
+
+# Slot held by the current process (index and lock), kept until the process terminates
+current_slot = None
+
+
+def get_available_cpus():
+    """This function returns the list of CPU cores the current process can run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count()))
+
+
+def acquire_slot(slots_dir, n_slots, poll_interval=1.0):
+    """This function acquires the first free slot, waiting until a slot is released if all slots are taken.
+
+    Arguments
+    ---------
+    slots_dir: str
+        Folder containing the lock files of the slots.
+    n_slots: int
+        Number of slots.
+    poll_interval: float
+        Seconds between two attempts when all slots are taken.
+
+    Returns
+    ---------
+    slot_idx: int
+        Index of the acquired slot.
+    lock: FileLock
+        Lock of the acquired slot (the slot is released with lock.release() or when the process terminates).
+    """
+    while True:
+        for slot_idx in range(n_slots):
+            lock = FileLock(
+                os.path.join(slots_dir, "slot-{0}.lock".format(slot_idx)),
+                blocking=False,
+            )
+            if lock.acquire():
+                return slot_idx, lock
+        time.sleep(poll_interval)
+
+
+def use_slot():
+    """This function takes a slot (as configured by the environment variables) and limits the current process to the
+    resources of the slot. It returns the index of the slot, or None if slots are not used.
+    The slot is taken only once per process."""
+    global current_slot
+    if current_slot is not None:
+        return current_slot[0]
+    n_slots = int(os.environ.get("MOABB_N_SLOTS", "0"))
+    if n_slots < 1:
+        return None
+    slots_dir = os.environ.get(
+        "MOABB_SLOTS_DIR", os.path.join(tempfile.gettempdir(), "moabb_slots")
+    )
+    slot_idx, lock = acquire_slot(slots_dir, n_slots)
+    current_slot = (slot_idx, lock)
+
+    # CPU threads (and cores)
+    cpus = get_available_cpus()
+    n_threads = int(
+        os.environ.get("MOABB_SLOT_THREADS", max(1, len(cpus) // n_slots))
+    )
+    torch.set_num_threads(n_threads)
+    slot_cpus = None
+    if os.environ.get("MOABB_PIN_CPUS", "False") == "True" and hasattr(
+        os, "sched_setaffinity"
+    ):
+        slot_cpus = [
+            cpus[(slot_idx * n_threads + i) % len(cpus)]
+            for i in range(n_threads)
+        ]
+        os.sched_setaffinity(0, slot_cpus)
+
+    # GPU (CUDA is not initialized yet, so that only the GPU of the slot is visible)
+    gpus = [
+        gpu
+        for gpu in os.environ.get("MOABB_SLOT_GPUS", "").split(",")
+        if gpu.strip() != ""
+    ]
+    if len(gpus) > 0:
+        os.environ["CUDA_VISIBLE_DEVICES"] = gpus[slot_idx % len(gpus)].strip()
+
+    logger.info(
+        "Slot {0}/{1}: {2} threads, cpus: {3}, gpus: {4}".format(
+            slot_idx,
+            n_slots,
+            n_threads,
+            "all" if slot_cpus is None else slot_cpus,
+            os.environ.get("CUDA_VISIBLE_DEVICES", "all"),
+        )
+    )
+    return slot_idx
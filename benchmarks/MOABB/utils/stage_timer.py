@@ -0,0 +1,87 @@
+"""
+Per-stage timing of training epochs (see stage_timing in hparam files).
+
+The hot path of MOABBBrain is split into consecutive laps (e.g., batch fetch, augmentation, normalization, forward pass,
+backward pass and optimizer step, validation metrics, checkpoint I/O): at the end of each lap, the wall time elapsed
+since the end of the previous lap is added to the lap stage. In this way a single clock read is needed at each stage
+boundary, and the stages of an epoch add up to its wall time.
+"""
+
+import json
+import time
+from collections import OrderedDict
+import torch
+
+
+class StageTimer(object):
+    """Accumulator of the wall time of the stages of an epoch.
+
+    Arguments
+    ---------
+    device: str
+        Device of the training. On CUDA devices, the queued operations are waited for at each lap, so that their time
+        is assigned to the stage that queued them (this slightly slows down the training).
+
+    Example
+    -------
+    >>> timer = StageTimer()
+    >>> timer.start_stage("train")
+    >>> timer.lap("fetch")
+    >>> timer.lap("forward")
+    >>> timer.add_samples(16)
+    >>> list(timer.get_stats()["train"].keys())
+    ['fetch', 'forward', 'total', 'samples/s']
+    """
+
+    def __init__(self, device="cpu"):
+        self.synchronize = torch.device(device).type == "cuda"
+        self.reset()
+
+    def reset(self):
+        """Clears the recorded times (e.g., at the beginning of an epoch)."""
+        self.times = OrderedDict()
+        self.n_samples = OrderedDict()
+        self.stage = None
+        self.last_time = time.perf_counter()
+
+    def now(self):
+        """Returns the current time (after waiting for the queued CUDA operations)."""
+        if self.synchronize:
+            torch.cuda.synchronize()
+        return time.perf_counter()
+
+    def start_stage(self, stage):
+        """Starts a stage of the epoch (e.g., train or valid): the following laps are assigned to it."""
+        self.stage = stage
+        self.times.setdefault(stage, OrderedDict())
+        self.n_samples.setdefault(stage, 0)
+        self.last_time = self.now()
+
+    def lap(self, name):
+        """Adds the time elapsed since the previous lap to the lap name of the current stage."""
+        current_time = self.now()
+        times = self.times[self.stage]
+        times[name] = times.get(name, 0.0) + current_time - self.last_time
+        self.last_time = current_time
+
+    def add_samples(self, n_samples):
+        """Counts the examples processed in the current stage."""
+        self.n_samples[self.stage] += n_samples
+
+    def get_stats(self):
+        """Returns the times (s) of the laps of each stage, with their total and the examples processed per second."""
+        stats = OrderedDict()
+        for stage, times in self.times.items():
+            stats[stage] = OrderedDict(times)
+            stats[stage]["total"] = sum(times.values())
+            stats[stage]["samples/s"] = (
+                self.n_samples[stage] / stats[stage]["total"]
+                if stats[stage]["total"] > 0
+                else 0.0
+            )
+        return stats
+
+    def write(self, path, **meta):
+        """Appends the stats of the epoch (with meta, e.g. the epoch) as a line of a JSONL file."""
+        with open(path, "a") as fout:
+            fout.write(json.dumps(dict(meta, **self.get_stats())) + "\n")
@@ -0,0 +1,139 @@
+"""
+Pool of prepared subjects for MOABB datasets.
+
+The pool loads each subject of a dataset once per process and keeps it available for all the folds computed in the
+same process (e.g., all target subjects of a leave-one-subject-out cross-validation).
+With the 'npy' cache format, EEG signals are memory-mapped: their pages are shared through the operating system page
+cache among all the processes reading the same cache, so concurrent fold processes do not duplicate the dataset, and
+memory-mapped subjects are always kept in the pool. Subjects whose signals are resident in memory (e.g., with the
+'pkl' cache format or when band-passed from a wide-band cache) are kept with a least-recently-used policy, up to
+max_resident subjects per pool, so that the memory of a process stays bounded on large datasets. While a fold is
+assembled, its subjects are pinned (see SubjectPool.pinned): they are not evicted, so that each subject is prepared
+once per fold whatever max_resident.
+The pool is per-process only: resident subjects are not shared among processes (there is no shared-memory path), the
+only sharing among processes is the one of the page cache for memory-mapped subjects.
+Training and validation sets are assembled by gathering the selected examples of each subject directly into a single
+preallocated buffer, without intermediate copies.
+"""
+
+from collections import OrderedDict
+from contextlib import contextmanager
+import numpy as np
+from utils.prepare import prepare_data
+
+# Pools created in the current process (keys: preparation parameters), the least recently used ones are dropped
+subject_pools = OrderedDict()
+
+# Maximum number of pools kept in the current process (e.g., for trainings with different bands in the same process)
+max_subject_pools = 2
+
+
+class SubjectPool(object):
+    """Pool of prepared subjects of a MOABB dataset.
+
+    Arguments
+    ---------
+    max_resident: int
+        Maximum number of subjects with signals resident in memory (i.e., not memory-mapped) kept in the pool.
+        Memory-mapped subjects are not counted.
+    prepare_kwargs: dict
+        Keyword arguments passed to prepare_data (except idx_subject_to_prepare).
+    """
+
+    def __init__(self, max_resident=4, **prepare_kwargs):
+        self.max_resident = max_resident
+        self.prepare_kwargs = prepare_kwargs
+        self.mapped = {}
+        self.resident = OrderedDict()
+        self.n_pins = 0
+
+    def __len__(self):
+        return len(self.mapped) + len(self.resident)
+
+    def get(self, subject_idx):
+        """Returns the dictionary of a subject (index in the subject list), preparing or loading it if it is not in
+        the pool."""
+        if subject_idx in self.mapped:
+            return self.mapped[subject_idx]
+        if subject_idx in self.resident:
+            self.resident.move_to_end(subject_idx)
+            return self.resident[subject_idx]
+        data_dict = prepare_data(
+            idx_subject_to_prepare=subject_idx, **self.prepare_kwargs
+        )
+        if isinstance(data_dict["x"], np.memmap):
+            self.mapped[subject_idx] = data_dict
+        elif self.max_resident > 0 or self.n_pins > 0:
+            self.resident[subject_idx] = data_dict
+            self.evict()
+        return data_dict
+
+    def evict(self):
+        """Drops the least recently used resident subjects beyond max_resident (unless the pool is pinned)."""
+        if self.n_pins > 0:
+            return
+        while len(self.resident) > self.max_resident:
+            self.resident.popitem(last=False)
+
+    @contextmanager
+    def pinned(self):
+        """Context manager suspending the eviction of resident subjects, e.g. while the subjects of a fold are
+        assembled: all subjects obtained in the context are kept until its end (the pool may thus hold more than
+        max_resident subjects), and then evicted down to max_resident."""
+        self.n_pins += 1
+        try:
+            yield self
+        finally:
+            self.n_pins -= 1
+            self.evict()
+
+    def gather(self, subject_indices):
+        """Returns EEG signals and labels of the selected examples of multiple subjects.
+        Examples are gathered into a single preallocated array.
+
+        Arguments
+        ---------
+        subject_indices: list
+            List of (subject index, example indices) pairs.
+
+        Returns
+        ---------
+        x: np.ndarray
+            EEG signals of the selected examples (N_examples, C, T).
+        y: np.ndarray
+            Labels of the selected examples (N_examples).
+        """
+        n_examples = sum([len(idx) for _, idx in subject_indices])
+        data_dict = self.get(subject_indices[0][0])
+        x = np.empty(
+            (n_examples,) + data_dict["x"].shape[1:], dtype=data_dict["x"].dtype
+        )
+        y = np.empty(n_examples, dtype=data_dict["y"].dtype)
+        start = 0
+        for subject_idx, idx in subject_indices:
+            data_dict = self.get(subject_idx)
+            stop = start + len(idx)
+            np.take(data_dict["x"], idx, axis=0, out=x[start:stop])
+            y[start:stop] = data_dict["y"][idx]
+            start = stop
+        return x, y
+
+
+def get_subject_pool(**prepare_kwargs):
+    """This function returns the pool of subjects prepared with the given parameters, creating it if needed.
+    At most max_subject_pools pools are kept in the process (least-recently-used policy)."""
+    key = repr(
+        sorted(
+            [
+                (k, v.code if k == "dataset" else v)
+                for k, v in prepare_kwargs.items()
+            ]
+        )
+    )
+    if key in subject_pools:
+        subject_pools.move_to_end(key)
+    else:
+        subject_pools[key] = SubjectPool(**prepare_kwargs)
+        while len(subject_pools) > max_subject_pools:
+            subject_pools.popitem(last=False)
+    return subject_pools[key]
@@ -0,0 +1,16 @@
+"""Unit tests of the MOABB benchmark (run from the root of the repository with: pytest tests/unittests/MOABB).
+
+The modules of the benchmark are imported as in its scripts (e.g., from utils.prepare import prepare_data).
+"""
+import os
+import sys
+
+MOABB_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    os.pardir,
+    os.pardir,
+    os.pardir,
+    "benchmarks",
+    "MOABB",
+)
+sys.path.insert(0, os.path.abspath(MOABB_DIR))
@@ -0,0 +1,140 @@
+"""Tests of the batched augmenter (utils/augmentation.py) against speechbrain's Augmenter."""
+import random
+import pytest
+import torch
+from scipy.stats import ks_2samp
+from speechbrain.processing.augmentation import Augmenter
+from speechbrain.processing.speech_augmentation import (
+    AddNoise,
+    CutCat,
+    RandAmp,
+    RandomShift,
+)
+from utils.augmentation import EEGAugmenter
+
+N_CALLS = 300
+
+
+def create_augmenters(repeat_augment=1, **augmentations):
+    """Returns the reference Augmenter (configured as in the hparam files) and the EEGAugmenter of the augmentations."""
+    augmenter = Augmenter(
+        parallel_augment=True,
+        concat_original=True,
+        parallel_augment_fixed_bs=True,
+        repeat_augment=repeat_augment,
+        shuffle_augmentations=True,
+        min_augmentations=len(augmentations),
+        max_augmentations=len(augmentations),
+        **augmentations,
+    )
+    eeg_augmenter = EEGAugmenter(
+        repeat_augment=repeat_augment, seed=0, **augmentations
+    )
+    return augmenter, eeg_augmenter
+
+
+def augment(augmenter, x, n_calls=N_CALLS):
+    """Returns the augmented copies (without the original trials) of n_calls augmentations of x."""
+    torch.manual_seed(0)
+    random.seed(0)
+    lengths = torch.ones(x.shape[0])
+    outputs = []
+    for _ in range(n_calls):
+        output, _ = augmenter(x, lengths=lengths)
+        assert torch.equal(output[: x.shape[0]], x)
+        outputs.append(output[x.shape[0] :].clone())
+    return torch.cat(outputs).view(-1, *x.shape)
+
+
+def residuals(copies, x):
+    """Returns the relative norm of the change of each augmented trial."""
+    return ((copies - x).norm(dim=(2, 3)) / x.norm(dim=(1, 2))).view(-1)
+
+
+@pytest.fixture
+def x():
+    torch.manual_seed(1)
+    return torch.randn(8, 60, 3)
+
+
+def test_time_shift_per_slice(x):
+    shifts = []
+    for augmenter in create_augmenters(time_shift=RandomShift(-5, 5, dim=1)):
+        copy_shifts = []
+        for copy in augment(augmenter, x):
+            # the trials of the slice are shifted by the same number of samples
+            matches = [
+                s
+                for s in range(-5, 6)
+                if torch.equal(copy, torch.roll(x, s, dims=1))
+            ]
+            assert len(matches) == 1
+            copy_shifts.append(matches[0])
+        shifts.append(copy_shifts)
+    assert ks_2samp(*shifts).pvalue > 0.01
+
+
+def test_cutcat_per_slice(x):
+    # outputs of CutCat for each number of segments (the slice is the whole batch)
+    candidates = {n: CutCat(n, n)(x) for n in range(2, 7)}
+    n_segments = []
+    for augmenter in create_augmenters(cutcat=CutCat(2, 6)):
+        copy_segments = []
+        for copy in augment(augmenter, x):
+            matches = [
+                n
+                for n, output in candidates.items()
+                if torch.equal(copy, output)
+            ]
+            assert len(matches) == 1
+            copy_segments.append(matches[0])
+        n_segments.append(copy_segments)
+    assert ks_2samp(*n_segments).pvalue > 0.01
+
+
+def test_rand_amp(x):
+    gains = []
+    for augmenter in create_augmenters(rand_amp=RandAmp(0.5, 1.5)):
+        copies = augment(augmenter, x)
+        gains.append((copies[:, :, 0, 0] / x[:, 0, 0]).view(-1))
+        assert torch.allclose(
+            copies, gains[-1].view(-1, 8, 1, 1) * x, atol=1e-5
+        )
+    assert ks_2samp(gains[0].numpy(), gains[1].numpy()).pvalue > 0.01
+
+
+def test_add_noise_mix_prob_and_normalize(x):
+    # large trials, so that AddNoise normalizes them
+    x = 5 * x
+    stats = []
+    for augmenter in create_augmenters(
+        augment_noise=AddNoise(
+            snr_low=0, snr_high=10, mix_prob=0.5, normalize=True
+        )
+    ):
+        copies = augment(augmenter, x)
+        mixed = (copies != x).view(N_CALLS, -1).any(dim=1)
+        # the noise is added to the whole slice, with probability mix_prob
+        assert torch.equal(
+            mixed, (copies != x).view(N_CALLS, 8, -1).any(dim=2).all(dim=1)
+        )
+        assert 0.4 < mixed.float().mean() < 0.6
+        # normalized noisy trials (maximum amplitude of each channel at most 1)
+        assert copies[mixed].abs().amax(dim=2).max() <= 1.0 + 1e-6
+        stats.append(residuals(copies[mixed], x).numpy())
+    assert ks_2samp(*stats).pvalue > 0.01
+
+
+def test_augmenter_distribution(x):
+    augmentations = {
+        "cutcat": CutCat(2, 3),
+        "rand_amp": RandAmp(0.8, 1.2),
+        "time_shift": RandomShift(-5, 5, dim=1),
+        "augment_noise": AddNoise(snr_low=5, snr_high=20),
+    }
+    stats = []
+    for augmenter in create_augmenters(repeat_augment=2, **augmentations):
+        copies = augment(augmenter, x, n_calls=N_CALLS // 2)
+        assert copies.shape == (N_CALLS, 8, 60, 3)
+        stats.append(residuals(copies, x).numpy())
+    assert ks_2samp(*stats).pvalue > 0.01
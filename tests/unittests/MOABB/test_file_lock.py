@@ -0,0 +1,91 @@
+"""Tests of the inter-process file locks (utils/file_lock.py) and of the single-flight preparation of subjects."""
+import multiprocessing
+import os
+import time
+import numpy as np
+import pytest
+import utils.prepare as prepare
+from utils.file_lock import FileLock, fcntl
+
+pytestmark = pytest.mark.skipif(
+    fcntl is None, reason="file locks are no-ops without fcntl"
+)
+
+
+def test_exclusive_lock(tmp_path):
+    lock_fpath = str(tmp_path / "locks" / "sub-001.lock")
+    with FileLock(lock_fpath):
+        assert os.path.isfile(lock_fpath)
+        assert not FileLock(lock_fpath, blocking=False).acquire()
+    lock = FileLock(lock_fpath, blocking=False)
+    assert lock.acquire()
+    lock.release()
+    # release is idempotent
+    lock.release()
+
+
+def hold_lock(lock_fpath, acquired, release):
+    with FileLock(lock_fpath):
+        acquired.set()
+        release.wait(10)
+
+
+def test_lock_between_processes(tmp_path):
+    lock_fpath = str(tmp_path / "sub-001.lock")
+    ctx = multiprocessing.get_context("fork")
+    acquired, release = ctx.Event(), ctx.Event()
+    holder = ctx.Process(target=hold_lock, args=(lock_fpath, acquired, release))
+    holder.start()
+    try:
+        assert acquired.wait(10)
+        assert not FileLock(lock_fpath, blocking=False).acquire()
+    finally:
+        release.set()
+        holder.join(10)
+    # the lock is released when the holder exits
+    assert FileLock(lock_fpath, blocking=False).acquire()
+
+
+def get_output_dict(dataset, subject, *args, **kwargs):
+    """Slow preparation of a subject, recording each call in the calls file of the dataset."""
+    with open(dataset, "a") as handle:
+        handle.write("{0}\n".format(os.getpid()))
+    time.sleep(0.5)
+    return {
+        "x": np.full((4, 3, 20), subject, dtype="float32"),
+        "y": np.arange(4),
+        "channels": ["C3", "Cz", "C4"],
+    }
+
+
+def prepare_subject(args):
+    calls_fpath, output_dir = args
+    output_dict = prepare.prepare_subject(
+        dataset=calls_fpath,
+        subject=1,
+        output_dir=output_dir,
+        events_to_load=None,
+        srate_in=128,
+        srate_out=128,
+        fmin=1,
+        fmax=40,
+    )
+    return float(np.sum(output_dict["x"]))
+
+
+def test_single_flight_preparation(tmp_path, monkeypatch):
+    monkeypatch.setattr(prepare, "get_output_dict", get_output_dict)
+    calls_fpath = str(tmp_path / "calls.txt")
+    output_dir = str(tmp_path / "MOABB_pickled" / "Fake")
+    os.makedirs(output_dir)
+    # concurrent processes preparing the same subject (the function is inherited by the forked processes)
+    with multiprocessing.get_context("fork").Pool(4) as pool:
+        sums = pool.map(prepare_subject, [(calls_fpath, output_dir)] * 4)
+    # the subject is prepared once, the other processes load the saved cache
+    with open(calls_fpath) as handle:
+        assert len(handle.read().splitlines()) == 1
+    assert sums == [4 * 3 * 20.0] * 4
+    assert (
+        prepare.find_cached_output_dict(os.path.join(output_dir, "sub-001.pkl"))
+        == "npy"
+    )
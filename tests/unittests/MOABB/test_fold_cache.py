@@ -0,0 +1,206 @@
+"""Tests of the cache of pre-processed folds (utils/fold_cache.py and its use in utils/dataio_iterators.py)."""
+import os
+import numpy as np
+import pytest
+import torch
+import utils.fold_cache as fold_cache
+from utils.dataio_iterators import LeaveOneSessionOut
+from utils.fold_cache import (
+    fold_dtype,
+    get_fold_dir,
+    get_fold_key,
+    load_fold,
+    load_or_prepare_fold,
+    save_fold,
+)
+
+FOLD_PARAMS = {
+    "iterator": "leave-one-session-out",
+    "dataset": "Fake",
+    "subject": 1,
+    "session": 0,
+    "events_to_load": None,
+    "srate_in": 128,
+    "srate_out": 128,
+    "fmin": 1,
+    "fmax": 40,
+    "wideband": None,
+    "valid_ratio": 0.2,
+    "tmin": 0.0,
+    "tmax": 4.0,
+    "n_steps_channel_selection": None,
+    "dtype": "float16",
+    "fold_dtype": fold_dtype,
+}
+
+CHANGED_PARAMS = {
+    "iterator": "leave-one-subject-out",
+    "dataset": "Other",
+    "subject": 2,
+    "session": 1,
+    "events_to_load": ["left_hand"],
+    "srate_in": 256,
+    "srate_out": 64,
+    "fmin": 4,
+    "fmax": 38,
+    "wideband": [0.5, 45],
+    "valid_ratio": 0.1,
+    "tmin": 0.5,
+    "tmax": 3.5,
+    "n_steps_channel_selection": 2,
+    "dtype": "float32",
+    "fold_dtype": "float16",
+}
+
+
+def make_fold(dtype="float16"):
+    rng = np.random.RandomState(0)
+    fold = {"info": {"session": "ses-01"}}
+    for split, n in [("train", 8), ("valid", 2), ("test", 4)]:
+        fold["x_" + split] = rng.randn(n, 50, 3, 1).astype(dtype)
+        fold["y_" + split] = rng.randint(0, 2, n)
+        fold["idx_" + split] = np.arange(n)
+    return fold
+
+
+def test_fold_key_is_deterministic():
+    reordered = dict(reversed(list(FOLD_PARAMS.items())))
+    assert get_fold_key(reordered) == get_fold_key(dict(FOLD_PARAMS))
+
+
+@pytest.mark.parametrize("key", sorted(CHANGED_PARAMS.keys()))
+def test_fold_key_changes_with_params(key):
+    assert CHANGED_PARAMS[key] != FOLD_PARAMS[key]
+    fold_params = dict(FOLD_PARAMS, **{key: CHANGED_PARAMS[key]})
+    assert get_fold_key(fold_params) != get_fold_key(FOLD_PARAMS)
+
+
+def test_save_load_model_ready(tmp_path):
+    fold_dir = get_fold_dir(str(tmp_path), "Fake", FOLD_PARAMS)
+    assert load_fold(fold_dir) is None
+    fold = make_fold()
+    save_fold(fold_dir, fold, FOLD_PARAMS)
+    cached = load_fold(fold_dir)
+    assert cached["info"] == fold["info"]
+    for key in ["x_train", "x_valid", "x_test"]:
+        # EEG signals are stored model-ready (fold_dtype)
+        assert cached[key].dtype == np.dtype(fold_dtype)
+        np.testing.assert_array_equal(cached[key], fold[key])
+    for key in ["y_train", "y_valid", "y_test", "idx_train", "idx_test"]:
+        np.testing.assert_array_equal(cached[key], fold[key])
+    assert os.listdir(os.path.dirname(fold_dir)) == [os.path.basename(fold_dir)]
+
+
+class FakeDataset(object):
+    code = "Fake"
+    subject_list = [1, 2, 3]
+
+
+@pytest.fixture
+def prepared_folds(monkeypatch):
+    """Replaces the pre-processing of folds, recording the parameters of each computed fold."""
+    prepared_folds = []
+
+    def _prepare_fold(self, **kwargs):
+        prepared_folds.append(kwargs)
+        return make_fold(kwargs["storage_dtype"])
+
+    monkeypatch.setattr(LeaveOneSessionOut, "_prepare_fold", _prepare_fold)
+    return prepared_folds
+
+
+def prepare(cached_data_folder, **kwargs):
+    fold_kwargs = dict(
+        data_folder=cached_data_folder,
+        cached_data_folder=cached_data_folder,
+        dataset=FakeDataset(),
+        batch_size=4,
+        valid_ratio=0.2,
+        target_subject_idx=0,
+        target_session_idx=0,
+        original_sample_rate=128,
+        sample_rate=128,
+        fmin=1,
+        fmax=40,
+        tmin=0.0,
+        tmax=4.0,
+        save_prepared_folds=True,
+        storage_dtype="float16",
+    )
+    fold_kwargs.update(kwargs)
+    return LeaveOneSessionOut(seed=1).prepare(**fold_kwargs)
+
+
+def test_fold_params_cover_iterator(tmp_path, prepared_folds, monkeypatch):
+    # the parameters of the tests are the ones hashed by the iterator
+    hashed_params = []
+
+    def get_fold_dir_spy(cached_data_folder, dataset_code, fold_params):
+        hashed_params.append(fold_params)
+        return get_fold_dir(cached_data_folder, dataset_code, fold_params)
+
+    monkeypatch.setattr(fold_cache, "get_fold_dir", get_fold_dir_spy)
+    prepare(str(tmp_path))
+    assert set(hashed_params[0].keys()) == set(FOLD_PARAMS.keys())
+    assert set(CHANGED_PARAMS.keys()) == set(FOLD_PARAMS.keys())
+
+
+def test_iterator_reuses_cached_fold(tmp_path, prepared_folds):
+    tail_path, datasets = prepare(str(tmp_path))
+    assert len(prepared_folds) == 1
+    # same parameters (e.g., another seed): the cached fold is used
+    tail_path_cached, datasets_cached = prepare(str(tmp_path))
+    assert len(prepared_folds) == 1
+    assert tail_path_cached == tail_path
+    # computed and cached folds are model-ready
+    for fold_datasets in [datasets, datasets_cached]:
+        x, y = next(iter(fold_datasets["test"]))
+        assert x.dtype == torch.float32
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {"fmin": 4},
+        {"fmax": 38},
+        {"valid_ratio": 0.1},
+        {"tmin": 0.5},
+        {"target_subject_idx": 1},
+        {"target_session_idx": 1},
+        {"n_steps_channel_selection": 2},
+        {"wideband": [0.5, 45]},
+        {"storage_dtype": "float32"},
+    ],
+)
+def test_iterator_invalidates_cached_fold(tmp_path, prepared_folds, kwargs):
+    prepare(str(tmp_path))
+    prepare(str(tmp_path), **kwargs)
+    assert len(prepared_folds) == 2
+    folds_dir = os.path.join(str(tmp_path), "MOABB_folds", "Fake")
+    assert len(os.listdir(folds_dir)) == 2
+
+
+def test_load_or_prepare_fold(tmp_path):
+    calls = []
+
+    def prepare_fn():
+        calls.append(1)
+        return make_fold("float16")
+
+    # without the cache, the fold is computed each time and returned as it is
+    fold = load_or_prepare_fold(
+        str(tmp_path),
+        "Fake",
+        FOLD_PARAMS,
+        prepare_fn,
+        save_prepared_folds=False,
+    )
+    assert len(calls) == 1 and fold["x_train"].dtype == np.float16
+    assert not os.path.isdir(str(tmp_path / "MOABB_folds"))
+    # with the cache, the fold is computed once, then loaded (model-ready in both cases)
+    for _ in range(2):
+        fold = load_or_prepare_fold(
+            str(tmp_path), "Fake", FOLD_PARAMS, prepare_fn
+        )
+        assert fold["x_train"].dtype == np.dtype(fold_dtype)
+    assert len(calls) == 2
@@ -0,0 +1,121 @@
+"""Tests of the cache of prepared subjects (utils/prepare.py): npy and pkl formats and legacy pkl fallback."""
+import os
+import numpy as np
+import pytest
+import utils.prepare as prepare
+
+
+def make_output_dict(dtype="float32"):
+    rng = np.random.RandomState(0)
+    return {
+        "x": rng.randn(6, 4, 50).astype(dtype),
+        "y": np.array([0, 1, 0, 1, 1, 0]),
+        "events": ["left_hand", "right_hand"],
+        "channels": ["C3", "Cz", "C4", "Pz"],
+        "srate": 128,
+    }
+
+
+def check_output_dict(output_dict, reference):
+    assert set(output_dict.keys()) == set(reference.keys())
+    np.testing.assert_array_equal(output_dict["x"], reference["x"])
+    np.testing.assert_array_equal(output_dict["y"], reference["y"])
+    assert output_dict["x"].dtype == reference["x"].dtype
+    for key in ["events", "channels", "srate"]:
+        assert output_dict[key] == reference[key]
+
+
+@pytest.mark.parametrize("cache_format", ["npy", "pkl"])
+def test_round_trip(tmp_path, cache_format):
+    fpath = str(tmp_path / "sub-001.pkl")
+    reference = make_output_dict()
+    assert prepare.find_cached_output_dict(fpath, cache_format) is None
+    prepare.save_output_dict(reference, fpath, cache_format=cache_format)
+    assert prepare.find_cached_output_dict(fpath, cache_format) == cache_format
+    output_dict = prepare.load_output_dict(fpath, cache_format=cache_format)
+    check_output_dict(output_dict, reference)
+    # EEG signals of npy caches are memory-mapped (read-only)
+    assert isinstance(output_dict["x"], np.memmap) == (cache_format == "npy")
+    # no temporary files are left
+    assert all([".tmp-" not in fname for fname in os.listdir(tmp_path)])
+
+
+def test_unknown_format(tmp_path):
+    fpath = str(tmp_path / "sub-001.pkl")
+    with pytest.raises(ValueError):
+        prepare.save_output_dict(make_output_dict(), fpath, cache_format="h5")
+    with pytest.raises(ValueError):
+        prepare.load_output_dict(fpath, cache_format="h5")
+
+
+def test_incomplete_npy_cache(tmp_path):
+    fpath = str(tmp_path / "sub-001.pkl")
+    # a directory without info.pkl (e.g., an interrupted copy) is not a cache, and is replaced when saving
+    os.makedirs(str(tmp_path / "sub-001"))
+    np.save(str(tmp_path / "sub-001" / "x.npy"), np.zeros(3))
+    assert prepare.find_cached_output_dict(fpath, "npy") is None
+    reference = make_output_dict()
+    prepare.save_output_dict(reference, fpath, cache_format="npy")
+    check_output_dict(prepare.load_output_dict(fpath, "npy"), reference)
+
+
+def prepare_cached_subject(output_dir, **kwargs):
+    """Prepares subject 1 from the cache only (the dataset is never read)."""
+    return prepare.prepare_subject(
+        dataset=None,
+        subject=1,
+        output_dir=output_dir,
+        events_to_load=None,
+        srate_in=128,
+        srate_out=128,
+        fmin=1,
+        fmax=40,
+        **kwargs,
+    )
+
+
+@pytest.fixture
+def no_dataset(monkeypatch):
+    def get_output_dict(*args, **kwargs):
+        raise AssertionError("the subject should be loaded from the cache")
+
+    monkeypatch.setattr(prepare, "get_output_dict", get_output_dict)
+
+
+def test_legacy_pkl_fallback(tmp_path, no_dataset):
+    output_dir = str(tmp_path)
+    fpath = os.path.join(output_dir, "sub-001.pkl")
+    reference = make_output_dict()
+    prepare.save_output_dict(reference, fpath, cache_format="pkl")
+    # a legacy pkl cache is found when the npy format is requested
+    assert prepare.find_cached_output_dict(fpath, "npy") == "pkl"
+
+    # without saving, the pkl cache is used as it is
+    output_dict = prepare_cached_subject(
+        output_dir, save_prepared_dataset=False, cache_format="npy"
+    )
+    check_output_dict(output_dict, reference)
+    assert not os.path.isdir(os.path.join(output_dir, "sub-001"))
+
+    # with saving, it is converted to the npy format (and then loaded memory-mapped)
+    output_dict = prepare_cached_subject(output_dir, cache_format="npy")
+    check_output_dict(output_dict, reference)
+    assert prepare.find_cached_output_dict(fpath, "npy") == "npy"
+    output_dict = prepare_cached_subject(output_dir, cache_format="npy")
+    check_output_dict(output_dict, reference)
+    assert isinstance(output_dict["x"], np.memmap)
+
+
+def test_storage_dtype_cast(tmp_path, no_dataset):
+    output_dir = str(tmp_path)
+    reference = make_output_dict(dtype="float64")
+    prepare.save_output_dict(
+        reference, os.path.join(output_dir, "sub-001.pkl"), cache_format="npy"
+    )
+    output_dict = prepare_cached_subject(
+        output_dir, save_prepared_dataset=False, storage_dtype="float16"
+    )
+    assert output_dict["x"].dtype == np.float16
+    np.testing.assert_allclose(
+        output_dict["x"], reference["x"], rtol=1e-3, atol=1e-3
+    )
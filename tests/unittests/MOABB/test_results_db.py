@@ -0,0 +1,142 @@
+"""Tests of the results database (utils/results_db.py)."""
+import json
+import sqlite3
+import numpy as np
+import pytest
+from utils.results_db import FOLD_KEYS, append_fold, connect, query_metrics
+
+
+def make_fold(**kwargs):
+    fold = {
+        "dataset": "BNCI2014001",
+        "model": "EEGNet",
+        "iterator": "leave-one-session-out",
+        "subject": 1,
+        "session": 0,
+        "seed": 1986,
+        "trial": None,
+    }
+    fold.update(kwargs)
+    return fold
+
+
+def make_eval_stats(acc):
+    return {
+        "test": {"loss": 0.5, "acc": acc, "cm": np.array([[3, 1], [0, 4]])},
+        "valid": {"loss": 0.4, "acc": acc + 0.1},
+    }
+
+
+def test_schema(tmp_path):
+    db_path = str(tmp_path / "results" / "results.db")
+    conn = connect(db_path)
+    # connecting again keeps the existing tables
+    connect(db_path).close()
+    tables = {
+        name: [
+            row[1]
+            for row in conn.execute("PRAGMA table_info({0})".format(name))
+        ]
+        for name in ["folds", "metrics", "confusion_matrices"]
+    }
+    indexes = [
+        row[0]
+        for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index'"
+        )
+    ]
+    conn.close()
+    assert tables["folds"] == ["id"] + FOLD_KEYS + [
+        "exp_dir",
+        "train_time",
+        "hparams",
+        "created",
+    ]
+    assert tables["metrics"] == ["fold_id", "split", "name", "value"]
+    assert tables["confusion_matrices"] == ["fold_id", "split", "matrix"]
+    for index in ["folds_idx", "folds_trial_idx", "metrics_idx"]:
+        assert index in indexes
+
+
+def test_append_fold(tmp_path):
+    db_path = str(tmp_path / "results.db")
+    hparams = {
+        "lr": 0.001,
+        "number_of_epochs": 10,
+        "events": ["left_hand", "right_hand"],
+        "model": object(),
+    }
+    fold_id = append_fold(
+        db_path,
+        # numpy scalars (e.g., subject ids from the dataset metadata) are stored as numbers
+        make_fold(subject=np.int64(7), trial="a1b2c3"),
+        make_eval_stats(0.75),
+        train_time=12.5,
+        hparams=hparams,
+        exp_dir="results/run1",
+    )
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    fold = dict(conn.execute("SELECT * FROM folds").fetchone())
+    metrics = conn.execute(
+        "SELECT split, name, value FROM metrics WHERE fold_id = ? ORDER BY split, name",
+        (fold_id,),
+    ).fetchall()
+    matrices = conn.execute(
+        "SELECT split, matrix FROM confusion_matrices"
+    ).fetchall()
+    conn.close()
+
+    assert fold["id"] == fold_id
+    assert fold["subject"] == 7 and fold["trial"] == "a1b2c3"
+    assert fold["train_time"] == 12.5 and fold["exp_dir"] == "results/run1"
+    # only the hparams that can be stored as JSON are stored
+    assert json.loads(fold["hparams"]) == {
+        "lr": 0.001,
+        "number_of_epochs": 10,
+        "events": ["left_hand", "right_hand"],
+    }
+    assert [tuple(row) for row in metrics] == [
+        ("test", "acc", 0.75),
+        ("test", "loss", 0.5),
+        ("valid", "acc", pytest.approx(0.85)),
+        ("valid", "loss", 0.4),
+    ]
+    assert [(row[0], json.loads(row[1])) for row in matrices] == [
+        ("test", [[3, 1], [0, 4]])
+    ]
+
+
+def test_query_metrics(tmp_path):
+    db_path = str(tmp_path / "results.db")
+    for model, accs in [("EEGNet", [0.6, 0.8]), ("ShallowConvNet", [0.7])]:
+        for subject, acc in enumerate(accs, start=1):
+            append_fold(
+                db_path,
+                make_fold(model=model, subject=subject, trial=model[:3]),
+                make_eval_stats(acc),
+            )
+
+    rows = query_metrics(db_path, "acc", group_by=["model"])
+    assert [(row["model"], row["n"]) for row in rows] == [
+        ("EEGNet", 2),
+        ("ShallowConvNet", 1),
+    ]
+    assert rows[0]["mean"] == pytest.approx(0.7)
+    assert rows[0]["std"] == pytest.approx(0.1)
+    assert rows[1]["std"] == pytest.approx(0.0)
+
+    rows = query_metrics(db_path, "acc", split="valid", group_by=[])
+    assert len(rows) == 1 and rows[0]["n"] == 3
+    assert rows[0]["mean"] == pytest.approx(0.8)
+
+    rows = query_metrics(
+        db_path, "acc", group_by=["subject"], where={"trial": "EEG"}
+    )
+    assert [(row["subject"], row["mean"]) for row in rows] == [
+        (1, pytest.approx(0.6)),
+        (2, pytest.approx(0.8)),
+    ]
+    assert query_metrics(db_path, "f1") == []
+    with pytest.raises(ValueError):
+        query_metrics(db_path, "acc", group_by=["fold"])
@@ -0,0 +1,91 @@
+"""Tests of the pool of prepared subjects (utils/subject_pool.py) and of its use in leave-one-subject-out folds."""
+import numpy as np
+import pandas as pd
+import pytest
+import utils.subject_pool as subject_pool
+from utils.dataio_iterators import LeaveOneSubjectOut
+from utils.subject_pool import SubjectPool
+
+
+class FakeDataset(object):
+    code = "Fake"
+    subject_list = [1, 2, 3, 4, 5, 6]
+
+
+@pytest.fixture
+def prepared_subjects(monkeypatch):
+    """Replaces the preparation of subjects (signals resident in memory, as with the 'pkl' format), recording the
+    index of each prepared subject."""
+    prepared_subjects = []
+
+    def prepare_data(idx_subject_to_prepare, **kwargs):
+        prepared_subjects.append(idx_subject_to_prepare)
+        return {
+            "x": np.full((8, 3, 64), idx_subject_to_prepare, dtype="float32"),
+            "y": np.tile([0, 1], 4),
+            "metadata": pd.DataFrame({"session": ["0"] * 4 + ["1"] * 4}),
+            "interval": [0.0, 4.0],
+            "srate": 16,
+            "channels": ["C3", "Cz", "C4"],
+        }
+
+    monkeypatch.setattr(subject_pool, "prepare_data", prepare_data)
+    monkeypatch.setattr(
+        subject_pool, "subject_pools", type(subject_pool.subject_pools)()
+    )
+    return prepared_subjects
+
+
+def test_lru_eviction(prepared_subjects):
+    pool = SubjectPool(max_resident=2)
+    for subject_idx in [0, 1, 0, 2, 0, 1]:
+        pool.get(subject_idx)
+    # subject 1 was evicted by subject 2, subject 0 was kept as recently used
+    assert prepared_subjects == [0, 1, 2, 1]
+    assert list(pool.resident.keys()) == [0, 1]
+
+
+def test_pinned_pool(prepared_subjects):
+    pool = SubjectPool(max_resident=2)
+    with pool.pinned():
+        for _ in range(2):
+            for subject_idx in range(5):
+                pool.get(subject_idx)
+        assert len(pool) == 5
+    # pinned subjects are prepared once, and evicted down to max_resident at the end of the context
+    assert prepared_subjects == list(range(5))
+    assert list(pool.resident.keys()) == [3, 4]
+
+
+def test_subjects_prepared_once_per_fold(prepared_subjects):
+    n_subjects = len(FakeDataset.subject_list)
+    for target_subject_idx in range(2):
+        tail_path, datasets = LeaveOneSubjectOut(seed=1).prepare(
+            data_folder=None,
+            cached_data_folder=None,
+            dataset=FakeDataset(),
+            batch_size=4,
+            valid_ratio=0.5,
+            target_subject_idx=target_subject_idx,
+            target_session_idx=None,
+            original_sample_rate=16,
+            sample_rate=16,
+            fmin=1,
+            fmax=40,
+            tmin=0.0,
+            tmax=4.0,
+            save_prepared_folds=False,
+        )
+        for split in ["train", "valid"]:
+            x, y = next(iter(datasets[split]))
+            assert x.shape[1:] == (64, 3, 1)
+    # more subjects than max_resident: each subject is prepared once in the first fold, the second fold prepares again
+    # the subjects evicted at the end of the first one only
+    max_resident = SubjectPool().max_resident
+    assert n_subjects > max_resident
+    first_fold = prepared_subjects[:n_subjects]
+    assert sorted(first_fold) == list(range(n_subjects))
+    second_fold = prepared_subjects[n_subjects:]
+    assert (
+        len(second_fold) == len(set(second_fold)) == n_subjects - max_resident
+    )